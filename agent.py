@@ -1,17 +1,30 @@
+import asyncio
 from typing import Annotated, TypedDict
 from langgraph.graph import StateGraph, START
 from langgraph.graph.message import add_messages
 from langgraph.prebuilt import ToolNode, tools_condition
 from langgraph.checkpoint.postgres import PostgresSaver
+from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.messages import SystemMessage
+from langchain_core.runnables import RunnableConfig
 
+import config
+import migrations
+import uploads
+import startup_profile
 from tools import get_all_tools
-from database import get_db_pool
+from context_window import ContextWindow
+from model_router import ModelRouter
+from database import get_db_pool, create_async_db_pool
+from async_runner import get_async_runner
 
 # --- Graph State ---
 class State(TypedDict):
     messages: Annotated[list, add_messages]
+    # 滚动摘要：已折叠进摘要的最后一条消息 id 及摘要内容
+    summary: str
+    summary_upto: str
 
 # --- System Prompt ---
 SYSTEM_PROMPT = """你是"幻影科技"公司的智能员工助手。
@@ -21,7 +34,7 @@ SYSTEM_PROMPT = """你是"幻影科技"公司的智能员工助手。
 2. 不要直接复述工具返回的原始内容，而是提炼关键信息。
 3. 回答要友好、简洁、直接。
 4. **格式警告**: 当工具参数需要 JSON 字符串时（如 calendars_info），**必须**确保内部使用双引号 `"` 包裹键和值（例如 `[{"key": "value"}]`），严禁使用单引号 `'`，否则会导致系统崩溃。
-5. **图片生成**: 当用户要求"配图"、"插图"、"画一张图"或提到 Nano Banana 时，请调用 `generate_illustration` 工具。工具成功后会返回确认消息，你只需要简单告诉用户"图片已生成"即可。**重要：不要自己构造任何图片标签如 `![](...)` 或 HTML `<img>` 标签，系统会自动显示图片。**
+5. **图片生成**: 当用户要求"配图"、"插图"、"画一张图"或提到 Nano Banana 时，请调用 `generate_illustration` 工具；需要多张不同的图片时，请调用一次 `generate_illustrations` 并传入全部描述，图片会并发生成。图片在后台生成，工具会立即返回任务已提交的确认消息，你只需要简单告诉用户"图片正在生成，完成后会自动显示"即可。**重要：不要自己构造任何图片标签如 `![](...)` 或 HTML `<img>` 标签，系统会自动显示图片。**
 关于日历工具的使用：
 - **步骤**: 查询日程前，**必须先调用** `get_calendars_info` 获取日历列表。
 - 然后调用 `search_events`，将 `get_calendars_info` 的完整返回值（保持原样，确保双引号）作为 `calendars_info` 参数传入。
@@ -32,34 +45,44 @@ SYSTEM_PROMPT = """你是"幻影科技"公司的智能员工助手。
 - 如果没有日程，回复"您没有找到相关日程"
 """
 
-def get_graph(_version="v6.0"):
-    """初始化图结构"""
-    print(f"🔄 正在初始化 LangGraph... (Version: {_version})")
+def make_context_window(summarizer=None):
+    """按配置创建上下文窗口管理器 (token 预算 + 滚动摘要)"""
+    # 摘要用更快的模型即可
+    if summarizer is None:
+        summarizer = ChatGoogleGenerativeAI(model=config.get_setting("SUMMARY_MODEL", "gemini-2.5-flash"))
+    token_budget = config.get_int_setting("CONTEXT_TOKEN_BUDGET", 32000)
+    return ContextWindow(SYSTEM_PROMPT, summarizer, token_budget)
 
-    # --- 模型 ---
-    # gemini-2.5-pro 更擅长理解复杂指令和工具调用
-    llm = ChatGoogleGenerativeAI(model="gemini-2.5-pro")
+def _model_name(llm):
+    return getattr(llm, "model_name", None) or getattr(llm, "model", None) or type(llm).__name__
 
-    # --- 工具 ---
-    tools = get_all_tools()
-    llm_with_tools = llm.bind_tools(tools)
+def make_model_router(tools, llm=None, fast_llm=None):
+    """按配置创建模型路由 (快速模型 / pro 模型)
 
-    # --- 节点逻辑 ---
-    def chatbot(state: State):
-        messages = state["messages"]
-        # 确保系统提示词在消息列表最前面
-        if not messages or not isinstance(messages[0], SystemMessage):
-            messages = [SystemMessage(content=SYSTEM_PROMPT)] + list(messages)
-        
-        # 🛡️ 防止历史消息过长导致 token 溢出
-        # 保留系统提示词 + 最近 50 条消息
-        MAX_HISTORY = 50
-        if len(messages) > MAX_HISTORY + 1:  # +1 是系统提示词
-            messages = [messages[0]] + list(messages[-(MAX_HISTORY):])
-        
-        return {"messages": [llm_with_tools.invoke(messages)]}
+    注入 llm 时以它作为 pro 模型，只有同时注入 fast_llm 才启用路由；
+    ROUTER_ENABLED=false 时始终使用 pro 模型
+    """
+    pro_name = _model_name(llm) if llm is not None else config.get_setting("PRO_MODEL", "gemini-2.5-pro")
+    fast_name = _model_name(fast_llm) if fast_llm is not None else config.get_setting("FAST_MODEL", "gemini-2.5-flash")
+    if llm is None:
+        # gemini-2.5-pro 更擅长理解复杂指令和工具调用
+        llm = ChatGoogleGenerativeAI(model=pro_name)
+        if config.get_bool_setting("ROUTER_ENABLED", True):
+            # 简单问答、整理单个工具结果交给更快的模型
+            fast_llm = ChatGoogleGenerativeAI(model=fast_name)
 
-    # --- 构建图 ---
+    return ModelRouter(
+        fast=fast_llm.bind_tools(tools) if fast_llm is not None else None,
+        pro=llm.bind_tools(tools),
+        tool_names=[t.name for t in tools],
+        fast_name=fast_name,
+        pro_name=pro_name,
+        # 决策日志默认关闭，需要调整阈值时设置 ROUTER_LOG (如 data/router_decisions.jsonl)
+        log_path=config.get_setting("ROUTER_LOG"),
+    )
+
+def build_graph(chatbot, tools):
+    """构建图结构 (同步 / 异步版本共用同一拓扑)"""
     graph_builder = StateGraph(State)
     graph_builder.add_node("chatbot", chatbot)
     graph_builder.add_node("tools", ToolNode(tools=tools))
@@ -67,16 +90,95 @@ def get_graph(_version="v6.0"):
     graph_builder.add_edge(START, "chatbot")
     graph_builder.add_conditional_edges("chatbot", tools_condition)
     graph_builder.add_edge("tools", "chatbot")
+    return graph_builder
+
+def get_graph(_version="v6.0", llm=None, tools=None, checkpointer=None, summarizer=None, fast_llm=None):
+    """初始化图结构
+
+    llm / fast_llm / tools / checkpointer / summarizer 可注入替身 (基准测试、压测)；
+    未指定 checkpointer 时使用 Postgres 并执行迁移
+    """
+    print(f"🔄 正在初始化 LangGraph... (Version: {_version})")
+
+    # --- 工具 ---
+    if tools is None:
+        tools = get_all_tools()
+
+    # --- 模型 (按每一步的特征在快速模型与 pro 模型之间路由) ---
+    router = make_model_router(tools, llm, fast_llm)
+
+    # --- 上下文窗口 (按 token 预算裁剪，较早的消息折叠为摘要) ---
+    context_window = make_context_window(summarizer)
+
+    # --- 节点逻辑 ---
+    def chatbot(state: State, config: RunnableConfig):
+        messages, update = context_window.build(state)
+        # 上传图片在 State 中只保存引用，发送前才读取内容
+        messages = uploads.resolve_references(messages)
+        return {"messages": [router.invoke(messages, config)], **update}
+
+    # --- 构建图 ---
+    graph_builder = build_graph(chatbot, tools)
 
     # 编译图 (带 Postgres 记忆)
-    pool = get_db_pool()
-    checkpointer = PostgresSaver(pool)
+    if checkpointer is None:
+        pool = get_db_pool()
+        checkpointer = PostgresSaver(pool)
+        
+        try:
+            # checkpoint 表由迁移统一创建，进程内只执行一次
+            with startup_profile.timed("graph:migrations"):
+                migrations.ensure_schema()
+        except Exception as e:
+            print(f"Warning: Failed to run migrations: {e}")
     
+    graph = graph_builder.compile(checkpointer=checkpointer)
+    startup_profile.print_report()
+    return graph
+
+# 异步 checkpointer 在共享事件循环中只创建一次 (工具加载完成后重建 Graph 时复用同一个连接池)
+_async_checkpointer = None
+_async_checkpointer_lock = asyncio.Lock()
+
+async def get_async_checkpointer():
+    global _async_checkpointer
+    async with _async_checkpointer_lock:
+        if _async_checkpointer is None:
+            pool = await create_async_db_pool()
+            _async_checkpointer = AsyncPostgresSaver(pool)
+    return _async_checkpointer
+
+async def build_async_graph(_version="v6.0"):
+    """初始化异步图结构 (必须在 async_runner 的事件循环中执行)"""
+    print(f"🔄 正在初始化 LangGraph (async)... (Version: {_version})")
+
+    tools = get_all_tools()
+    router = make_model_router(tools)
+
+    context_window = make_context_window()
+
+    # 异步节点：等待模型响应时不占用线程
+    async def chatbot(state: State, config: RunnableConfig):
+        messages, update = await context_window.abuild(state)
+        messages = await asyncio.to_thread(uploads.resolve_references, messages)
+        return {"messages": [await router.ainvoke(messages, config)], **update}
+
+    # ToolNode 在异步图中走 ainvoke，同步工具会自动放到线程池执行
+    graph_builder = build_graph(chatbot, tools)
+
+    # 编译图 (带 Async Postgres 记忆)
+    checkpointer = await get_async_checkpointer()
+
     try:
-        # 首次运行时创建必要的表 (如果不存在)
-        checkpointer.setup()
+        # 迁移走同步连接池，放到线程中执行避免阻塞事件循环
+        await asyncio.to_thread(migrations.ensure_schema)
     except Exception as e:
-        print(f"Warning: Failed to setup Postgres checkpointer: {e}")
-    
+        print(f"Warning: Failed to run migrations: {e}")
+
     graph = graph_builder.compile(checkpointer=checkpointer)
+    startup_profile.print_report()
     return graph
+
+def get_async_graph(_version="v6.0"):
+    """在共享事件循环中构建异步图"""
+    return get_async_runner().run(build_async_graph(_version))
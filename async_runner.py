@@ -0,0 +1,56 @@
+import asyncio
+import queue
+import threading
+import streamlit as st
+
+# 🔁 共享事件循环（所有 Streamlit 会话把异步任务提交到同一个后台 loop）
+# 这样一个进程可以同时服务多个会话的 LLM 调用，而不必每个请求占用一个线程
+_DONE = object()
+
+class AsyncRunner:
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self._run_loop, name="async-runner", daemon=True)
+        self.thread.start()
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def submit(self, coro):
+        """提交协程，返回 concurrent.futures.Future"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro, timeout=None):
+        """提交协程并在当前线程等待结果"""
+        return self.submit(coro).result(timeout)
+
+    def iterate(self, agen):
+        """把异步生成器桥接为同步迭代器（供 Streamlit 脚本线程逐条消费）"""
+        items = queue.Queue()
+
+        async def pump():
+            try:
+                async for item in agen:
+                    items.put((item, None))
+            except BaseException as e:
+                items.put((None, e))
+            else:
+                items.put((_DONE, None))
+
+        future = self.submit(pump())
+        try:
+            while True:
+                item, error = items.get()
+                if error is not None:
+                    raise error
+                if item is _DONE:
+                    return
+                yield item
+        finally:
+            # 消费方提前退出 (例如页面 rerun) 时取消后台任务
+            future.cancel()
+
+@st.cache_resource
+def get_async_runner():
+    return AsyncRunner()
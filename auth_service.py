@@ -1,21 +1,42 @@
 import streamlit as st
-import bcrypt
+import base64
+import threading
+import time
+from collections import OrderedDict
+import config
+import metrics
 from database import get_db_pool
+from password_hasher import get_hasher, HasherBusy, HasherTimeout
+from rate_limiter import SlidingWindowLimiter
+import blob_store
+import image_dedup
+import image_variants
+import checkpoint_gc
+import history_cache
+
+# 登录 / 注册准入控制
+_LOGIN_WINDOW = config.get_int_setting("LOGIN_WINDOW", 60)
+_user_limiter = SlidingWindowLimiter(config.get_int_setting("LOGIN_MAX_PER_USER", 5), _LOGIN_WINDOW)
+_ip_limiter = SlidingWindowLimiter(config.get_int_setting("LOGIN_MAX_PER_IP", 20), _LOGIN_WINDOW)
 
 def hash_password(password: str) -> str:
-    """加密密码"""
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    """加密密码 (在哈希进程池中执行)"""
+    with metrics.timed("password_hash_seconds", op="hash"):
+        return get_hasher().hash(password)
 
 def verify_password(password: str, hashed: str) -> bool:
-    """验证密码"""
-    return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+    """验证密码 (在哈希进程池中执行)"""
+    with metrics.timed("password_hash_seconds", op="verify"):
+        return get_hasher().verify(password, hashed)
 
-def register_user(username, password):
+def register_user(username, password, client_ip=None):
     """注册新用户"""
+    if not _ip_limiter.allow(client_ip):
+        return None, "操作过于频繁，请稍后再试。"
     try:
         pool = get_db_pool()
         hashed = hash_password(password)
-        with pool.connection() as conn:
+        with metrics.db_connection(pool, "register_user") as conn:
             with conn.cursor() as cur:
                 cur.execute(
                     "INSERT INTO users (username, password_hash) VALUES (%s, %s) RETURNING id",
@@ -23,16 +44,22 @@ def register_user(username, password):
                 )
                 user_id = cur.fetchone()[0]
         return user_id, "注册成功！请登录。"
+    except (HasherBusy, HasherTimeout):
+        # 队列已满或等待超时 (二者的异常信息都为空)，统一提示稍后重试
+        return None, "系统繁忙，请稍后再试。"
     except Exception as e:
         if "unique" in str(e).lower():
             return None, "用户名已存在，请重试。"
         return None, f"注册失败: {e}"
 
-def login_user(username, password):
+def login_user(username, password, client_ip=None):
     """用户登录"""
+    # 准入控制：在任何哈希运算之前拒绝超额尝试
+    if not _ip_limiter.allow(client_ip) or not _user_limiter.allow(username):
+        return None, "登录尝试过于频繁，请稍后再试。"
     try:
         pool = get_db_pool()
-        with pool.connection() as conn:
+        with metrics.db_connection(pool, "login_user") as conn:
             with conn.cursor() as cur:
                 cur.execute("SELECT id, password_hash FROM users WHERE username = %s", (username,))
                 result = cur.fetchone()
@@ -40,81 +67,220 @@ def login_user(username, password):
         if result:
             user_id, stored_hash = result
             if verify_password(password, stored_hash):
+                rehash_if_needed(user_id, password, stored_hash)
                 return user_id, "登录成功"
         return None, "用户名或密码错误"
+    except (HasherBusy, HasherTimeout):
+        # 队列已满或等待超时 (二者的异常信息都为空)，统一提示稍后重试
+        return None, "系统繁忙，请稍后再试。"
     except Exception as e:
         return None, f"登录出错: {e}"
 
+def rehash_if_needed(user_id, password, stored_hash):
+    """work factor 调整后，在用户登录成功时透明地重新哈希"""
+    hasher = get_hasher()
+    if not hasher.needs_rehash(stored_hash):
+        return
+    try:
+        new_hash = hasher.hash(password)
+        pool = get_db_pool()
+        with metrics.db_connection(pool, "rehash_if_needed") as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "UPDATE users SET password_hash = %s WHERE id = %s AND password_hash = %s",
+                    (new_hash, user_id, stored_hash)
+                )
+        print(f"🔑 用户 {user_id} 密码哈希已升级到 cost={hasher.rounds}")
+    except Exception as e:
+        # 升级失败不影响本次登录
+        print(f"⚠️ 密码重新哈希失败: {e}")
+
 def create_new_thread(user_id, title="新对话"):
     """为用户创建新对话"""
     import uuid
     new_thread_id = str(uuid.uuid4())
     pool = get_db_pool()
-    with pool.connection() as conn:
+    with metrics.db_connection(pool, "create_new_thread") as conn:
         with conn.cursor() as cur:
             cur.execute(
                 "INSERT INTO user_threads (thread_id, user_id, title) VALUES (%s, %s, %s)",
                 (new_thread_id, user_id, title)
             )
+    invalidate_thread_list(user_id)
     return new_thread_id
 
-def get_user_threads(user_id):
-    """获取用户的所有对话"""
+# 对话列表缓存：user_id -> {(limit, before): (过期时间, 结果)}
+# 本进程内的新建 / 重命名 / 删除会立即失效；其他进程的修改最多延迟 TTL 秒
+# 按用户 LRU (THREAD_LIST_CACHE_USERS)，每个用户最多缓存 THREAD_LIST_CACHE_PAGES 页
+THREAD_LIST_TTL = 30
+THREAD_LIST_CACHE_USERS = config.get_int_setting("THREAD_LIST_CACHE_USERS", 1024)
+THREAD_LIST_CACHE_PAGES = config.get_int_setting("THREAD_LIST_CACHE_PAGES", 8)
+_thread_list_cache = OrderedDict()
+_thread_list_lock = threading.Lock()
+
+def invalidate_thread_list(user_id):
+    """清除用户的对话列表缓存"""
+    with _thread_list_lock:
+        _thread_list_cache.pop(user_id, None)
+
+def get_user_threads(user_id, limit=None, before=None):
+    """获取用户的对话 (按 updated_at 倒序，keyset 分页)
+
+    before: 上一页最后一条的 (updated_at, thread_id)，为 None 时从最新开始
+    """
+    page_key = (limit, before)
+    with _thread_list_lock:
+        pages = _thread_list_cache.get(user_id)
+        if pages is not None:
+            cached = pages.get(page_key)
+            if cached and cached[0] > time.monotonic():
+                _thread_list_cache.move_to_end(user_id)
+                return cached[1]
+            if cached:
+                del pages[page_key]
+
+    sql = "SELECT thread_id, title, updated_at FROM user_threads WHERE user_id = %s"
+    params = [user_id]
+    if before is not None:
+        sql += " AND (updated_at, thread_id) < (%s, %s)"
+        params += list(before)
+    sql += " ORDER BY updated_at DESC, thread_id DESC"
+    if limit is not None:
+        sql += " LIMIT %s"
+        params.append(limit)
+
     pool = get_db_pool()
-    with pool.connection() as conn:
+    with metrics.db_connection(pool, "get_user_threads") as conn:
         with conn.cursor() as cur:
-            cur.execute(
-                "SELECT thread_id, title, updated_at FROM user_threads WHERE user_id = %s ORDER BY updated_at DESC",
-                (user_id,)
-            )
-            return cur.fetchall()
+            cur.execute(sql, params)
+            rows = cur.fetchall()
 
-def save_image_to_db(thread_id, prompt, base64_data, mime_type="image/png"):
-    """保存图片到数据库"""
+    with _thread_list_lock:
+        pages = _thread_list_cache.setdefault(user_id, OrderedDict())
+        pages[page_key] = (time.monotonic() + THREAD_LIST_TTL, rows)
+        pages.move_to_end(page_key)
+        while len(pages) > THREAD_LIST_CACHE_PAGES:
+            pages.popitem(last=False)
+        _thread_list_cache.move_to_end(user_id)
+        while len(_thread_list_cache) > THREAD_LIST_CACHE_USERS:
+            _thread_list_cache.popitem(last=False)
+    return rows
+
+def save_image_to_db(thread_id, prompt, image_bytes, mime_type="image/png", model=None):
+    """保存图片到数据库 (内容存入 blob 存储，表内只记录 hash 与元数据)
+
+    传入 model 时同时记录 prompt hash，供相同描述的后续请求复用
+    """
+    blob_hash = blob_store.put_blob(image_bytes)
+    prompt_hash = image_dedup.prompt_hash(prompt, model) if model else None
     pool = get_db_pool()
-    with pool.connection() as conn:
+    with metrics.db_connection(pool, "save_image_to_db") as conn:
         with conn.cursor() as cur:
             cur.execute(
-                "INSERT INTO app_images (thread_id, prompt, base64_data, mime_type) VALUES (%s, %s, %s, %s) RETURNING id",
-                (thread_id, prompt, base64_data, mime_type)
+                """
+                INSERT INTO app_images (thread_id, prompt, blob_hash, size_bytes, mime_type, prompt_hash, model)
+                VALUES (%s, %s, %s, %s, %s, %s, %s) RETURNING id
+                """,
+                (thread_id, prompt, blob_hash, len(image_bytes), mime_type, prompt_hash, model)
             )
             image_id = cur.fetchone()[0]
-            return image_id  # 返回新插入的图片 ID
+    save_image_variants(image_id, image_bytes)
+    return image_id  # 返回新插入的图片 ID
 
-def get_images_for_thread(thread_id):
-    """获取对话关联的所有图片"""
+def save_image_variants(image_id, image_bytes):
+    """生成并保存缩略图 / 中图 (失败不影响原图)"""
+    try:
+        variants = image_variants.make_derivatives(image_bytes)
+        if not variants:
+            return
+        # 先写入全部 blob (db 后端会各自占用一个连接)，再用一个连接插入记录，避免同时占用两个连接
+        blob_hashes = {name: blob_store.put_blob(variant["bytes"]) for name, variant in variants.items()}
+        pool = get_db_pool()
+        with metrics.db_connection(pool, "save_image_variants") as conn:
+            with conn.cursor() as cur:
+                for name, variant in variants.items():
+                    cur.execute(
+                        """
+                        INSERT INTO app_image_variants (image_id, variant, blob_hash, mime_type, width, height, size_bytes)
+                        VALUES (%s, %s, %s, %s, %s, %s, %s)
+                        ON CONFLICT (image_id, variant) DO NOTHING
+                        """,
+                        (image_id, name, blob_hashes[name], variant["mime_type"], variant["width"], variant["height"], len(variant["bytes"]))
+                    )
+    except Exception as e:
+        print(f"⚠️ 图片衍生尺寸保存失败 (ID: {image_id}): {e}")
+
+def _load_image_bytes(blob_hash, legacy_base64):
+    """读取图片原始字节 (兼容旧的 base64_data 记录)"""
+    if blob_hash:
+        return blob_store.get_blob(blob_hash)
+    if legacy_base64:
+        return base64.b64decode(legacy_base64)
+    return None
+
+def _row_to_image_meta(row):
+    return {"id": row[0], "prompt": row[1], "mime_type": row[2], "size_bytes": row[3]}
+
+def get_image_meta_by_ids(image_ids):
+    """批量获取图片元数据，返回 {ID: 元数据} (不含图片内容)"""
+    if not image_ids:
+        return {}
     pool = get_db_pool()
-    with pool.connection() as conn:
+    with metrics.db_connection(pool, "get_image_meta_by_ids") as conn:
         with conn.cursor() as cur:
             cur.execute(
-                "SELECT id, base64_data, prompt, mime_type FROM app_images WHERE thread_id = %s ORDER BY created_at ASC",
-                (thread_id,)
+                "SELECT id, prompt, mime_type, size_bytes FROM app_images WHERE id = ANY(%s)",
+                (list(image_ids),)
             )
-            return [{"id": row[0], "data": row[1], "prompt": row[2], "mime_type": row[3]} for row in cur.fetchall()]
+            return {row[0]: _row_to_image_meta(row) for row in cur.fetchall()}
 
-def get_image_by_id(image_id):
-    """通过图片 ID 获取单张图片"""
+def get_image_meta(image_id):
+    """通过图片 ID 获取单张图片元数据"""
     pool = get_db_pool()
-    with pool.connection() as conn:
+    with metrics.db_connection(pool, "get_image_meta") as conn:
         with conn.cursor() as cur:
             cur.execute(
-                "SELECT base64_data, prompt, mime_type FROM app_images WHERE id = %s",
+                "SELECT id, prompt, mime_type, size_bytes FROM app_images WHERE id = %s",
                 (image_id,)
             )
             row = cur.fetchone()
-            if row:
-                return {"data": row[0], "prompt": row[1], "mime_type": row[2]}
-            return None
+            return _row_to_image_meta(row) if row else None
+
+def get_image_bytes(image_id, variant=None):
+    """通过图片 ID 读取图片字节
+
+    variant 为 thumb / medium 时优先返回对应衍生图，不存在则回退原图
+    """
+    # 读取 blob 前先归还连接：db 后端的 get_blob 会再占用一个连接
+    pool = get_db_pool()
+    with metrics.db_connection(pool, "get_image_bytes") as conn:
+        with conn.cursor() as cur:
+            # 一次查询同时取衍生图与原图；衍生图存在时不读取旧的 base64_data
+            cur.execute(
+                """
+                SELECT v.blob_hash, i.blob_hash, CASE WHEN v.blob_hash IS NULL THEN i.base64_data END
+                FROM app_images i
+                LEFT JOIN app_image_variants v ON v.image_id = i.id AND v.variant = %s
+                WHERE i.id = %s
+                """,
+                (variant, image_id)
+            )
+            row = cur.fetchone()
+    if not row:
+        return None
+    if row[0]:
+        return blob_store.get_blob(row[0])
+    return _load_image_bytes(row[1], row[2])
 
 def get_recent_images(thread_id, limit=1):
-    """获取最近生成的图片（用于即时回显Fallback）"""
+    """获取最近生成的图片元数据（用于即时回显Fallback）"""
     pool = get_db_pool()
-    with pool.connection() as conn:
+    with metrics.db_connection(pool, "get_recent_images") as conn:
         with conn.cursor() as cur:
             # 获取最近 120 秒内生成的图片（增加窗口以应对慢生成）
             cur.execute(
                 """
-                SELECT base64_data, prompt, mime_type 
+                SELECT id, prompt, mime_type, size_bytes 
                 FROM app_images 
                 WHERE thread_id = %s 
                 AND created_at > NOW() - INTERVAL '120 seconds'
@@ -123,27 +289,33 @@ def get_recent_images(thread_id, limit=1):
                 """,
                 (thread_id, limit)
             )
-            result = [{"data": row[0], "prompt": row[1], "mime_type": row[2]} for row in cur.fetchall()]
+            result = [_row_to_image_meta(row) for row in cur.fetchall()]
             print(f"🔍 DB 查询最近图片: thread={thread_id}, 找到 {len(result)} 张")
             return result
 
 def delete_thread(thread_id, user_id):
     """删除指定的对话"""
     pool = get_db_pool()
-    with pool.connection() as conn:
+    with metrics.db_connection(pool, "delete_thread") as conn:
         with conn.cursor() as cur:
-            # 先删除关联的图片记录
-            cur.execute("DELETE FROM app_images WHERE thread_id = %s", (thread_id,))
-            # 删除 checkpoints (如果 LangGraph 表在同一个库，这里只能删业务表记录，LangGraph 自己的表可能还是脏数据但影响不大)
-            # 实际上 LangGraph 的 checkpoint 是只有 row 记录，我们这里主要删业务层的 thread 记录
+            # 确认对话属于该用户，再删除关联数据
             cur.execute("DELETE FROM user_threads WHERE thread_id = %s AND user_id = %s", (thread_id, user_id))
+            if cur.rowcount == 0:
+                return
+            # 删除关联的图片记录
+            cur.execute("DELETE FROM app_images WHERE thread_id = %s", (thread_id,))
+            # 删除 LangGraph 的 checkpoint 数据 (遗漏的由 checkpoint_gc 定时清理)
+            checkpoint_gc.purge_thread(cur, thread_id)
+            history_cache.invalidate(thread_id, cur)
+    invalidate_thread_list(user_id)
 
 def rename_thread(thread_id, new_title, user_id):
     """重命名对话"""
     pool = get_db_pool()
-    with pool.connection() as conn:
+    with metrics.db_connection(pool, "rename_thread") as conn:
         with conn.cursor() as cur:
             cur.execute(
                 "UPDATE user_threads SET title = %s, updated_at = CURRENT_TIMESTAMP WHERE thread_id = %s AND user_id = %s",
                 (new_title, thread_id, user_id)
-            )
\ No newline at end of file
+            )
+    invalidate_thread_list(user_id)
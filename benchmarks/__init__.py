@@ -0,0 +1,3 @@
+# 🏁 离线基准测试
+# 使用确定性的假模型 / 假工具构建真实的 agent.get_graph 拓扑，不依赖 Gemini、Qdrant 和 Google API
+# 用法: python -m benchmarks.run --output results.json  (详见 benchmarks/run.py)
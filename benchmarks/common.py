@@ -0,0 +1,104 @@
+import json
+import math
+import os
+import platform
+import time
+from datetime import datetime
+
+import config
+
+# 基准测试 / 压测共用：统计、checkpointer 选择、结果输出
+
+def percentile(sorted_samples, q):
+    """最近秩百分位 (sorted_samples 需已排序)"""
+    if not sorted_samples:
+        return 0.0
+    index = max(math.ceil(q / 100 * len(sorted_samples)) - 1, 0)
+    return sorted_samples[min(index, len(sorted_samples) - 1)]
+
+def summarize(samples):
+    """耗时样本 (秒) -> 毫秒统计"""
+    ordered = sorted(samples)
+    if not ordered:
+        return {"count": 0}
+    return {
+        "count": len(ordered),
+        "mean_ms": round(sum(ordered) / len(ordered) * 1000, 3),
+        "p50_ms": round(percentile(ordered, 50) * 1000, 3),
+        "p95_ms": round(percentile(ordered, 95) * 1000, 3),
+        "p99_ms": round(percentile(ordered, 99) * 1000, 3),
+        "max_ms": round(ordered[-1] * 1000, 3),
+    }
+
+def postgres_available(timeout=5):
+    """DB_URI 已配置且能连上时返回 True"""
+    if not config.get_db_uri():
+        return False
+    try:
+        from database import get_db_pool
+        with get_db_pool().connection(timeout=timeout) as conn:
+            conn.execute("SELECT 1")
+        return True
+    except Exception as e:
+        print(f"⚠️ 无法连接 Postgres，改用内存 checkpointer: {e}")
+        return False
+
+def open_checkpointer(use_postgres):
+    """返回 (checkpointer, 后端名称)；Postgres 不可用时退回内存实现"""
+    if use_postgres:
+        from langgraph.checkpoint.postgres import PostgresSaver
+        from database import get_db_pool
+        import migrations
+        migrations.ensure_schema()
+        return PostgresSaver(get_db_pool()), "postgres"
+
+    try:
+        from langgraph.checkpoint.memory import InMemorySaver
+    except ImportError:
+        # 旧版本 langgraph 的名称
+        from langgraph.checkpoint.memory import MemorySaver as InMemorySaver
+    return InMemorySaver(), "memory"
+
+def time_checkpoint_writes(checkpointer, samples):
+    """包装 checkpointer 的写入方法，把每次写入耗时 (秒) 追加到 samples"""
+    def wrap(method):
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                samples.append(time.perf_counter() - started)
+        return timed
+
+    checkpointer.put = wrap(checkpointer.put)
+    checkpointer.put_writes = wrap(checkpointer.put_writes)
+    return checkpointer
+
+def purge_threads(thread_ids):
+    """删除测试产生的 checkpoint / 图片 / 历史缓存"""
+    from database import get_db_pool
+    import checkpoint_gc
+    import history_cache
+    with get_db_pool().connection() as conn:
+        with conn.cursor() as cur:
+            for thread_id in thread_ids:
+                cur.execute("DELETE FROM app_images WHERE thread_id = %s", (thread_id,))
+                checkpoint_gc.purge_thread(cur, thread_id)
+                history_cache.invalidate(thread_id, cur)
+
+def write_results(path, name, results, **meta):
+    """写入 JSON 结果文件 (带运行环境信息，便于对比多次运行)"""
+    payload = {
+        "benchmark": name,
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "host": platform.node(),
+        "python": platform.python_version(),
+        **meta,
+        "results": results,
+    }
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(payload, f, ensure_ascii=False, indent=2, default=str)
+    print(f"📄 结果已写入 {path}")
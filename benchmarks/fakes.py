@@ -0,0 +1,127 @@
+import hashlib
+import io
+import time
+from typing import Any, Callable, List, Optional
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.runnables import RunnableConfig
+from langchain_core.tools import tool
+
+from context_window import estimate_content_tokens, estimate_text_tokens
+
+# 🎭 基准测试 / 压测用的替身：确定性的假模型与假工具
+
+class ScriptedChatModel(BaseChatModel):
+    """按脚本回复的假模型
+
+    script: 每轮对话的工具调用脚本 (按轮次循环使用)。每轮是若干"回合"，
+            每个回合是一组工具调用 [{"name": ..., "args": {...}}]；
+            回合用完后返回文字回复。空脚本表示直接回复文字。
+    latency: 可选，返回每次调用需要模拟的耗时 (秒)
+    """
+    script: List[List[List[dict]]] = []
+    reply: str = "好的，这是根据查询结果整理的回答。"
+    latency: Optional[Callable[[], float]] = None
+    model_name: str = "fake-scripted"
+
+    @property
+    def _llm_type(self) -> str:
+        return "scripted-fake"
+
+    def bind_tools(self, tools, **kwargs):
+        # 工具调用由脚本决定，不需要绑定
+        return self
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        if self.latency is not None:
+            time.sleep(max(self.latency(), 0))
+
+        # 当前是第几轮 (按用户消息计数)，以及本轮已经调用过几个回合的工具
+        turn = sum(1 for m in messages if isinstance(m, HumanMessage)) - 1
+        round_index = 0
+        for msg in reversed(messages):
+            if isinstance(msg, HumanMessage):
+                break
+            if isinstance(msg, AIMessage) and msg.tool_calls:
+                round_index += 1
+
+        rounds = self.script[turn % len(self.script)] if self.script and turn >= 0 else []
+        content, tool_calls = "", []
+        if round_index < len(rounds):
+            tool_calls = [
+                {"name": call["name"], "args": call.get("args", {}), "id": f"call_{turn}_{round_index}_{k}"}
+                for k, call in enumerate(rounds[round_index])
+            ]
+        else:
+            content = f"{self.reply} (第 {turn + 1} 轮)"
+
+        input_tokens = sum(estimate_content_tokens(m.content) for m in messages)
+        output_tokens = estimate_text_tokens(content) + 10 * len(tool_calls)
+        message = AIMessage(
+            content=content,
+            tool_calls=tool_calls,
+            usage_metadata={
+                "input_tokens": input_tokens,
+                "output_tokens": output_tokens,
+                "total_tokens": input_tokens + output_tokens,
+            }
+        )
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+def fake_image_bytes(prompt: str, side: int = 256) -> bytes:
+    """按 prompt 生成确定性的图片 (有 Pillow 时为真实 PNG)"""
+    digest = hashlib.sha256(prompt.encode("utf-8")).digest()
+    try:
+        from PIL import Image
+    except ImportError:
+        return b"\x89PNG\r\n\x1a\n" + digest * (side * side // len(digest))
+    buf = io.BytesIO()
+    Image.new("RGB", (side, side), tuple(digest[:3])).save(buf, format="PNG")
+    return buf.getvalue()
+
+POLICY_TEXT = "【公司制度】年假按工龄计算：满 1 年 5 天，满 10 年 10 天，满 20 年 15 天。" * 8
+
+def make_fake_tools(image_mode: str = "db", latency: Optional[Callable[[], float]] = None):
+    """创建与真实工具同名的假工具
+
+    image_mode: db -> 图片写入数据库并返回 IMAGE_ID；memory -> 不落库，只返回文字 (无 Postgres 时)
+    latency: 可选，返回每次工具调用需要模拟的耗时 (秒)
+    """
+    def wait():
+        if latency is not None:
+            time.sleep(max(latency(), 0))
+
+    @tool
+    def search_company_policy(query: str) -> str:
+        """搜索公司制度 (假数据)。"""
+        wait()
+        return POLICY_TEXT
+
+    @tool
+    def get_current_datetime() -> str:
+        """获取当前时间 (固定值)。"""
+        return "2025-01-01 09:00:00"
+
+    @tool
+    def generate_illustration(prompt: str, config: RunnableConfig) -> str:
+        """生成图片 (假数据)。"""
+        wait()
+        img_data = fake_image_bytes(prompt)
+        if image_mode != "db":
+            return f"✅ 图片已生成 ({len(img_data)} 字节，未入库)。"
+
+        import auth_service
+        thread_id = config.get("configurable", {}).get("thread_id")
+        image_id = auth_service.save_image_to_db(thread_id, prompt, img_data, "image/png")
+        return f"✅ 图片已生成。[IMAGE_ID:{image_id}]"
+
+    return [search_company_policy, get_current_datetime, generate_illustration]
+
+# 默认脚本：纯文字 / 查制度 / 并行两个工具 / 画图 交替出现
+DEFAULT_SCRIPT = [
+    [],
+    [[{"name": "search_company_policy", "args": {"query": "年假"}}]],
+    [[{"name": "get_current_datetime", "args": {}}, {"name": "search_company_policy", "args": {"query": "报销"}}]],
+    [[{"name": "generate_illustration", "args": {"prompt": "公司年会海报"}}]],
+]
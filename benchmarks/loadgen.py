@@ -0,0 +1,289 @@
+import argparse
+import math
+import os
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# 🚦 多用户并发压测 (无界面)
+# 每个模拟用户：登录 -> 新建对话 -> 连续发送若干轮 (假模型按延迟分布耗时，按比例画图) -> 刷新对话列表 -> 恢复历史
+# 并发数按 --users 逐级提升，每级输出 p50 / p95 / p99、错误率与连接池饱和度
+# 用法:
+#   python -m benchmarks.loadgen --db-uri postgresql://... --users 1,5,10,20,40 --turns 5 \
+#       --llm-latency lognormal:800,0.5 --tool-latency uniform:50,300 --image-every 4
+# 需要 Postgres (登录 / 对话 / 图片都走真实的 auth_service)
+
+OPERATIONS = ("login", "create_thread", "turn", "list_threads", "restore")
+
+def parse_latency(spec):
+    """延迟分布 (毫秒) -> 返回秒数的函数
+
+    fixed:800 | uniform:300,1500 | lognormal:800,0.5 (中位数, sigma) | none
+    """
+    if not spec or spec == "none":
+        return None
+    kind, _, params = spec.partition(":")
+    values = [float(v) for v in params.split(",")] if params else []
+    if kind == "fixed":
+        return lambda: values[0] / 1000
+    if kind == "uniform":
+        return lambda: random.uniform(values[0], values[1]) / 1000
+    if kind == "lognormal":
+        mu, sigma = math.log(values[0] / 1000), values[1]
+        return lambda: random.lognormvariate(mu, sigma)
+    raise ValueError(f"未知的延迟分布: {spec}")
+
+def make_load_script(image_every):
+    """每 image_every 轮画一张图，其余轮次在纯文字回答和查询制度之间交替"""
+    policy = [[{"name": "search_company_policy", "args": {"query": "年假"}}]]
+    image = [[{"name": "generate_illustration", "args": {"prompt": "公司年会海报"}}]]
+    if image_every <= 0:
+        return [[], policy]
+    return [policy if i % 2 else [] for i in range(image_every - 1)] + [image]
+
+class StepRecorder:
+    """一个并发级别内的耗时 / 错误记录 (线程安全)"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = {name: [] for name in OPERATIONS}
+        self.errors = {name: 0 for name in OPERATIONS}
+        self.error_messages = {}
+
+    def measure(self, name, func, *args, check=None, **kwargs):
+        """执行并计时；抛异常或 check(result) 返回错误信息时记为失败"""
+        started = time.perf_counter()
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            self.fail(name, e)
+            raise
+        error = check(result) if check else None
+        if error:
+            self.fail(name, error)
+            return result
+        with self.lock:
+            self.samples[name].append(time.perf_counter() - started)
+        return result
+
+    def fail(self, name, error):
+        with self.lock:
+            self.errors[name] += 1
+            message = str(error)[:200]
+            self.error_messages[message] = self.error_messages.get(message, 0) + 1
+
+class PoolSampler:
+    """后台定期采样 get_db_pool().get_stats()，统计连接池饱和度"""
+    def __init__(self, pool, interval):
+        self.pool = pool
+        self.interval = interval
+        self.samples = []
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._loop, name="pool-sampler", daemon=True)
+
+    def _loop(self):
+        while not self.stop_event.is_set():
+            self.samples.append(self.pool.get_stats())
+            self.stop_event.wait(self.interval)
+
+    def __enter__(self):
+        self.start_stats = self.pool.get_stats()
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop_event.set()
+        self.thread.join()
+        self.end_stats = self.pool.get_stats()
+
+    def report(self):
+        max_size = self.start_stats.get("pool_max", 0)
+        in_use = [s.get("pool_size", 0) - s.get("pool_available", 0) for s in self.samples]
+        waiting = [s.get("requests_waiting", 0) for s in self.samples]
+
+        def delta(key):
+            return self.end_stats.get(key, 0) - self.start_stats.get(key, 0)
+
+        return {
+            "max_size": max_size,
+            "peak_in_use": max(in_use, default=0),
+            "mean_in_use": round(sum(in_use) / len(in_use), 2) if in_use else 0,
+            "saturated_ratio": round(sum(1 for n in in_use if max_size and n >= max_size) / len(in_use), 3) if in_use else 0,
+            "peak_waiting": max(waiting, default=0),
+            "requests": delta("requests_num"),
+            "requests_queued": delta("requests_queued"),
+            "requests_wait_ms": delta("requests_wait_ms"),
+            "requests_errors": delta("requests_errors"),
+        }
+
+def simulate_user(graph, account, turns, think_time, recorder, created):
+    """一个模拟用户的完整会话"""
+    import auth_service
+    import history_cache
+
+    username, password = account
+    # login_user 失败时返回 (None, 原因) 而不是抛异常
+    user_id, _ = recorder.measure(
+        "login", auth_service.login_user, username, password,
+        check=lambda result: None if result[0] else result[1]
+    )
+    if not user_id:
+        return
+
+    thread_id = recorder.measure("create_thread", auth_service.create_new_thread, user_id, "压测对话")
+    created.append((thread_id, user_id))
+
+    from langchain_core.messages import HumanMessage
+    for i in range(turns):
+        config = {"configurable": {"thread_id": thread_id, "user_id": user_id, "turn_id": str(uuid.uuid4())}}
+        try:
+            recorder.measure("turn", graph.invoke, {"messages": [HumanMessage(content=f"第 {i + 1} 个问题")]}, config)
+        except Exception:
+            pass
+        if think_time:
+            time.sleep(random.uniform(0, think_time))
+
+    try:
+        recorder.measure("list_threads", auth_service.get_user_threads, user_id, limit=30)
+        # 与 web_app.restore_history 相同的路径 (页面刷新 / 切换对话)
+        state_config = {"configurable": {"thread_id": thread_id}}
+        recorder.measure(
+            "restore",
+            history_cache.get_display_messages,
+            thread_id,
+            lambda: graph.get_state(state_config),
+            auth_service.get_image_meta_by_ids
+        )
+    except Exception:
+        pass
+
+def run_step(graph, pool, accounts, turns, think_time, sample_interval):
+    """以 len(accounts) 个并发用户跑一轮"""
+    from benchmarks.common import summarize
+
+    recorder = StepRecorder()
+    created = []
+    started = time.perf_counter()
+    with PoolSampler(pool, sample_interval) as sampler:
+        with ThreadPoolExecutor(max_workers=len(accounts), thread_name_prefix="sim-user") as executor:
+            futures = [executor.submit(simulate_user, graph, account, turns, think_time, recorder, created) for account in accounts]
+            for future in futures:
+                try:
+                    future.result()
+                except Exception as e:
+                    print(f"⚠️ 模拟用户异常退出: {e}")
+    elapsed = time.perf_counter() - started
+
+    operations = {}
+    for name in OPERATIONS:
+        attempts = len(recorder.samples[name]) + recorder.errors[name]
+        operations[name] = {
+            **summarize(recorder.samples[name]),
+            "errors": recorder.errors[name],
+            "error_rate": round(recorder.errors[name] / attempts, 4) if attempts else 0.0,
+        }
+    top_errors = sorted(recorder.error_messages.items(), key=lambda item: -item[1])[:5]
+    return {
+        "users": len(accounts),
+        "elapsed_s": round(elapsed, 2),
+        "turns_per_sec": round(len(recorder.samples["turn"]) / elapsed, 2) if elapsed else None,
+        "operations": operations,
+        "pool": sampler.report(),
+        "top_errors": [{"message": m, "count": c} for m, c in top_errors],
+    }, created
+
+def print_step(result):
+    ops = result["operations"]
+    pool = result["pool"]
+    print(
+        f"👥 {result['users']:>4} 用户 | {result['turns_per_sec']} 轮/秒 | "
+        f"turn p50/p95/p99 = {ops['turn'].get('p50_ms', 0):.0f}/{ops['turn'].get('p95_ms', 0):.0f}/{ops['turn'].get('p99_ms', 0):.0f} ms | "
+        f"错误率 {ops['turn']['error_rate']:.2%} | "
+        f"连接池 峰值 {pool['peak_in_use']}/{pool['max_size']} 等待 {pool['peak_waiting']}"
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description="多用户并发压测 (假模型 + 真实 Postgres)")
+    parser.add_argument("--db-uri", default=None, help="使用指定的 (一次性) Postgres")
+    parser.add_argument("--users", default="1,5,10,20,40", help="逐级提升的并发用户数")
+    parser.add_argument("--turns", type=int, default=5, help="每个用户发送的轮数")
+    parser.add_argument("--llm-latency", default="lognormal:800,0.5", help="假模型每次调用的延迟分布 (毫秒)")
+    parser.add_argument("--tool-latency", default="uniform:50,300", help="假工具每次调用的延迟分布 (毫秒)")
+    parser.add_argument("--image-every", type=int, default=4, help="每隔几轮画一张图 (0 表示不画图)")
+    parser.add_argument("--think-time", type=float, default=0.0, help="两轮之间的最长思考时间 (秒)")
+    parser.add_argument("--sample-interval", type=float, default=0.1, help="连接池采样间隔 (秒)")
+    parser.add_argument("--stop-error-rate", type=float, default=0.5, help="错误率超过该值时停止继续加压")
+    parser.add_argument("--output", default=None, help="结果 JSON 路径 (默认 benchmarks/results/load-<时间>.json)")
+    args = parser.parse_args()
+
+    # 必须在导入业务模块之前设置：数据库地址，以及放宽登录频率限制 (否则会测成限流)
+    if args.db_uri:
+        os.environ["DB_URI"] = args.db_uri
+    os.environ.setdefault("LOGIN_MAX_PER_USER", "1000000")
+    os.environ.setdefault("LOGIN_MAX_PER_IP", "1000000")
+
+    import config
+    config.init_environment()
+    from benchmarks.common import postgres_available, open_checkpointer, write_results
+    from benchmarks.fakes import ScriptedChatModel, make_fake_tools
+    from database import get_db_pool
+    from agent import get_graph
+    import auth_service
+
+    if not postgres_available():
+        print("❌ 压测需要 Postgres，请配置 DB_URI 或使用 --db-uri")
+        return
+
+    levels = [int(n) for n in args.users.split(",")]
+    checkpointer, _ = open_checkpointer(True)
+    graph = get_graph(
+        "loadgen",
+        llm=ScriptedChatModel(script=make_load_script(args.image_every), latency=parse_latency(args.llm_latency)),
+        tools=make_fake_tools("db", parse_latency(args.tool_latency)),
+        checkpointer=checkpointer,
+        summarizer=ScriptedChatModel(reply="（对话摘要）", latency=parse_latency(args.llm_latency)),
+    )
+
+    # 预先注册足够的用户 (注册不计入压测结果)
+    password = "load-password"
+    run_id = uuid.uuid4().hex[:6]
+    accounts, user_ids = [], []
+    for i in range(max(levels)):
+        username = f"load_{run_id}_{i}"
+        user_id, msg = auth_service.register_user(username, password)
+        if not user_id:
+            print(f"❌ 注册压测用户失败: {msg}")
+            return
+        accounts.append((username, password))
+        user_ids.append(user_id)
+    print(f"✅ 已注册 {len(accounts)} 个压测用户")
+
+    pool = get_db_pool()
+    results, created = [], []
+    try:
+        for users in levels:
+            result, step_created = run_step(graph, pool, accounts[:users], args.turns, args.think_time, args.sample_interval)
+            created.extend(step_created)
+            results.append(result)
+            print_step(result)
+            if result["operations"]["turn"]["error_rate"] > args.stop_error_rate:
+                print(f"🛑 错误率超过 {args.stop_error_rate:.0%}，停止加压")
+                break
+    finally:
+        for thread_id, user_id in created:
+            auth_service.delete_thread(thread_id, user_id)
+        with pool.connection() as conn:
+            conn.execute("DELETE FROM users WHERE id = ANY(%s)", (user_ids,))
+
+    output = args.output or os.path.join("benchmarks", "results", f"load-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    write_results(
+        output, "load", results,
+        turns_per_user=args.turns,
+        llm_latency=args.llm_latency,
+        tool_latency=args.tool_latency,
+        image_every=args.image_every,
+    )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+import argparse
+import os
+import time
+import uuid
+
+# 🏁 离线基准测试
+# 用法:
+#   python -m benchmarks.run                                    # 全部项目，Postgres 不可用时用内存 checkpointer
+#   python -m benchmarks.run --db-uri postgresql://...         # 指定一次性的本地 Postgres
+#   python -m benchmarks.run --suites turns,restore --memory --output results/base.json
+# 项目:
+#   turns        每秒轮数、checkpoint 写入耗时
+#   restore      不同对话长度 / 图片数量下的历史恢复耗时
+#   auth         auth_service 各查询耗时 (需要 Postgres)
+# 原计划的 ImageStore 并发争用测试已随内存 ImageStore 一起移除 (图片统一经后台任务入库，不再有进程内图片存储)
+
+SUITES = ("turns", "restore", "auth")
+
+def run_turns(graph, checkpoint_samples, turns, cleanup):
+    """同一对话连续发送 turns 轮，统计吞吐与每轮耗时"""
+    from langchain_core.messages import HumanMessage
+    from benchmarks.common import summarize
+
+    thread_id = str(uuid.uuid4())
+    cleanup.append(thread_id)
+    checkpoint_samples.clear()
+    latencies = []
+    started = time.perf_counter()
+    for i in range(turns):
+        config = {"configurable": {"thread_id": thread_id, "user_id": "bench", "turn_id": str(uuid.uuid4())}}
+        turn_started = time.perf_counter()
+        graph.invoke({"messages": [HumanMessage(content=f"第 {i + 1} 个问题：年假有几天？")]}, config)
+        latencies.append(time.perf_counter() - turn_started)
+    elapsed = time.perf_counter() - started
+
+    return {
+        "turns": turns,
+        "turns_per_sec": round(turns / elapsed, 2) if elapsed else None,
+        "turn_latency": summarize(latencies),
+        "checkpoint_writes_per_turn": round(len(checkpoint_samples) / turns, 2) if turns else 0,
+        "checkpoint_write_latency": summarize(checkpoint_samples),
+    }
+
+def _synthetic_history(thread_id, length, images, use_postgres):
+    """构造 length 条消息的对话 (每 4 条一组：提问 / 工具调用 / 工具结果 / 回答)，前 images 组带图片"""
+    from langchain_core.messages import HumanMessage, AIMessage, ToolMessage
+    from benchmarks.fakes import fake_image_bytes
+
+    messages = []
+    image_ids = []
+    for group in range(max(length // 4, 1)):
+        call_id = f"call_{group}"
+        tool_name = "generate_illustration" if group < images else "search_company_policy"
+        tool_result = "✅ 已完成。"
+        if group < images:
+            if use_postgres:
+                import auth_service
+                image_id = auth_service.save_image_to_db(thread_id, f"图片 {group}", fake_image_bytes(f"图片 {group}"), "image/png")
+            else:
+                image_id = group + 1
+            image_ids.append(image_id)
+            tool_result = f"✅ 图片已生成。[IMAGE_ID:{image_id}]"
+        messages += [
+            HumanMessage(content=f"第 {group + 1} 个问题"),
+            AIMessage(content="", tool_calls=[{"name": tool_name, "args": {"query": "x"}, "id": call_id}]),
+            ToolMessage(content=tool_result, tool_call_id=call_id, name=tool_name),
+            AIMessage(content=f"第 {group + 1} 个回答。" * 5),
+        ]
+    return messages, image_ids
+
+def run_restore(graph, lengths, images, repeats, use_postgres, cleanup):
+    """历史恢复耗时：读取 State、转换展示列表，以及 (Postgres 下) 冷 / 热缓存的完整恢复"""
+    import history_cache
+    from benchmarks.common import summarize
+
+    results = []
+    for length in lengths:
+        thread_id = str(uuid.uuid4())
+        cleanup.append(thread_id)
+        messages, image_ids = _synthetic_history(thread_id, length, images, use_postgres)
+        config = {"configurable": {"thread_id": thread_id}}
+        graph.update_state(config, {"messages": messages}, as_node="chatbot")
+
+        if use_postgres:
+            import auth_service
+            image_lookup = auth_service.get_image_meta_by_ids
+        else:
+            meta = {i: {"id": i, "prompt": "", "mime_type": "image/png", "size_bytes": 0} for i in image_ids}
+            image_lookup = lambda ids: {i: meta[i] for i in ids if i in meta}
+
+        get_state, build, cold, warm = [], [], [], []
+        for _ in range(repeats):
+            started = time.perf_counter()
+            state = graph.get_state(config)
+            get_state.append(time.perf_counter() - started)
+
+            started = time.perf_counter()
+            history_cache.build_display_messages(state.values["messages"], image_lookup)
+            build.append(time.perf_counter() - started)
+
+            if use_postgres:
+                history_cache.invalidate(thread_id)
+                started = time.perf_counter()
+                history_cache.get_display_messages(thread_id, lambda: graph.get_state(config), image_lookup)
+                cold.append(time.perf_counter() - started)
+
+                started = time.perf_counter()
+                history_cache.get_display_messages(thread_id, lambda: graph.get_state(config), image_lookup)
+                warm.append(time.perf_counter() - started)
+
+        entry = {
+            "messages": len(messages),
+            "images": len(image_ids),
+            "get_state": summarize(get_state),
+            "build_display": summarize(build),
+        }
+        if use_postgres:
+            entry["restore_cold"] = summarize(cold)
+            entry["restore_warm"] = summarize(warm)
+        results.append(entry)
+        print(f"  restore: {len(messages)} 条消息 / {len(image_ids)} 张图片 完成")
+    return results
+
+def run_auth(iterations, cleanup):
+    """auth_service 各查询耗时 (登录包含 bcrypt)"""
+    import auth_service
+    from database import get_db_pool
+    from benchmarks.common import summarize
+
+    username = f"bench_{uuid.uuid4().hex[:8]}"
+    password = "bench-password"
+    user_id, msg = auth_service.register_user(username, password)
+    if not user_id:
+        return {"error": msg}
+
+    samples = {name: [] for name in ("login_user", "create_new_thread", "get_user_threads", "get_image_meta_by_ids", "get_recent_images")}
+
+    def measure(name, func, *args, **kwargs):
+        started = time.perf_counter()
+        result = func(*args, **kwargs)
+        samples[name].append(time.perf_counter() - started)
+        return result
+
+    try:
+        thread_ids = []
+        for i in range(iterations):
+            measure("login_user", auth_service.login_user, username, password)
+            thread_id = measure("create_new_thread", auth_service.create_new_thread, user_id, f"基准 {i}")
+            thread_ids.append(thread_id)
+            cleanup.append(thread_id)
+            # 绕过进程内的对话列表缓存，测量数据库查询本身
+            auth_service.invalidate_thread_list(user_id)
+            measure("get_user_threads", auth_service.get_user_threads, user_id, limit=30)
+            measure("get_image_meta_by_ids", auth_service.get_image_meta_by_ids, [1, 2, 3])
+            measure("get_recent_images", auth_service.get_recent_images, thread_id, 1)
+        for thread_id in thread_ids:
+            auth_service.delete_thread(thread_id, user_id)
+    finally:
+        with get_db_pool().connection() as conn:
+            conn.execute("DELETE FROM users WHERE id = %s", (user_id,))
+
+    return {name: summarize(values) for name, values in samples.items()}
+
+def build_bench_graph(use_postgres, checkpoint_samples, image_mode):
+    """真实的 Graph 拓扑 + 假模型 / 假工具"""
+    from agent import get_graph
+    from benchmarks.fakes import ScriptedChatModel, make_fake_tools, DEFAULT_SCRIPT
+    from benchmarks.common import open_checkpointer, time_checkpoint_writes
+
+    checkpointer, backend = open_checkpointer(use_postgres)
+    time_checkpoint_writes(checkpointer, checkpoint_samples)
+    graph = get_graph(
+        "bench",
+        llm=ScriptedChatModel(script=DEFAULT_SCRIPT),
+        tools=make_fake_tools(image_mode),
+        checkpointer=checkpointer,
+        summarizer=ScriptedChatModel(reply="（对话摘要）"),
+    )
+    return graph, backend
+
+def main():
+    parser = argparse.ArgumentParser(description="离线基准测试 (假模型 / 假工具)")
+    parser.add_argument("--suites", default=",".join(SUITES), help=f"逗号分隔: {', '.join(SUITES)}")
+    parser.add_argument("--output", default=None, help="结果 JSON 路径 (默认 benchmarks/results/bench-<时间>.json)")
+    parser.add_argument("--db-uri", default=None, help="使用指定的 (一次性) Postgres")
+    parser.add_argument("--memory", action="store_true", help="强制使用内存 checkpointer")
+    parser.add_argument("--turns", type=int, default=50)
+    parser.add_argument("--lengths", default="10,50,200,1000", help="restore 测试的对话长度 (消息条数)")
+    parser.add_argument("--images", type=int, default=5, help="restore 测试中每个对话的图片数")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--auth-iterations", type=int, default=20)
+    args = parser.parse_args()
+
+    # 必须在导入业务模块之前设置：数据库地址，以及放宽登录频率限制 (否则 auth 测试会被限流)
+    if args.db_uri:
+        os.environ["DB_URI"] = args.db_uri
+    os.environ.setdefault("LOGIN_MAX_PER_USER", "1000000")
+    os.environ.setdefault("LOGIN_MAX_PER_IP", "1000000")
+
+    import config
+    config.init_environment()
+    from benchmarks.common import postgres_available, purge_threads, write_results
+
+    suites = [s.strip() for s in args.suites.split(",") if s.strip()]
+    use_postgres = not args.memory and postgres_available()
+    checkpoint_samples = []
+    cleanup = []
+    results = {}
+
+    graph = backend = None
+    if "turns" in suites or "restore" in suites:
+        graph, backend = build_bench_graph(use_postgres, checkpoint_samples, "db" if use_postgres else "memory")
+
+    try:
+        if "turns" in suites:
+            print(f"▶️ turns ({backend})")
+            results["turns"] = run_turns(graph, checkpoint_samples, args.turns, cleanup)
+        if "restore" in suites:
+            print(f"▶️ restore ({backend})")
+            lengths = [int(n) for n in args.lengths.split(",")]
+            results["restore"] = run_restore(graph, lengths, args.images, args.repeats, use_postgres, cleanup)
+        if "auth" in suites:
+            print("▶️ auth")
+            results["auth"] = run_auth(args.auth_iterations, cleanup) if use_postgres else {"skipped": "需要 Postgres"}
+    finally:
+        if use_postgres and cleanup:
+            purge_threads(cleanup)
+
+    output = args.output or os.path.join("benchmarks", "results", f"bench-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    write_results(output, "offline", results, checkpointer=backend or "n/a", suites=suites)
+
+if __name__ == "__main__":
+    main()
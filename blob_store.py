@@ -0,0 +1,85 @@
+import hashlib
+import mmap
+import os
+import threading
+import config
+from database import get_db_pool
+
+# 🗄️ 内容寻址的二进制存储 (Key = SHA-256)
+# 相同内容只存一份；后端可选：
+#   - db:   app_blobs 表的 bytea 列
+#   - disk: 本地分片目录 BLOB_DIR/ab/cd/<sha256>，读取走 mmap
+
+def get_backend():
+    """当前写入后端: db | disk"""
+    return str(config.get_setting("BLOB_BACKEND", "db")).lower()
+
+def get_blob_dir():
+    return config.get_setting("BLOB_DIR", os.path.join("data", "blobs"))
+
+def hash_bytes(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+def _blob_path(blob_hash: str) -> str:
+    # 两级分片，避免单目录文件过多
+    return os.path.join(get_blob_dir(), blob_hash[:2], blob_hash[2:4], blob_hash)
+
+def put_blob(data: bytes) -> str:
+    """存储二进制内容，返回 SHA-256（已存在则直接复用）"""
+    blob_hash = hash_bytes(data)
+
+    # 复用已有内容时刷新时间：孤立 blob 清理只删除超过宽限期的 blob，避免在引用写入之前被删掉
+    if get_backend() == "disk":
+        path = _blob_path(blob_hash)
+        if os.path.exists(path):
+            os.utime(path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # 先写临时文件再原子替换，避免并发读到半个文件
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+    else:
+        pool = get_db_pool()
+        with pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    INSERT INTO app_blobs (sha256, data, size_bytes) VALUES (%s, %s, %s)
+                    ON CONFLICT (sha256) DO UPDATE SET created_at = CURRENT_TIMESTAMP
+                    """,
+                    (blob_hash, data, len(data))
+                )
+    return blob_hash
+
+def get_blob(blob_hash: str):
+    """按 SHA-256 读取内容，不存在返回 None"""
+    # 磁盘优先 (切换过后端时两边都可能有数据)
+    path = _blob_path(blob_hash)
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return b""
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                return mm[:]
+
+    pool = get_db_pool()
+    with pool.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT data FROM app_blobs WHERE sha256 = %s", (blob_hash,))
+            row = cur.fetchone()
+            return bytes(row[0]) if row else None
+
+def iter_disk_blobs(older_than):
+    """遍历磁盘后端的 blob 文件，返回修改时间早于 older_than (时间戳) 的 (hash, 路径)"""
+    for directory, _dirs, files in os.walk(get_blob_dir()):
+        for name in files:
+            if len(name) != 64:
+                continue
+            path = os.path.join(directory, name)
+            try:
+                if os.path.getmtime(path) < older_than:
+                    yield name, path
+            except FileNotFoundError:
+                continue
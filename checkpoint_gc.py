@@ -0,0 +1,246 @@
+import argparse
+import os
+import threading
+import time
+import streamlit as st
+import config
+import blob_store
+from database import get_db_pool
+
+# 🧹 LangGraph Checkpoint 压缩与清理
+# PostgresSaver 每个 super-step 都会写一份 checkpoint，且从不清理。本模块：
+#   1. 删除 user_threads 中已不存在的对话的所有 checkpoint / writes / blobs
+#   2. 每个对话只保留最近 N 个 checkpoint
+#   3. 删除不再被任何 checkpoint 引用的 blobs
+#   4. 删除内容寻址存储中不再被图片 / 衍生尺寸 / 上传引用使用的 blob (app_blobs 与磁盘，超过宽限期的才删)
+# 所有删除都按批进行 (连接为 autocommit，每批一个短事务)，避免长时间持锁
+# 可作为 CLI 运行 (python checkpoint_gc.py)，也可在 Web 进程中作为后台线程定时运行
+
+# pg_try_advisory_lock 使用的 key，保证多进程下同一时间只有一个压缩任务
+ADVISORY_LOCK_KEY = 7_301_001
+
+CHECKPOINT_TABLES = ("checkpoints", "checkpoint_writes", "checkpoint_blobs")
+# 报告中内容寻址存储的两个后端
+BLOB_STORES = ("app_blobs", "disk_blobs")
+
+# blob 仍被使用的条件 ({hash} 替换为 hash 列 / 表达式)
+BLOB_REFERENCED_SQL = """
+    EXISTS (SELECT 1 FROM app_images i WHERE i.blob_hash = {hash})
+    OR EXISTS (SELECT 1 FROM app_image_variants v WHERE v.blob_hash = {hash})
+    OR EXISTS (SELECT 1 FROM app_upload_refs r WHERE r.blob_hash = {hash})
+"""
+
+def _delete_in_batches(cur, select_sql, params, table, batch_size):
+    """按 ctid 分批删除，返回 (删除行数, 删除字节数)"""
+    total_rows, total_bytes = 0, 0
+    sql = f"""
+        WITH doomed AS ({select_sql} LIMIT %s)
+        DELETE FROM {table} t USING doomed
+        WHERE t.ctid = doomed.ctid
+        RETURNING pg_column_size(t.*)
+    """
+    while True:
+        cur.execute(sql, (*params, batch_size))
+        sizes = [row[0] for row in cur.fetchall()]
+        total_rows += len(sizes)
+        total_bytes += sum(sizes)
+        if len(sizes) < batch_size:
+            return total_rows, total_bytes
+
+def _new_report():
+    return {table: {"rows": 0, "bytes": 0} for table in CHECKPOINT_TABLES + BLOB_STORES}
+
+def _add(report, table, result):
+    report[table]["rows"] += result[0]
+    report[table]["bytes"] += result[1]
+
+# checkpoint 表中 thread_id 为 TEXT，只有符合 UUID 格式的才能转换后与 user_threads 比较
+UUID_PATTERN = r"^[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}$"
+
+def find_orphan_threads(cur):
+    """checkpoint 表中出现、但 user_threads 中已不存在的对话 ID"""
+    cur.execute(
+        """
+        SELECT t.thread_id FROM (
+            SELECT thread_id FROM checkpoints
+            UNION SELECT thread_id FROM checkpoint_writes
+            UNION SELECT thread_id FROM checkpoint_blobs
+        ) t
+        WHERE NOT CASE
+            WHEN t.thread_id ~ %s
+            THEN EXISTS (SELECT 1 FROM user_threads u WHERE u.thread_id = t.thread_id::uuid)
+            ELSE FALSE
+        END
+        """,
+        (UUID_PATTERN,)
+    )
+    return [row[0] for row in cur.fetchall()]
+
+def purge_orphan_threads(cur, batch_size, report):
+    """删除 user_threads 中已不存在的对话的全部 checkpoint 数据
+
+    孤立对话 ID 只收集一次，再按 thread_id (各表主键前缀) 分批删除，避免每批都重新扫描全表
+    """
+    for thread_id in find_orphan_threads(cur):
+        for table in CHECKPOINT_TABLES:
+            select_sql = f"SELECT x.ctid FROM {table} x WHERE x.thread_id = %s"
+            _add(report, table, _delete_in_batches(cur, select_sql, (thread_id,), table, batch_size))
+    # 上传引用随对话一起失效
+    cur.execute(
+        """
+        DELETE FROM app_upload_refs r
+        WHERE NOT EXISTS (SELECT 1 FROM user_threads u WHERE u.thread_id = r.thread_id)
+        """
+    )
+
+def compact_thread(cur, thread_id, checkpoint_ns, keep, batch_size, report):
+    """只保留该对话最近 keep 个 checkpoint，并清理不再引用的 writes / blobs"""
+    cur.execute(
+        """
+        SELECT checkpoint_id FROM checkpoints
+        WHERE thread_id = %s AND checkpoint_ns = %s
+        ORDER BY checkpoint_id DESC
+        OFFSET %s LIMIT 1
+        """,
+        (thread_id, checkpoint_ns, keep - 1)
+    )
+    row = cur.fetchone()
+    if not row:
+        return
+    # checkpoint_id 是按时间单调递增的 UUIDv6，可直接比较
+    oldest_kept = row[0]
+
+    for table in ("checkpoints", "checkpoint_writes"):
+        select_sql = f"""
+            SELECT x.ctid FROM {table} x
+            WHERE x.thread_id = %s AND x.checkpoint_ns = %s AND x.checkpoint_id < %s
+        """
+        _add(report, table, _delete_in_batches(cur, select_sql, (thread_id, checkpoint_ns, oldest_kept), table, batch_size))
+
+    select_sql = """
+        SELECT b.ctid FROM checkpoint_blobs b
+        WHERE b.thread_id = %s AND b.checkpoint_ns = %s
+        AND NOT EXISTS (
+            SELECT 1 FROM checkpoints c
+            WHERE c.thread_id = b.thread_id AND c.checkpoint_ns = b.checkpoint_ns
+            AND c.checkpoint -> 'channel_versions' ->> b.channel = b.version
+        )
+    """
+    _add(report, "checkpoint_blobs", _delete_in_batches(cur, select_sql, (thread_id, checkpoint_ns), "checkpoint_blobs", batch_size))
+
+def _remove_unreferenced_files(cur, candidates, report):
+    """candidates: [(hash, 路径)]，删除其中不再被引用的文件"""
+    cur.execute(
+        f"SELECT h FROM unnest(%s::text[]) AS h WHERE {BLOB_REFERENCED_SQL.format(hash='h')}",
+        ([blob_hash for blob_hash, _path in candidates],)
+    )
+    referenced = {row[0] for row in cur.fetchall()}
+    for blob_hash, path in candidates:
+        if blob_hash in referenced:
+            continue
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except FileNotFoundError:
+            continue
+        _add(report, "disk_blobs", (1, size))
+
+def sweep_orphan_blobs(cur, grace_seconds, batch_size, report):
+    """删除超过宽限期且不再被引用的 blob (宽限期覆盖 put_blob 与引用写入之间的窗口)"""
+    select_sql = f"""
+        SELECT b.ctid FROM app_blobs b
+        WHERE b.created_at < CURRENT_TIMESTAMP - make_interval(secs => %s)
+        AND NOT ({BLOB_REFERENCED_SQL.format(hash='b.sha256')})
+    """
+    _add(report, "app_blobs", _delete_in_batches(cur, select_sql, (grace_seconds,), "app_blobs", batch_size))
+
+    # 磁盘后端 (切换过后端时两边都可能有数据)
+    candidates = []
+    for candidate in blob_store.iter_disk_blobs(time.time() - grace_seconds):
+        candidates.append(candidate)
+        if len(candidates) >= batch_size:
+            _remove_unreferenced_files(cur, candidates, report)
+            candidates = []
+    if candidates:
+        _remove_unreferenced_files(cur, candidates, report)
+
+def compact(keep=None, batch_size=None):
+    """执行一次完整压缩，返回报告；其他进程正在压缩时返回 None"""
+    keep = max(keep or config.get_int_setting("CHECKPOINT_KEEP", 20), 1)
+    batch_size = batch_size or config.get_int_setting("CHECKPOINT_GC_BATCH", 500)
+    report = _new_report()
+    started = time.perf_counter()
+
+    pool = get_db_pool()
+    with pool.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_try_advisory_lock(%s)", (ADVISORY_LOCK_KEY,))
+            if not cur.fetchone()[0]:
+                print("⏭️ 其他进程正在压缩 checkpoint，跳过本次")
+                return None
+            try:
+                purge_orphan_threads(cur, batch_size, report)
+
+                cur.execute(
+                    """
+                    SELECT thread_id, checkpoint_ns FROM checkpoints
+                    GROUP BY thread_id, checkpoint_ns
+                    HAVING COUNT(*) > %s
+                    """,
+                    (keep,)
+                )
+                for thread_id, checkpoint_ns in cur.fetchall():
+                    compact_thread(cur, thread_id, checkpoint_ns, keep, batch_size, report)
+
+                sweep_orphan_blobs(cur, config.get_int_setting("BLOB_GC_GRACE_SECONDS", 86400), batch_size, report)
+            finally:
+                cur.execute("SELECT pg_advisory_unlock(%s)", (ADVISORY_LOCK_KEY,))
+
+    total_bytes = sum(item["bytes"] for item in report.values())
+    print(
+        f"🧹 Checkpoint 压缩完成 ({time.perf_counter() - started:.1f}s)，回收约 {total_bytes / 1024 / 1024:.2f} MB: "
+        + ", ".join(f"{table}={item['rows']} 行" for table, item in report.items())
+    )
+    return report
+
+def purge_thread(cur, thread_id):
+    """删除单个对话的全部 checkpoint 数据及上传引用 (删除对话时调用)"""
+    for table in CHECKPOINT_TABLES:
+        cur.execute(f"DELETE FROM {table} WHERE thread_id = %s", (str(thread_id),))
+    cur.execute("DELETE FROM app_upload_refs WHERE thread_id = %s", (str(thread_id),))
+
+def _worker_loop(interval):
+    while True:
+        time.sleep(interval)
+        try:
+            compact()
+        except Exception as e:
+            print(f"❌ Checkpoint 压缩失败: {e}")
+
+@st.cache_resource
+def start_compaction_worker():
+    """启动后台定时压缩线程 (CHECKPOINT_GC_INTERVAL 秒，0 表示禁用)"""
+    interval = config.get_int_setting("CHECKPOINT_GC_INTERVAL", 3600)
+    if interval <= 0:
+        return None
+    worker = threading.Thread(target=_worker_loop, args=(interval,), name="checkpoint-gc", daemon=True)
+    worker.start()
+    print(f"🧹 Checkpoint 压缩线程已启动 (每 {interval}s)")
+    return worker
+
+def main():
+    parser = argparse.ArgumentParser(description="压缩 LangGraph Postgres checkpoint 表")
+    parser.add_argument("--keep", type=int, default=None, help="每个对话保留的 checkpoint 数 (默认 CHECKPOINT_KEEP 或 20)")
+    parser.add_argument("--batch-size", type=int, default=None, help="每批删除的行数 (默认 CHECKPOINT_GC_BATCH 或 500)")
+    parser.add_argument("--interval", type=int, default=0, help="大于 0 时按该间隔 (秒) 循环执行")
+    args = parser.parse_args()
+
+    config.init_environment()
+    while True:
+        compact(keep=args.keep, batch_size=args.batch_size)
+        if args.interval <= 0:
+            break
+        time.sleep(args.interval)
+
+if __name__ == "__main__":
+    main()
@@ -47,17 +47,35 @@ def init_environment():
     except Exception as e:
         print(f"Environment setup warning: {e}")
 
-# 数据库连接串 (优先从 Secrets 获取，兼容本地 .env)
-def get_db_uri():
-    """安全获取数据库连接串"""
+def get_setting(name, default=None):
+    """读取配置项 (优先从 Secrets 获取，兼容本地 .env)"""
     # 优先从 st.secrets 获取
     try:
-        if "DB_URI" in st.secrets:
-            return st.secrets["DB_URI"]
+        if name in st.secrets:
+            return st.secrets[name]
     except Exception:
         pass
     
     # 回退到环境变量
-    return os.getenv("DB_URI")
+    return os.getenv(name, default)
+
+def get_bool_setting(name, default=False):
+    """读取布尔配置项 (1/true/yes/on 视为开启)"""
+    value = get_setting(name)
+    if value is None:
+        return default
+    return str(value).strip().lower() in ("1", "true", "yes", "on")
+
+def get_int_setting(name, default):
+    """读取整数配置项，格式错误时回退默认值"""
+    try:
+        return int(get_setting(name, default))
+    except (TypeError, ValueError):
+        return default
+
+# 数据库连接串 (优先从 Secrets 获取，兼容本地 .env)
+def get_db_uri():
+    """安全获取数据库连接串"""
+    return get_setting("DB_URI")
 
 DB_URI = get_db_uri()
\ No newline at end of file
@@ -0,0 +1,209 @@
+import json
+import threading
+from collections import OrderedDict
+from langchain_core.messages import SystemMessage, ToolMessage, HumanMessage
+import metrics
+
+# 🧮 Token 预算上下文窗口
+# - 按消息 id 缓存 token 估算值 (消息内容写入 checkpoint 后不再变化)
+# - 超出预算时，把较早的消息折叠进滚动摘要 (保存在 Graph State 中)
+# - 摘要只在窗口起点移动时才重新计算
+
+# Gemini 对单张图片按固定 token 计费
+IMAGE_TOKENS = 258
+# 每条消息的角色 / 分隔符开销
+MESSAGE_OVERHEAD = 4
+# 超出预算时，把窗口收缩到预算的这个比例，避免每轮都重新摘要
+KEEP_RATIO = 0.6
+# 折叠进摘要时，单条工具返回最多保留的字符数
+FOLD_TOOL_CHARS = 500
+
+SUMMARY_PROMPT = """你负责维护一段对话的滚动摘要。
+请把"已有摘要"与"新增对话"合并成一份新的中文摘要：保留用户的身份信息、需求、已确认的事实、工具查询得到的关键结果和尚未完成的事项；省略寒暄和重复内容。只输出摘要正文。
+
+已有摘要：
+{summary}
+
+新增对话：
+{transcript}
+"""
+
+def _is_cjk(ch):
+    return "\u4e00" <= ch <= "\u9fff" or "\u3000" <= ch <= "\u30ff" or "\uff00" <= ch <= "\uffef"
+
+def estimate_text_tokens(text: str) -> int:
+    """粗略估算 token：中日文约 1 字 1 token，其余约 4 字符 1 token"""
+    cjk = sum(1 for ch in text if _is_cjk(ch))
+    return cjk + (len(text) - cjk + 3) // 4
+
+def estimate_content_tokens(content) -> int:
+    if isinstance(content, str):
+        return estimate_text_tokens(content)
+    tokens = 0
+    for part in content or []:
+        if isinstance(part, str):
+            tokens += estimate_text_tokens(part)
+        elif part.get("type") == "text":
+            tokens += estimate_text_tokens(part.get("text", ""))
+        else:
+            # 图片等多模态内容按固定开销计，而不是按 base64 长度
+            tokens += IMAGE_TOKENS
+    return tokens
+
+def estimate_message_tokens(msg) -> int:
+    tokens = MESSAGE_OVERHEAD + estimate_content_tokens(msg.content)
+    for tool_call in getattr(msg, "tool_calls", None) or []:
+        tokens += estimate_text_tokens(tool_call["name"] + json.dumps(tool_call.get("args", {}), ensure_ascii=False))
+    return tokens
+
+class TokenCounter:
+    """按消息 id 缓存 token 数 (LRU，线程安全)"""
+    def __init__(self, max_entries=100_000):
+        self.max_entries = max_entries
+        self.counts = OrderedDict()
+        self.lock = threading.Lock()
+
+    def count(self, msg) -> int:
+        if not msg.id:
+            return estimate_message_tokens(msg)
+        with self.lock:
+            if msg.id in self.counts:
+                self.counts.move_to_end(msg.id)
+                return self.counts[msg.id]
+        tokens = estimate_message_tokens(msg)
+        with self.lock:
+            self.counts[msg.id] = tokens
+            if len(self.counts) > self.max_entries:
+                self.counts.popitem(last=False)
+        return tokens
+
+def _content_text(content) -> str:
+    if isinstance(content, list):
+        return "".join(p if isinstance(p, str) else p.get("text", "") for p in content)
+    return str(content)
+
+def _render_for_summary(msg) -> str:
+    if isinstance(msg, HumanMessage):
+        role = "用户"
+    elif isinstance(msg, ToolMessage):
+        role = f"工具({msg.name})"
+    else:
+        role = "助手"
+
+    content = msg.content
+    if isinstance(content, list):
+        texts = []
+        for part in content:
+            if isinstance(part, str):
+                texts.append(part)
+            elif part.get("type") == "text":
+                texts.append(part.get("text", ""))
+            else:
+                texts.append("[图片]")
+        content = "\n".join(texts)
+    content = str(content)
+    if isinstance(msg, ToolMessage) and len(content) > FOLD_TOOL_CHARS:
+        content = content[:FOLD_TOOL_CHARS] + "..."
+
+    for tool_call in getattr(msg, "tool_calls", None) or []:
+        content += f"\n[调用工具 {tool_call['name']}]"
+    return f"{role}: {content}"
+
+class ContextWindow:
+    def __init__(self, system_prompt, summarizer, token_budget, counter=None):
+        self.system_prompt = system_prompt
+        self.summarizer = summarizer
+        self.token_budget = token_budget
+        self.counter = counter or TokenCounter()
+
+    def _window_start(self, messages, summary_upto):
+        """上次摘要之后的第一条消息下标"""
+        if summary_upto:
+            for i in range(len(messages) - 1, -1, -1):
+                if messages[i].id == summary_upto:
+                    return i + 1
+        return 0
+
+    def plan(self, state):
+        """计算窗口：返回 (窗口起点, 需要新折叠进摘要的消息)"""
+        messages = [m for m in state["messages"] if not isinstance(m, SystemMessage)]
+        summary = state.get("summary") or ""
+        start = self._window_start(messages, state.get("summary_upto"))
+
+        fixed_tokens = estimate_text_tokens(self.system_prompt) + estimate_text_tokens(summary)
+        tail_tokens = sum(self.counter.count(m) for m in messages[start:])
+        if fixed_tokens + tail_tokens <= self.token_budget:
+            return messages, start, []
+
+        # 超出预算：从最新消息往前，保留到 KEEP_RATIO 预算为止
+        target = max(self.token_budget * KEEP_RATIO - fixed_tokens, 0)
+        new_start = len(messages) - 1  # 至少保留最新一条
+        kept = self.counter.count(messages[new_start])
+        while new_start > start:
+            tokens = self.counter.count(messages[new_start - 1])
+            if kept + tokens > target:
+                break
+            kept += tokens
+            new_start -= 1
+
+        # 窗口必须从用户消息开始，不能切在一轮工具调用中间 (否则 ToolMessage / 带 tool_calls 的 AI 消息会失去配对)
+        # 优先向前退到开启本轮的用户消息；本轮从窗口起点之前就开始时，改为向后推进到下一条用户消息
+        boundary = new_start
+        while boundary > start and not isinstance(messages[boundary], HumanMessage):
+            boundary -= 1
+        if boundary > start:
+            new_start = boundary
+        else:
+            boundary = new_start
+            while boundary < len(messages) and not isinstance(messages[boundary], HumanMessage):
+                boundary += 1
+            new_start = boundary if boundary < len(messages) else start
+
+        return messages, new_start, messages[start:new_start]
+
+    def _summary_model(self):
+        # 摘要在 chatbot 节点内调用：nostream 使其不进入聊天流式输出，SUMMARY_TAG 使其单独计入摘要指标
+        return self.summarizer.with_config(tags=["nostream", metrics.SUMMARY_TAG], run_name="context_summary")
+
+    def _summary_prompt(self, summary, folded):
+        transcript = "\n".join(_render_for_summary(m) for m in folded)
+        return SUMMARY_PROMPT.format(summary=summary or "（无）", transcript=transcript)
+
+    def _assemble(self, messages, start, summary):
+        system_prompt = self.system_prompt
+        if summary:
+            system_prompt += f"\n\n以下是之前对话的摘要（更早的消息已省略）：\n{summary}"
+        return [SystemMessage(content=system_prompt)] + list(messages[start:])
+
+    def _finish(self, messages, start, folded, summary, new_summary):
+        if not folded:
+            return self._assemble(messages, start, summary), {}
+        update = {"summary": new_summary, "summary_upto": messages[start - 1].id}
+        print(f"🧾 上下文折叠 {len(folded)} 条消息进摘要，窗口保留 {len(messages) - start} 条")
+        return self._assemble(messages, start, new_summary), update
+
+    def build(self, state):
+        """返回 (发送给模型的消息列表, 需要写回 State 的更新)"""
+        messages, start, folded = self.plan(state)
+        summary = state.get("summary") or ""
+        new_summary = summary
+        if folded:
+            try:
+                new_summary = _content_text(self._summary_model().invoke(self._summary_prompt(summary, folded)).content)
+            except Exception as e:
+                # 摘要失败时仍按预算截断，只是丢失被折叠部分的信息
+                print(f"⚠️ 生成对话摘要失败: {e}")
+        return self._finish(messages, start, folded, summary, new_summary)
+
+    async def abuild(self, state):
+        """build 的异步版本"""
+        messages, start, folded = self.plan(state)
+        summary = state.get("summary") or ""
+        new_summary = summary
+        if folded:
+            try:
+                response = await self._summary_model().ainvoke(self._summary_prompt(summary, folded))
+                new_summary = _content_text(response.content)
+            except Exception as e:
+                print(f"⚠️ 生成对话摘要失败: {e}")
+        return self._finish(messages, start, folded, summary, new_summary)
@@ -0,0 +1,165 @@
+import hashlib
+import re
+import threading
+import unicodedata
+from array import array
+from collections import OrderedDict
+from langchain_core.embeddings import Embeddings
+from database import get_db_pool
+
+# 🧠 Embedding 缓存
+# Key = 模型 + 用途 (query/document) + 归一化文本
+#   - 内存 LRU：命中时完全不访问数据库
+#   - app_embedding_cache 表：跨进程 / 重启持久化，超过上限时按最近使用时间淘汰
+# 员工反复询问相同的制度问题时，可以跳过远程 Embedding 调用
+
+# 每写入多少条持久化记录执行一次淘汰
+EVICT_EVERY = 100
+
+def normalize_text(text: str) -> str:
+    """归一化：全半角统一、去首尾空白、合并连续空白"""
+    text = unicodedata.normalize("NFKC", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+def _pack(vector):
+    return array("f", vector).tobytes()
+
+def _unpack(data):
+    vector = array("f")
+    vector.frombytes(bytes(data))
+    return vector.tolist()
+
+class CachedEmbeddings(Embeddings):
+    def __init__(self, underlying, model_name, max_memory_entries=1024, max_persistent_entries=50000, persistent=True):
+        self.underlying = underlying
+        self.model_name = model_name
+        self.max_memory_entries = max_memory_entries
+        self.max_persistent_entries = max_persistent_entries
+        self.persistent = persistent
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {"memory_hits": 0, "persistent_hits": 0, "misses": 0, "evictions": 0}
+        self._writes_since_evict = 0
+
+    def _key(self, text, kind):
+        raw = f"{self.model_name}\0{kind}\0{normalize_text(text)}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    # --- 内存层 ---
+    def _memory_get(self, key):
+        with self.lock:
+            vector = self.memory.get(key)
+            if vector is not None:
+                self.memory.move_to_end(key)
+            return vector
+
+    def _memory_put(self, key, vector):
+        with self.lock:
+            self.memory[key] = vector
+            self.memory.move_to_end(key)
+            while len(self.memory) > self.max_memory_entries:
+                self.memory.popitem(last=False)
+
+    # --- 持久层 ---
+    def _persistent_get(self, keys):
+        if not self.persistent or not keys:
+            return {}
+        try:
+            pool = get_db_pool()
+            with pool.connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(
+                        """
+                        UPDATE app_embedding_cache SET last_used_at = CURRENT_TIMESTAMP, hits = hits + 1
+                        WHERE key = ANY(%s)
+                        RETURNING key, vector
+                        """,
+                        (list(keys),)
+                    )
+                    return {row[0]: _unpack(row[1]) for row in cur.fetchall()}
+        except Exception as e:
+            print(f"⚠️ Embedding 缓存读取失败: {e}")
+            return {}
+
+    def _persistent_put(self, items):
+        if not self.persistent or not items:
+            return
+        try:
+            pool = get_db_pool()
+            with pool.connection() as conn:
+                with conn.cursor() as cur:
+                    cur.executemany(
+                        """
+                        INSERT INTO app_embedding_cache (key, model, vector, dim)
+                        VALUES (%s, %s, %s, %s)
+                        ON CONFLICT (key) DO UPDATE SET last_used_at = CURRENT_TIMESTAMP
+                        """,
+                        [(key, self.model_name, _pack(vector), len(vector)) for key, vector in items]
+                    )
+                    with self.lock:
+                        self._writes_since_evict += len(items)
+                        should_evict = self._writes_since_evict >= EVICT_EVERY
+                        if should_evict:
+                            self._writes_since_evict = 0
+                    if should_evict:
+                        cur.execute(
+                            """
+                            DELETE FROM app_embedding_cache WHERE key IN (
+                                SELECT key FROM app_embedding_cache
+                                ORDER BY last_used_at DESC
+                                OFFSET %s
+                            )
+                            """,
+                            (self.max_persistent_entries,)
+                        )
+                        with self.lock:
+                            self.stats["evictions"] += cur.rowcount
+        except Exception as e:
+            print(f"⚠️ Embedding 缓存写入失败: {e}")
+
+    # --- 查询 ---
+    def _embed(self, texts, kind, embed_fn):
+        keys = [self._key(text, kind) for text in texts]
+        results = {}
+
+        for key in keys:
+            vector = self._memory_get(key)
+            if vector is not None:
+                results[key] = vector
+        memory_hits = len(results)
+
+        missing = [key for key in dict.fromkeys(keys) if key not in results]
+        persisted = self._persistent_get(missing)
+        for key, vector in persisted.items():
+            self._memory_put(key, vector)
+        results.update(persisted)
+
+        # 剩余未命中的才调用远程 Embedding (同批次重复文本只算一次)
+        to_embed = {}
+        for key, text in zip(keys, texts):
+            if key not in results and key not in to_embed:
+                to_embed[key] = text
+        if to_embed:
+            vectors = embed_fn(list(to_embed.values()))
+            new_items = list(zip(to_embed.keys(), vectors))
+            for key, vector in new_items:
+                self._memory_put(key, vector)
+                results[key] = vector
+            self._persistent_put(new_items)
+
+        with self.lock:
+            self.stats["memory_hits"] += memory_hits
+            self.stats["persistent_hits"] += len(persisted)
+            self.stats["misses"] += len(to_embed)
+        return [results[key] for key in keys]
+
+    def embed_query(self, text):
+        return self._embed([text], "query", lambda texts: [self.underlying.embed_query(texts[0])])[0]
+
+    def embed_documents(self, texts):
+        return self._embed(list(texts), "document", self.underlying.embed_documents)
+
+    def get_stats(self):
+        """命中统计 (memory_hits / persistent_hits / misses / evictions / memory_size)"""
+        with self.lock:
+            return {**self.stats, "memory_size": len(self.memory)}
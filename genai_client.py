@@ -0,0 +1,92 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import config
+
+# 🔌 进程内共享的 Gemini 客户端
+# genai.Client 内部持有 HTTP 连接池，复用同一个实例即可复用连接，避免每次调用都重新握手
+# 并发数由信号量限制 (GEMINI_MAX_CONCURRENCY)，排队超过 GEMINI_QUEUE_TIMEOUT 秒直接报忙，
+# 单次请求超时由 GEMINI_TIMEOUT 控制；generate_batch 并发发出多个请求，按完成顺序返回结果
+
+class GeminiBusy(Exception):
+    """并发名额已满，排队超时"""
+
+class GeminiClientManager:
+    def __init__(self, api_key, max_concurrency, timeout, queue_timeout):
+        # 延迟导入
+        from google import genai
+        from google.genai import types
+
+        # HttpOptions.timeout 单位为毫秒
+        self.client = genai.Client(
+            api_key=api_key,
+            http_options=types.HttpOptions(timeout=int(timeout * 1000))
+        )
+        self.slots = threading.BoundedSemaphore(max_concurrency)
+        self.queue_timeout = queue_timeout
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="gemini")
+        self.lock = threading.Lock()
+        self.metrics = {"requests": 0, "errors": 0, "busy": 0, "in_flight": 0}
+
+    def _count(self, name, delta=1):
+        with self.lock:
+            self.metrics[name] += delta
+
+    def generate_content(self, model, contents, config=None):
+        """占用一个并发名额调用 generate_content"""
+        if not self.slots.acquire(timeout=self.queue_timeout):
+            self._count("busy")
+            raise GeminiBusy("Gemini 请求过多，请稍后再试")
+        self._count("requests")
+        self._count("in_flight")
+        try:
+            return self.client.models.generate_content(model=model, contents=contents, config=config)
+        except Exception:
+            self._count("errors")
+            raise
+        finally:
+            self._count("in_flight", -1)
+            self.slots.release()
+
+    def generate_batch(self, requests):
+        """并发执行一组请求 (每项为 generate_content 的参数字典)
+
+        按完成顺序逐个产出 (序号, 响应, 异常)，总耗时约等于最慢的一个请求
+        """
+        futures = {
+            self.executor.submit(self.generate_content, **request): index
+            for index, request in enumerate(requests)
+        }
+        try:
+            for future in as_completed(futures):
+                index = futures[future]
+                try:
+                    yield index, future.result(), None
+                except Exception as e:
+                    yield index, None, e
+        finally:
+            # 调用方提前停止迭代时，取消尚未开始的请求
+            for future in futures:
+                future.cancel()
+
+    def get_metrics(self):
+        with self.lock:
+            return dict(self.metrics)
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_client(api_key):
+    """进程内共享的客户端管理器 (首次使用时创建)"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                max_concurrency = max(1, config.get_int_setting("GEMINI_MAX_CONCURRENCY", 4))
+                _client = GeminiClientManager(
+                    api_key,
+                    max_concurrency=max_concurrency,
+                    timeout=config.get_int_setting("GEMINI_TIMEOUT", 120),
+                    queue_timeout=config.get_int_setting("GEMINI_QUEUE_TIMEOUT", 60)
+                )
+    return _client
@@ -0,0 +1,229 @@
+import json
+import re
+import threading
+from collections import OrderedDict
+from langchain_core.messages import HumanMessage, ToolMessage, SystemMessage
+import config
+import metrics
+from database import get_db_pool
+
+# 📜 已渲染历史缓存
+# 把 LangGraph 消息列表转换成界面展示用的列表，并按 (thread_id, checkpoint_id) 缓存：
+#   - 进程内 LRU：同一进程的不同会话共享
+#   - app_history_cache 表：跨进程共享
+# 出现新的 checkpoint 时，只处理缓存之后新增的消息
+
+IMAGE_ID_PATTERN = re.compile(r'\[IMAGE_ID:(\d+)\]')
+IMAGE_JOB_PATTERN = re.compile(r'\[IMAGE_JOB:(\d+)\]')
+
+def _message_text(msg):
+    content = msg.content
+    if isinstance(content, list):
+        text_parts = [item["text"] for item in content if isinstance(item, dict) and "text" in item]
+        content = "\n".join(text_parts)
+    return str(content)
+
+def build_display_messages(raw_msgs, image_lookup, display=None, pending_images=None):
+    """把消息转换为展示列表 (可在已有结果基础上增量追加)
+
+    image_lookup: 函数，接收图片 ID 列表，返回 {ID: 图片元数据}
+    返回 (展示列表, 尚未附加到 AI 消息的图片)
+    后台任务生成的图片以 {"job_id": ...} 表示，渲染时再查询任务状态
+    """
+    display = list(display or [])
+    pending_images = list(pending_images or [])
+
+    # 先收集所有图片 ID，一次查询元数据
+    wanted_ids = set()
+    for msg in raw_msgs:
+        if not isinstance(msg, (HumanMessage, SystemMessage)):
+            wanted_ids.update(int(i) for i in IMAGE_ID_PATTERN.findall(_message_text(msg)))
+    image_by_id = image_lookup(sorted(wanted_ids)) if wanted_ids else {}
+
+    for msg in raw_msgs:
+        if isinstance(msg, SystemMessage):
+            continue
+
+        # 处理 ToolMessage：提取 IMAGE_ID / IMAGE_JOB，附加到下一条 AI 回复
+        if isinstance(msg, ToolMessage):
+            content = str(msg.content)
+            for id_str in IMAGE_ID_PATTERN.findall(content):
+                if int(id_str) in image_by_id:
+                    pending_images.append(image_by_id[int(id_str)])
+            for id_str in IMAGE_JOB_PATTERN.findall(content):
+                pending_images.append({"job_id": int(id_str)})
+            continue  # 不显示 ToolMessage 本身
+
+        role = "user" if isinstance(msg, HumanMessage) else "assistant"
+        content_str = _message_text(msg)
+
+        # 跳过空内容的 Assistant 消息
+        if role == "assistant" and not content_str.strip():
+            continue
+
+        images = []
+        if role == "assistant":
+            # 也尝试从 AI 消息中提取 IMAGE_ID（某些情况下 AI 会复述）
+            for id_str in IMAGE_ID_PATTERN.findall(content_str):
+                if int(id_str) in image_by_id:
+                    images.append(image_by_id[int(id_str)])
+            content_str = IMAGE_ID_PATTERN.sub('图片已生成。', content_str)
+            content_str = IMAGE_JOB_PATTERN.sub('', content_str)
+
+            # 附加从 ToolMessage 提取的待处理图片
+            images.extend(pending_images)
+            pending_images = []
+
+        display.append({"role": role, "content": content_str, "images": images})
+
+    return display, pending_images
+
+class _MemoryCache:
+    """进程内 LRU：thread_id -> 缓存条目"""
+    def __init__(self, max_threads):
+        self.max_threads = max_threads
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, thread_id):
+        with self.lock:
+            entry = self.entries.get(thread_id)
+            if entry is not None:
+                self.entries.move_to_end(thread_id)
+            return entry
+
+    def put(self, thread_id, entry):
+        with self.lock:
+            self.entries[thread_id] = entry
+            self.entries.move_to_end(thread_id)
+            while len(self.entries) > self.max_threads:
+                self.entries.popitem(last=False)
+
+    def discard(self, thread_id):
+        with self.lock:
+            self.entries.pop(thread_id, None)
+
+_memory = _MemoryCache(config.get_int_setting("HISTORY_CACHE_THREADS", 256))
+
+def get_latest_checkpoint_id(thread_id):
+    """读取对话最新的 checkpoint id (不反序列化消息)"""
+    pool = get_db_pool()
+    with pool.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT checkpoint_id FROM checkpoints
+                WHERE thread_id = %s AND checkpoint_ns = ''
+                ORDER BY checkpoint_id DESC LIMIT 1
+                """,
+                (str(thread_id),)
+            )
+            row = cur.fetchone()
+            return row[0] if row else None
+
+def load(thread_id):
+    """读取缓存条目：先查进程内，再查数据库"""
+    thread_id = str(thread_id)
+    entry = _memory.get(thread_id)
+    if entry is not None:
+        return entry
+
+    pool = get_db_pool()
+    with pool.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT checkpoint_id, message_count, last_message_id, pending_images, display
+                FROM app_history_cache WHERE thread_id = %s
+                """,
+                (thread_id,)
+            )
+            row = cur.fetchone()
+    if not row:
+        return None
+    entry = {
+        "checkpoint_id": row[0],
+        "message_count": row[1],
+        "last_message_id": row[2],
+        "pending_images": row[3] or [],
+        "display": row[4] or [],
+    }
+    _memory.put(thread_id, entry)
+    return entry
+
+def save(thread_id, entry):
+    """写入缓存 (进程内 + 数据库)"""
+    thread_id = str(thread_id)
+    _memory.put(thread_id, entry)
+    pool = get_db_pool()
+    with pool.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                INSERT INTO app_history_cache (thread_id, checkpoint_id, message_count, last_message_id, pending_images, display, updated_at)
+                VALUES (%s, %s, %s, %s, %s, %s, CURRENT_TIMESTAMP)
+                ON CONFLICT (thread_id) DO UPDATE SET
+                    checkpoint_id = EXCLUDED.checkpoint_id,
+                    message_count = EXCLUDED.message_count,
+                    last_message_id = EXCLUDED.last_message_id,
+                    pending_images = EXCLUDED.pending_images,
+                    display = EXCLUDED.display,
+                    updated_at = CURRENT_TIMESTAMP
+                """,
+                (
+                    thread_id, entry["checkpoint_id"], entry["message_count"], entry["last_message_id"],
+                    json.dumps(entry["pending_images"]), json.dumps(entry["display"], ensure_ascii=False)
+                )
+            )
+
+def invalidate(thread_id, cur=None):
+    """删除对话缓存 (删除对话时调用)"""
+    _memory.discard(str(thread_id))
+    if cur is not None:
+        cur.execute("DELETE FROM app_history_cache WHERE thread_id = %s", (str(thread_id),))
+
+def get_display_messages(thread_id, get_state, image_lookup):
+    """获取对话的展示列表
+
+    get_state: 函数，返回 LangGraph 的最新 StateSnapshot (仅缓存失效时调用)
+    """
+    with metrics.timed("restore_history_seconds", phase="latest_checkpoint"):
+        latest_checkpoint_id = get_latest_checkpoint_id(thread_id)
+    if latest_checkpoint_id is None:
+        return []
+
+    with metrics.timed("restore_history_seconds", phase="cache_load"):
+        cached = load(thread_id)
+    if cached and cached["checkpoint_id"] == latest_checkpoint_id:
+        metrics.inc("history_cache_total", result="hit")
+        return cached["display"]
+
+    with metrics.timed("restore_history_seconds", phase="get_state"):
+        state = get_state()
+    if not state or not state.values or "messages" not in state.values:
+        return []
+    raw_msgs = state.values["messages"]
+    checkpoint_id = state.config["configurable"].get("checkpoint_id", latest_checkpoint_id)
+
+    # 缓存仍是当前消息列表的前缀时，只处理新增部分
+    count = cached["message_count"] if cached else 0
+    with metrics.timed("restore_history_seconds", phase="build_display"):
+        if cached and 0 < count <= len(raw_msgs) and raw_msgs[count - 1].id == cached["last_message_id"]:
+            display, pending = build_display_messages(
+                raw_msgs[count:], image_lookup, cached["display"], cached["pending_images"]
+            )
+            metrics.inc("history_cache_total", result="incremental")
+            print(f"📜 历史缓存增量更新: thread={thread_id}, 新增 {len(raw_msgs) - count} 条消息")
+        else:
+            display, pending = build_display_messages(raw_msgs, image_lookup)
+            metrics.inc("history_cache_total", result="miss")
+
+    with metrics.timed("restore_history_seconds", phase="cache_save"):
+        save(thread_id, {
+            "checkpoint_id": checkpoint_id,
+            "message_count": len(raw_msgs),
+            "last_message_id": raw_msgs[-1].id if raw_msgs else None,
+            "pending_images": pending,
+            "display": display,
+        })
+    return display
@@ -0,0 +1,89 @@
+import hashlib
+import re
+import threading
+import config
+from database import get_db_pool
+from embedding_cache import normalize_text
+
+# ♻️ 插图去重：相同 (归一化 prompt, 模型) 的图片在有效期内直接复用
+# 复用时只新增一条 app_images 记录，blob_hash 与衍生尺寸都指向已有内容，不复制图片数据
+# IMAGE_DEDUP 开启 (默认关闭)，IMAGE_DEDUP_MAX_AGE 为可复用图片的最长存活时间 (秒)
+
+# 句末标点不影响画面内容
+_TRAILING_PUNCTUATION = re.compile(r"[\s。.!！?？~～]+$")
+
+_stats = {"hits": 0, "misses": 0, "bypassed": 0}
+_stats_lock = threading.Lock()
+
+def is_enabled():
+    return config.get_bool_setting("IMAGE_DEDUP", False)
+
+def normalize_prompt(prompt):
+    """归一化：全半角统一、合并空白、忽略大小写与句末标点"""
+    return _TRAILING_PUNCTUATION.sub("", normalize_text(prompt).casefold())
+
+def prompt_hash(prompt, model):
+    return hashlib.sha256(f"{model}\n{normalize_prompt(prompt)}".encode("utf-8")).hexdigest()
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+def reuse_image(thread_id, prompt, model, bypass=False):
+    """查找有效期内相同 prompt 的图片，命中则为本对话登记一条引用并返回新图片 ID，否则返回 None"""
+    if not is_enabled():
+        return None
+    if bypass:
+        _count("bypassed")
+        return None
+
+    max_age = config.get_int_setting("IMAGE_DEDUP_MAX_AGE", 7 * 24 * 3600)
+    key = prompt_hash(prompt, model)
+    pool = get_db_pool()
+    with pool.connection() as conn:
+        with conn.transaction():
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    SELECT id, blob_hash, size_bytes, mime_type FROM app_images
+                    WHERE prompt_hash = %s AND blob_hash IS NOT NULL
+                    AND created_at > NOW() - make_interval(secs => %s)
+                    ORDER BY created_at DESC
+                    LIMIT 1
+                    """,
+                    (key, max_age)
+                )
+                source = cur.fetchone()
+                if source is None:
+                    _count("misses")
+                    return None
+                source_id, blob_hash, size_bytes, mime_type = source
+                # 引用记录不登记 prompt_hash，有效期始终按原图的生成时间计算
+                cur.execute(
+                    """
+                    INSERT INTO app_images (thread_id, prompt, blob_hash, size_bytes, mime_type, prompt_hash, model)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s) RETURNING id
+                    """,
+                    (thread_id, prompt, blob_hash, size_bytes, mime_type, None, model)
+                )
+                image_id = cur.fetchone()[0]
+                # 衍生尺寸同样按引用复制
+                cur.execute(
+                    """
+                    INSERT INTO app_image_variants (image_id, variant, blob_hash, mime_type, width, height, size_bytes)
+                    SELECT %s, variant, blob_hash, mime_type, width, height, size_bytes
+                    FROM app_image_variants WHERE image_id = %s
+                    """,
+                    (image_id, source_id)
+                )
+    _count("hits")
+    print(f"♻️ 复用已有图片 (Image: {image_id} ← {source_id}, Thread: {thread_id})")
+    return image_id
+
+def get_stats():
+    """命中统计 (hits / misses / bypassed / hit_rate)"""
+    with _stats_lock:
+        stats = dict(_stats)
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+    return stats
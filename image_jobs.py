@@ -0,0 +1,285 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import streamlit as st
+import config
+import genai_client
+from genai_client import GeminiBusy
+from database import get_db_pool
+
+# 🎨 后台图片生成任务队列
+# generate_illustration 只负责提交任务并立即返回任务编号，文字回复不再等待图片模型
+# 工作线程池以有界并发执行生成 (失败自动重试)，结果通过 save_image_to_db 入库，
+# 任务状态记录在 app_image_jobs 表中，界面轮询任务状态并在完成后显示图片
+
+IMAGE_MODEL = "gemini-2.0-flash-exp"
+# 超过该时间仍处于 queued / running 的任务视为所属进程已退出，可以重新领取
+STALE_JOB_SECONDS = 600
+
+class ImageGenerationError(Exception):
+    """图片生成失败 (message 可直接展示给用户)"""
+    def __init__(self, message, retryable=False):
+        super().__init__(message)
+        self.retryable = retryable
+
+def get_api_key():
+    return os.getenv("GOOGLE_API_KEY") or os.getenv("GEMINI_API_KEY")
+
+def _image_request(prompt):
+    from google.genai import types
+    # 使用 Gemini 2.0 Flash 的多模态生成能力
+    return {
+        "model": IMAGE_MODEL,
+        "contents": prompt,
+        "config": types.GenerateContentConfig(response_modalities=['Text', 'Image']),
+    }
+
+def _classify_error(gemini_e):
+    """把调用异常转换为 ImageGenerationError (区分是否值得重试)"""
+    if isinstance(gemini_e, GeminiBusy):
+        return ImageGenerationError(f"❌ 图片生成失败: {gemini_e}", retryable=True)
+    error_msg = str(gemini_e).lower()
+    # 检测是否是计费问题
+    if "billed" in error_msg or "billing" in error_msg:
+        return ImageGenerationError("❌ **需要启用 Google Cloud 计费**\n\n您的 API 账户目前是免费层级。图片生成功能需要在 Google AI Studio 或 Google Cloud 中启用计费。")
+    # 检测是否是安全策略问题
+    if "safety" in error_msg or "blocked" in error_msg:
+        return ImageGenerationError("❌ 图片生成被安全策略阻止。请尝试更换描述内容。")
+    return ImageGenerationError(f"❌ 图片生成失败: {gemini_e}", retryable=True)
+
+def _extract_image(response):
+    """从响应中提取图片，返回 (图片字节, mime_type)"""
+    parts = response.candidates[0].content.parts
+    for part in parts:
+        if part.inline_data is not None:
+            return part.inline_data.data, part.inline_data.mime_type or 'image/png'
+
+    # 如果没有图片，返回文本响应
+    text_parts = [p.text for p in parts if hasattr(p, 'text') and p.text]
+    if text_parts:
+        raise ImageGenerationError(f"⚠️ 模型返回了文字而非图片：\n{''.join(text_parts)}")
+    raise ImageGenerationError("❌ 生成成功但未返回图片数据。", retryable=True)
+
+def _get_client():
+    api_key = get_api_key()
+    if not api_key:
+        raise ImageGenerationError("❌ 错误：未找到 GOOGLE_API_KEY，无法生成图片。")
+    return genai_client.get_client(api_key)
+
+def generate_image(prompt):
+    """调用 Gemini 生成一张图片，返回 (图片字节, mime_type)"""
+    client = _get_client()
+    try:
+        response = client.generate_content(**_image_request(prompt))
+    except Exception as gemini_e:
+        raise _classify_error(gemini_e)
+    return _extract_image(response)
+
+def generate_images(prompts):
+    """并发生成多张图片，按完成顺序产出 (序号, (图片字节, mime_type), ImageGenerationError)"""
+    client = _get_client()
+    requests = [_image_request(prompt) for prompt in prompts]
+    for index, response, error in client.generate_batch(requests):
+        if error is not None:
+            yield index, None, _classify_error(error)
+            continue
+        try:
+            yield index, _extract_image(response), None
+        except ImageGenerationError as e:
+            yield index, None, e
+
+def _update_job(job_id, **fields):
+    assignments = ", ".join(f"{name} = %s" for name in fields)
+    pool = get_db_pool()
+    with pool.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                f"UPDATE app_image_jobs SET {assignments}, updated_at = CURRENT_TIMESTAMP WHERE id = %s",
+                (*fields.values(), job_id)
+            )
+
+class ImageJobQueue:
+    def __init__(self, workers, max_attempts):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="image-job")
+        self.max_attempts = max_attempts
+        self.lock = threading.Lock()
+        self.metrics = {"submitted": 0, "done": 0, "failed": 0, "retries": 0}
+
+    def _count(self, name):
+        with self.lock:
+            self.metrics[name] += 1
+
+    def enqueue(self, thread_id, prompt):
+        """提交生成任务，立即返回任务 ID"""
+        pool = get_db_pool()
+        with pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "INSERT INTO app_image_jobs (thread_id, prompt, status) VALUES (%s, %s, 'queued') RETURNING id",
+                    (thread_id, prompt)
+                )
+                job_id = cur.fetchone()[0]
+        self._submit(job_id, thread_id, prompt)
+        return job_id
+
+    def enqueue_many(self, thread_id, prompts):
+        """一次提交多张图片，首轮并发生成，返回任务 ID 列表 (与 prompts 顺序一致)"""
+        pool = get_db_pool()
+        with pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    INSERT INTO app_image_jobs (thread_id, prompt, status)
+                    SELECT %s, prompt, 'queued' FROM unnest(%s::text[]) WITH ORDINALITY AS t(prompt, n)
+                    ORDER BY n
+                    RETURNING id
+                    """,
+                    (thread_id, list(prompts))
+                )
+                job_ids = sorted(row[0] for row in cur.fetchall())
+        jobs = list(zip(job_ids, prompts))
+        with self.lock:
+            self.metrics["submitted"] += len(jobs)
+        self.executor.submit(self._run_batch, thread_id, jobs)
+        return job_ids
+
+    def _submit(self, job_id, thread_id, prompt, first_attempt=1):
+        if first_attempt == 1:
+            self._count("submitted")
+        self.executor.submit(self._run, job_id, thread_id, prompt, first_attempt)
+
+    def _finish(self, job_id, thread_id, prompt, img_data, mime_type):
+        import auth_service
+        image_id = auth_service.save_image_to_db(thread_id, prompt, img_data, mime_type, model=IMAGE_MODEL)
+        _update_job(job_id, status="done", image_id=image_id, error=None)
+        self._count("done")
+        print(f"✅ 图片任务完成 (Job: {job_id}, Image: {image_id}, Thread: {thread_id})")
+
+    def _fail(self, job_id, error):
+        _update_job(job_id, status="failed", error=error)
+        self._count("failed")
+        print(f"❌ 图片任务失败 (Job: {job_id}): {error}")
+
+    def _run(self, job_id, thread_id, prompt, first_attempt=1):
+        for attempt in range(first_attempt, self.max_attempts + 1):
+            if attempt > 1:
+                self._count("retries")
+                time.sleep(2 ** (attempt - 1))
+            _update_job(job_id, status="running", attempts=attempt)
+            try:
+                img_data, mime_type = generate_image(prompt)
+                self._finish(job_id, thread_id, prompt, img_data, mime_type)
+                return
+            except ImageGenerationError as e:
+                error, retryable = str(e), e.retryable
+            except Exception as e:
+                # 入库失败等未知错误同样重试
+                error, retryable = f"❌ 生成图片出错: {e}", True
+            if not retryable:
+                break
+        self._fail(job_id, error)
+
+    def _run_batch(self, thread_id, jobs):
+        """首轮并发生成整批图片，每完成一张立即入库；失败的图片转入单张重试"""
+        pool = get_db_pool()
+        with pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    UPDATE app_image_jobs SET status = 'running', attempts = 1, updated_at = CURRENT_TIMESTAMP
+                    WHERE id = ANY(%s)
+                    """,
+                    ([job_id for job_id, _ in jobs],)
+                )
+
+        def retry_or_fail(job_id, prompt, error, retryable):
+            if retryable and self.max_attempts > 1:
+                self._submit(job_id, thread_id, prompt, first_attempt=2)
+            else:
+                self._fail(job_id, error)
+
+        try:
+            results = generate_images([prompt for _, prompt in jobs])
+            for index, image, error in results:
+                job_id, prompt = jobs[index]
+                if error is not None:
+                    retry_or_fail(job_id, prompt, str(error), error.retryable)
+                    continue
+                try:
+                    self._finish(job_id, thread_id, prompt, *image)
+                except Exception as e:
+                    retry_or_fail(job_id, prompt, f"❌ 生成图片出错: {e}", True)
+        except ImageGenerationError as e:
+            # 批量请求未能发出 (例如缺少 API Key)
+            for job_id, _ in jobs:
+                self._fail(job_id, str(e))
+
+    def recover(self):
+        """重新领取长时间未完成的任务 (进程重启 / 崩溃遗留)"""
+        pool = get_db_pool()
+        with pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    UPDATE app_image_jobs SET status = 'queued', updated_at = CURRENT_TIMESTAMP
+                    WHERE status IN ('queued', 'running')
+                    AND updated_at < NOW() - make_interval(secs => %s)
+                    RETURNING id, thread_id, prompt
+                    """,
+                    (STALE_JOB_SECONDS,)
+                )
+                stale = cur.fetchall()
+        for job_id, thread_id, prompt in stale:
+            self._submit(job_id, str(thread_id), prompt)
+        if stale:
+            print(f"♻️ 重新提交 {len(stale)} 个未完成的图片任务")
+
+    def get_metrics(self):
+        with self.lock:
+            return dict(self.metrics)
+
+# 已结束 (done / failed) 的任务状态不会再变，缓存在进程内，避免渲染历史时逐个查库
+_finished_jobs = OrderedDict()
+_finished_lock = threading.Lock()
+FINISHED_JOB_CACHE_SIZE = 4096
+
+def get_job(job_id):
+    """查询任务状态"""
+    with _finished_lock:
+        job = _finished_jobs.get(job_id)
+        if job is not None:
+            _finished_jobs.move_to_end(job_id)
+            return job
+
+    pool = get_db_pool()
+    with pool.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                "SELECT id, status, image_id, prompt, error FROM app_image_jobs WHERE id = %s",
+                (job_id,)
+            )
+            row = cur.fetchone()
+    if not row:
+        return None
+    job = {"id": row[0], "status": row[1], "image_id": row[2], "prompt": row[3], "error": row[4]}
+    if job["status"] in ("done", "failed"):
+        with _finished_lock:
+            _finished_jobs[job_id] = job
+            if len(_finished_jobs) > FINISHED_JOB_CACHE_SIZE:
+                _finished_jobs.popitem(last=False)
+    return job
+
+@st.cache_resource
+def get_job_queue():
+    """进程内共享的任务队列 (IMAGE_JOB_WORKERS / IMAGE_JOB_MAX_ATTEMPTS)"""
+    queue = ImageJobQueue(
+        workers=config.get_int_setting("IMAGE_JOB_WORKERS", 2),
+        max_attempts=config.get_int_setting("IMAGE_JOB_MAX_ATTEMPTS", 3)
+    )
+    try:
+        queue.recover()
+    except Exception as e:
+        print(f"⚠️ 恢复图片任务失败: {e}")
+    return queue
@@ -0,0 +1,61 @@
+import io
+import config
+
+# 🖼️ 图片衍生尺寸 (缩略图 / 中图)
+# 保存图片时生成，按展示场景选择最小的合适尺寸，原图仅在用户展开时加载
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+    print("Warning: Pillow not installed, image variants disabled.")
+
+# 变体名称 -> 最长边像素
+VARIANT_SIZES = {
+    "thumb": 320,
+    "medium": 1024,
+}
+
+def get_variant_format():
+    """衍生图编码格式: WEBP | JPEG"""
+    return str(config.get_setting("IMAGE_VARIANT_FORMAT", "WEBP")).upper()
+
+def make_variant(data: bytes, max_side: int, quality: int = 80, fmt=None, force=False):
+    """按最长边缩放并重新编码
+
+    返回 {"bytes", "mime_type", "width", "height"}；
+    原图已经足够小 (且未指定 force) 或无法处理时返回 None (直接使用原图即可)
+    """
+    if Image is None:
+        return None
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            if max(img.size) <= max_side and not force:
+                return None
+            img.thumbnail((max_side, max_side), Image.LANCZOS)
+
+            fmt = (fmt or get_variant_format()).upper()
+            if fmt == "JPEG" and img.mode not in ("RGB", "L"):
+                img = img.convert("RGB")
+            elif img.mode not in ("RGB", "RGBA", "L"):
+                img = img.convert("RGBA")
+
+            buf = io.BytesIO()
+            img.save(buf, format=fmt, quality=quality)
+            return {
+                "bytes": buf.getvalue(),
+                "mime_type": f"image/{fmt.lower()}",
+                "width": img.width,
+                "height": img.height,
+            }
+    except Exception as e:
+        print(f"⚠️ 生成缩略图失败: {e}")
+        return None
+
+def make_derivatives(data: bytes):
+    """生成所有衍生尺寸，返回 {变体名称: 变体数据}"""
+    variants = {}
+    for name, max_side in VARIANT_SIZES.items():
+        variant = make_variant(data, max_side)
+        if variant:
+            variants[name] = variant
+    return variants
@@ -0,0 +1,198 @@
+import argparse
+import hashlib
+import json
+import os
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import config
+
+# 📥 知识库增量导入 (knowledge_base 集合)
+# 目录 -> 生成器分块 -> 批量 Embedding (有界并发) -> 批量 upsert 到 Qdrant
+#   - chunk id 由 (文件路径, chunk 内容 hash) 决定，内容不变的 chunk 直接跳过
+#   - manifest 记录每个文件的 hash 与 chunk id，重复运行时只处理变化的部分
+#   - 已删除的文件 / 已消失的 chunk 会从集合中删除
+# 用法: python ingest.py docs/ [--collection knowledge_base]
+
+SUPPORTED_EXTENSIONS = (".md", ".txt")
+CHUNK_ID_NAMESPACE = uuid.UUID("5f0c3a4e-8d2b-4c1e-9a77-1b6f2d9e4c10")
+
+def get_manifest_path():
+    return config.get_setting("INGEST_MANIFEST", os.path.join("data", "ingest_manifest.json"))
+
+def _sha256(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def iter_documents(root):
+    """逐个读取目录下的文档，生成 (相对路径, 文本, 文件 hash)"""
+    for dirpath, _dirnames, filenames in os.walk(root):
+        for filename in sorted(filenames):
+            if not filename.lower().endswith(SUPPORTED_EXTENSIONS):
+                continue
+            path = os.path.join(dirpath, filename)
+            with open(path, encoding="utf-8") as f:
+                text = f.read()
+            yield os.path.relpath(path, root).replace(os.sep, "/"), text, _sha256(text)
+
+def iter_chunks(text, chunk_size=800, overlap=100):
+    """按段落切分，合并到 chunk_size 字符左右；超长段落按固定窗口切开"""
+    buffer = ""
+    for paragraph in text.split("\n\n"):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        # 放不下时先输出当前块；超长段落直接拼接，交给下面的窗口切分
+        if buffer and len(buffer) + len(paragraph) + 2 > chunk_size and len(paragraph) <= chunk_size:
+            yield buffer
+            # 保留上一块结尾作为重叠上下文
+            buffer = buffer[-overlap:] if overlap else ""
+        buffer = f"{buffer}\n\n{paragraph}" if buffer else paragraph
+        while len(buffer) > chunk_size:
+            yield buffer[:chunk_size]
+            buffer = buffer[chunk_size - overlap:] if overlap else buffer[chunk_size:]
+    if buffer.strip():
+        yield buffer
+
+def chunk_id(rel_path, chunk_hash):
+    return str(uuid.uuid5(CHUNK_ID_NAMESPACE, f"{rel_path}:{chunk_hash}"))
+
+def load_manifest(path):
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    return {"files": {}}
+
+def save_manifest(path, manifest):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+def iter_new_chunks(root, manifest, stats):
+    """生成需要 Embedding 的 chunk，同时更新 manifest 并记录需删除的 chunk id"""
+    seen_files = set()
+    for rel_path, text, file_hash in iter_documents(root):
+        seen_files.add(rel_path)
+        entry = manifest["files"].get(rel_path)
+        if entry and entry["file_hash"] == file_hash:
+            stats["files_unchanged"] += 1
+            continue
+
+        old_ids = set(entry["chunk_ids"]) if entry else set()
+        new_ids = []
+        for index, chunk in enumerate(iter_chunks(text)):
+            chunk_hash = _sha256(chunk)
+            cid = chunk_id(rel_path, chunk_hash)
+            new_ids.append(cid)
+            if cid in old_ids:
+                stats["chunks_unchanged"] += 1
+                continue
+            yield {
+                "id": cid,
+                "text": chunk,
+                "metadata": {"source": rel_path, "chunk_index": index, "content_hash": chunk_hash},
+            }
+
+        stats["delete_ids"].extend(old_ids - set(new_ids))
+        manifest["files"][rel_path] = {"file_hash": file_hash, "chunk_ids": new_ids}
+        stats["files_changed"] += 1
+
+    # 目录中已不存在的文件
+    for rel_path in list(manifest["files"]):
+        if rel_path not in seen_files:
+            stats["delete_ids"].extend(manifest["files"].pop(rel_path)["chunk_ids"])
+            stats["files_removed"] += 1
+
+def _batched(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def ensure_collection(client, collection_name, dim):
+    from qdrant_client.models import Distance, VectorParams
+    if not client.collection_exists(collection_name):
+        client.create_collection(collection_name, vectors_config=VectorParams(size=dim, distance=Distance.COSINE))
+        print(f"🆕 已创建集合 {collection_name} (dim={dim})")
+
+def upsert_batch(client, collection_name, batch, vectors):
+    from qdrant_client.models import PointStruct
+    ensure_collection(client, collection_name, len(vectors[0]))
+    client.upsert(
+        collection_name=collection_name,
+        points=[
+            # payload 键与 langchain_qdrant 默认一致，QdrantVectorStore 可直接检索
+            PointStruct(id=item["id"], vector=vector, payload={"page_content": item["text"], "metadata": item["metadata"]})
+            for item, vector in zip(batch, vectors)
+        ]
+    )
+
+def ingest(root, client, embeddings, collection_name="knowledge_base", batch_size=64, concurrency=4, manifest_path=None):
+    """增量导入目录，返回统计信息"""
+    manifest_path = manifest_path or get_manifest_path()
+    manifest = load_manifest(manifest_path)
+    stats = {
+        "files_changed": 0, "files_unchanged": 0, "files_removed": 0,
+        "chunks_embedded": 0, "chunks_unchanged": 0, "chunks_deleted": 0,
+        "delete_ids": [],
+    }
+    started = time.perf_counter()
+
+    # 流水线：Embedding 并发进行，最多 concurrency * 2 个批次在途
+    in_flight = deque()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for batch in _batched(iter_new_chunks(root, manifest, stats), batch_size):
+            future = executor.submit(embeddings.embed_documents, [item["text"] for item in batch])
+            in_flight.append((batch, future))
+            if len(in_flight) >= concurrency * 2:
+                done_batch, done_future = in_flight.popleft()
+                upsert_batch(client, collection_name, done_batch, done_future.result())
+                stats["chunks_embedded"] += len(done_batch)
+        while in_flight:
+            done_batch, done_future = in_flight.popleft()
+            upsert_batch(client, collection_name, done_batch, done_future.result())
+            stats["chunks_embedded"] += len(done_batch)
+
+    delete_ids = stats.pop("delete_ids")
+    if delete_ids and client.collection_exists(collection_name):
+        from qdrant_client.models import PointIdsList
+        for ids in _batched(delete_ids, 1000):
+            client.delete(collection_name=collection_name, points_selector=PointIdsList(points=ids))
+        stats["chunks_deleted"] = len(delete_ids)
+
+    # 全部写入成功后才保存 manifest，中途失败时下次会重新处理 (upsert 幂等)
+    save_manifest(manifest_path, manifest)
+    stats["seconds"] = round(time.perf_counter() - started, 2)
+    print(f"✅ 知识库导入完成: {stats}")
+    return stats
+
+def main():
+    parser = argparse.ArgumentParser(description="增量导入知识库文档到 Qdrant")
+    parser.add_argument("root", help="文档目录 (.md / .txt)")
+    parser.add_argument("--collection", default="knowledge_base")
+    parser.add_argument("--batch-size", type=int, default=64, help="每批 Embedding 的 chunk 数")
+    parser.add_argument("--concurrency", type=int, default=4, help="并发 Embedding 请求数")
+    parser.add_argument("--manifest", default=None, help="manifest 路径 (默认 INGEST_MANIFEST)")
+    args = parser.parse_args()
+
+    config.init_environment()
+    from langchain_google_genai import GoogleGenerativeAIEmbeddings
+    from tools import EMBEDDING_MODEL, get_qdrant_client
+    ingest(
+        args.root,
+        get_qdrant_client(),
+        GoogleGenerativeAIEmbeddings(model=EMBEDDING_MODEL),
+        collection_name=args.collection,
+        batch_size=args.batch_size,
+        concurrency=args.concurrency,
+        manifest_path=args.manifest
+    )
+
+if __name__ == "__main__":
+    main()
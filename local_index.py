@@ -0,0 +1,175 @@
+import argparse
+import json
+import os
+import time
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+import config
+
+# 📦 进程内向量索引 (替代远程 Qdrant 的低延迟后端)
+# 公司制度语料只有几千个 chunk，直接暴力检索即可：
+#   - vectors.npy：归一化后的向量矩阵，以 mmap 方式加载
+#   - 可选量化：float16 / int8 (int8 额外保存每行缩放系数 scales.npy)
+#   - docs.json：与矩阵行一一对应的 page_content / metadata
+# 通过 `python local_index.py sync` 从 Qdrant 集合同步
+
+QUANTIZATIONS = ("float32", "float16", "int8")
+# 每批参与矩阵乘法的行数 (控制量化矩阵反量化时的临时内存)
+SEARCH_BATCH_ROWS = 8192
+
+def get_index_dir():
+    return config.get_setting("LOCAL_INDEX_DIR", os.path.join("data", "local_index"))
+
+def _normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+class LocalVectorIndex:
+    def __init__(self, vectors, scales, docs, meta):
+        self.vectors = vectors
+        self.scales = scales
+        self.docs = docs
+        self.meta = meta
+
+    @classmethod
+    def load(cls, path=None):
+        path = path or get_index_dir()
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        with open(os.path.join(path, "docs.json"), encoding="utf-8") as f:
+            docs = json.load(f)
+        # 空数组无法 mmap
+        mmap_mode = "r" if docs else None
+        vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode=mmap_mode)
+        scales = None
+        if meta["quantization"] == "int8":
+            scales = np.load(os.path.join(path, "scales.npy"), mmap_mode=mmap_mode)
+        print(f"📦 本地向量索引已加载: {len(docs)} 条, dim={meta['dim']}, {meta['quantization']}")
+        return cls(vectors, scales, docs, meta)
+
+    def search(self, query_vector, k=4):
+        """余弦相似度 Top-K，返回 [(下标, 分数)]"""
+        if not self.docs:
+            return []
+        query = np.asarray(query_vector, dtype=np.float32)
+        query /= (np.linalg.norm(query) or 1.0)
+
+        scores = np.empty(len(self.docs), dtype=np.float32)
+        for start in range(0, len(self.docs), SEARCH_BATCH_ROWS):
+            block = np.asarray(self.vectors[start:start + SEARCH_BATCH_ROWS], dtype=np.float32)
+            block_scores = block @ query
+            if self.scales is not None:
+                block_scores *= self.scales[start:start + SEARCH_BATCH_ROWS]
+            scores[start:start + len(block)] = block_scores
+
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(i), float(scores[i])) for i in top]
+
+class LocalVectorRetriever(BaseRetriever):
+    """与 QdrantVectorStore.as_retriever 接口一致的本地检索器"""
+    index: LocalVectorIndex
+    embeddings: object
+    k: int = 4
+
+    def _get_relevant_documents(self, query, *, run_manager=None):
+        query_vector = self.embeddings.embed_query(query)
+        return [
+            Document(page_content=self.index.docs[i]["page_content"], metadata=self.index.docs[i].get("metadata") or {})
+            for i, _score in self.index.search(query_vector, self.k)
+        ]
+
+def build_index(path, vectors, docs, quantization="float32", source=None):
+    """写入索引文件 (先写临时目录再整体替换，避免读到半成品)"""
+    if quantization not in QUANTIZATIONS:
+        raise ValueError(f"不支持的量化方式: {quantization}")
+    if docs:
+        matrix = _normalize_rows(np.asarray(vectors, dtype=np.float32).reshape(len(docs), -1))
+    else:
+        # 空集合：写入空索引，检索时直接返回空结果
+        matrix = np.zeros((0, 0), dtype=np.float32)
+
+    tmp_path = f"{path}.tmp"
+    os.makedirs(tmp_path, exist_ok=True)
+    if quantization == "int8":
+        # 对称量化：每行按最大绝对值缩放到 [-127, 127]
+        scales = np.abs(matrix).max(axis=1, initial=0.0) / 127.0
+        scales[scales == 0] = 1.0
+        np.save(os.path.join(tmp_path, "vectors.npy"), np.round(matrix / scales[:, None]).astype(np.int8))
+        np.save(os.path.join(tmp_path, "scales.npy"), scales.astype(np.float32))
+    else:
+        np.save(os.path.join(tmp_path, "vectors.npy"), matrix.astype(quantization))
+
+    with open(os.path.join(tmp_path, "docs.json"), "w", encoding="utf-8") as f:
+        json.dump(docs, f, ensure_ascii=False)
+    with open(os.path.join(tmp_path, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({
+            "dim": int(matrix.shape[1]) if len(docs) else 0,
+            "count": len(docs),
+            "quantization": quantization,
+            "source": source,
+            "synced_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        }, f, ensure_ascii=False)
+
+    # 替换旧索引
+    if os.path.exists(path):
+        old_path = f"{path}.old"
+        os.replace(path, old_path)
+        os.replace(tmp_path, path)
+        for name in os.listdir(old_path):
+            os.remove(os.path.join(old_path, name))
+        os.rmdir(old_path)
+    else:
+        os.replace(tmp_path, path)
+
+def sync_from_qdrant(client, collection_name, path=None, quantization="float32", batch_size=256):
+    """从 Qdrant 集合拉取全部向量与 payload，重建本地索引"""
+    path = path or get_index_dir()
+    vectors, docs = [], []
+    offset = None
+    while True:
+        points, offset = client.scroll(
+            collection_name=collection_name,
+            limit=batch_size,
+            offset=offset,
+            with_payload=True,
+            with_vectors=True
+        )
+        for point in points:
+            vector = point.vector
+            if isinstance(vector, dict):
+                # 命名向量：langchain_qdrant 默认使用空名称
+                vector = vector.get("") or next(iter(vector.values()))
+            payload = point.payload or {}
+            vectors.append(vector)
+            docs.append({
+                "id": str(point.id),
+                "page_content": payload.get("page_content", ""),
+                "metadata": payload.get("metadata") or {},
+            })
+        if offset is None:
+            break
+
+    build_index(path, vectors, docs, quantization, source=collection_name)
+    print(f"✅ 已从 Qdrant 同步 {len(docs)} 条向量到 {path} ({quantization})")
+    return len(docs)
+
+def main():
+    parser = argparse.ArgumentParser(description="本地向量索引工具")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    sync_parser = subparsers.add_parser("sync", help="从 Qdrant 集合同步")
+    sync_parser.add_argument("--collection", default="knowledge_base")
+    sync_parser.add_argument("--path", default=None, help="索引目录 (默认 LOCAL_INDEX_DIR)")
+    sync_parser.add_argument("--quantization", choices=QUANTIZATIONS, default="float32")
+    args = parser.parse_args()
+
+    config.init_environment()
+    if args.command == "sync":
+        from tools import get_qdrant_client
+        sync_from_qdrant(get_qdrant_client(), args.collection, args.path, args.quantization)
+
+if __name__ == "__main__":
+    main()
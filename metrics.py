@@ -0,0 +1,287 @@
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import streamlit as st
+from langchain_core.callbacks import BaseCallbackHandler
+import config
+
+# 📊 运行时指标
+# - 直方图：Graph 节点、单次工具调用、LLM 调用、数据库查询 / 连接池等待、历史恢复各阶段
+# - 计数器：每次 LLM 调用的输入 / 输出 token
+# - 采集器：连接池、图片任务、工具缓存等组件的即时状态
+# 导出：Prometheus 文本格式，METRICS_PORT 开启 HTTP 端点 (/metrics)，
+#       METRICS_FILE 定期写入文件 (兼容 node_exporter textfile collector)
+
+# 耗时直方图的桶 (秒)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# 单次 LLM 调用 token 数的桶
+TOKEN_BUCKETS = (100, 500, 1000, 2000, 4000, 8000, 16000, 32000, 64000)
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+_histograms = {}
+_counters = {}
+_collectors = {}
+_lock = threading.Lock()
+
+def _key(name, labels):
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+def observe(name, value, buckets=LATENCY_BUCKETS, **labels):
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = Histogram(buckets)
+        histogram.observe(value)
+
+def inc(name, value=1, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+@contextmanager
+def timed(name, **labels):
+    """记录代码块耗时 (秒) 到直方图"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - started, **labels)
+
+@contextmanager
+def db_connection(pool, query):
+    """从连接池取连接，分别记录等待连接与持有连接 (执行查询) 的耗时"""
+    started = time.perf_counter()
+    with pool.connection() as conn:
+        acquired = time.perf_counter()
+        observe("db_pool_wait_seconds", acquired - started, query=query)
+        try:
+            yield conn
+        finally:
+            observe("db_query_seconds", time.perf_counter() - acquired, query=query)
+
+def register_collector(name, collect):
+    """注册即时状态采集函数，collect() 返回 {指标名: 数值}，导出时调用"""
+    with _lock:
+        _collectors[name] = collect
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+def _format_number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def render_prometheus():
+    """以 Prometheus 文本格式输出全部指标"""
+    with _lock:
+        histograms = {key: (h.buckets, list(h.counts), h.sum, h.count) for key, h in _histograms.items()}
+        counters = dict(_counters)
+        collectors = dict(_collectors)
+
+    lines = []
+    typed = set()
+    for (name, labels), (buckets, counts, total, count) in sorted(histograms.items()):
+        if name not in typed:
+            lines.append(f"# TYPE {name} histogram")
+            typed.add(name)
+        cumulative = 0
+        for bound, bucket_count in zip(list(buckets) + ["+Inf"], counts):
+            cumulative += bucket_count
+            lines.append(f"{name}_bucket{_format_labels(labels, [('le', bound)])} {cumulative}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {_format_number(total)}")
+        lines.append(f"{name}_count{_format_labels(labels)} {count}")
+
+    for (name, labels), value in sorted(counters.items()):
+        if name not in typed:
+            lines.append(f"# TYPE {name} counter")
+            typed.add(name)
+        lines.append(f"{name}{_format_labels(labels)} {_format_number(value)}")
+
+    for component, collect in sorted(collectors.items()):
+        try:
+            values = collect()
+        except Exception as e:
+            print(f"⚠️ 指标采集失败 ({component}): {e}")
+            continue
+        for field, value in sorted(values.items()):
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                name = f"{component}_{field}"
+                lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name} {_format_number(value)}")
+    return "\n".join(lines) + "\n"
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def _write_file(path):
+    # 先写临时文件再原子替换，避免采集端读到半个文件
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(render_prometheus())
+    os.replace(tmp_path, path)
+
+@st.cache_resource
+def start_exporter():
+    """按配置启动导出 (进程内只启动一次)：METRICS_PORT -> HTTP 端点，METRICS_FILE -> 定期写文件"""
+    port = config.get_int_setting("METRICS_PORT", 0)
+    if port:
+        try:
+            server = ThreadingHTTPServer(("0.0.0.0", port), _MetricsHandler)
+            threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+            print(f"📊 指标端点已启动: http://0.0.0.0:{port}/metrics")
+        except OSError as e:
+            print(f"⚠️ 指标端点启动失败: {e}")
+
+    path = config.get_setting("METRICS_FILE")
+    if path:
+        interval = config.get_int_setting("METRICS_FILE_INTERVAL", 15)
+
+        def loop():
+            while True:
+                try:
+                    _write_file(path)
+                except Exception as e:
+                    print(f"⚠️ 指标文件写入失败: {e}")
+                time.sleep(interval)
+
+        threading.Thread(target=loop, name="metrics-file", daemon=True).start()
+        print(f"📊 指标文件导出: {path} (每 {interval} 秒)")
+    return True
+
+# 上下文摘要模型调用的标签 (context_window 设置)：单独计入摘要指标，不算作本轮 LLM 调用
+SUMMARY_TAG = "context_summary"
+
+class TurnMetrics(BaseCallbackHandler):
+    """单轮对话的回调：记录节点 / 工具 / LLM 耗时与 token，同时写入全局直方图
+
+    用法: config["callbacks"] = [TurnMetrics()]，结束后 breakdown() 获取本轮明细
+    """
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.lock = threading.Lock()
+        self.running = {}
+        self.entries = []
+
+    def _start(self, run_id, kind, name, **extra):
+        with self.lock:
+            self.running[run_id] = (kind, name, time.perf_counter(), extra)
+
+    def _end(self, run_id, error=False, **extra):
+        with self.lock:
+            run = self.running.pop(run_id, None)
+        if run is None:
+            return None
+        kind, name, started, start_extra = run
+        entry = {"kind": kind, "name": name, "seconds": time.perf_counter() - started, "error": error, **start_extra, **extra}
+        with self.lock:
+            self.entries.append(entry)
+        return entry
+
+    # --- Graph 节点 ---
+    def on_chain_start(self, serialized, inputs, *, run_id, metadata=None, **kwargs):
+        node = (metadata or {}).get("langgraph_node")
+        # 节点内部的子链同样携带 langgraph_node，只统计节点本身
+        if node and kwargs.get("name") == node:
+            self._start(run_id, "node", node)
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        entry = self._end(run_id)
+        if entry:
+            observe("graph_node_seconds", entry["seconds"], node=entry["name"])
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        entry = self._end(run_id, error=True)
+        if entry:
+            observe("graph_node_seconds", entry["seconds"], node=entry["name"])
+            inc("graph_node_errors_total", node=entry["name"])
+
+    # --- 工具调用 ---
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        name = kwargs.get("name") or (serialized or {}).get("name", "unknown")
+        self._start(run_id, "tool", name)
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        entry = self._end(run_id)
+        if entry:
+            observe("tool_call_seconds", entry["seconds"], tool=entry["name"])
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        entry = self._end(run_id, error=True)
+        if entry:
+            observe("tool_call_seconds", entry["seconds"], tool=entry["name"])
+            inc("tool_call_errors_total", tool=entry["name"])
+
+    # --- LLM 调用 ---
+    def _start_llm(self, run_id, metadata, tags):
+        kind = "summary" if SUMMARY_TAG in (tags or []) else "llm"
+        self._start(run_id, kind, (metadata or {}).get("ls_model_name", "unknown"))
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, metadata=None, tags=None, **kwargs):
+        self._start_llm(run_id, metadata, tags)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, metadata=None, tags=None, **kwargs):
+        self._start_llm(run_id, metadata, tags)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        input_tokens = output_tokens = 0
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+                input_tokens += usage.get("input_tokens", 0)
+                output_tokens += usage.get("output_tokens", 0)
+        entry = self._end(run_id, input_tokens=input_tokens, output_tokens=output_tokens)
+        if entry and entry["kind"] == "summary":
+            observe("context_summary_seconds", entry["seconds"], model=entry["name"])
+            inc("context_summary_tokens_total", input_tokens, model=entry["name"], direction="input")
+            inc("context_summary_tokens_total", output_tokens, model=entry["name"], direction="output")
+        elif entry:
+            model = entry["name"]
+            observe("llm_call_seconds", entry["seconds"], model=model)
+            observe("llm_call_tokens", input_tokens + output_tokens, buckets=TOKEN_BUCKETS, model=model)
+            inc("llm_tokens_total", input_tokens, model=model, direction="input")
+            inc("llm_tokens_total", output_tokens, model=model, direction="output")
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        entry = self._end(run_id, error=True)
+        if entry and entry["kind"] == "summary":
+            observe("context_summary_seconds", entry["seconds"], model=entry["name"])
+            inc("context_summary_errors_total", model=entry["name"])
+        elif entry:
+            observe("llm_call_seconds", entry["seconds"], model=entry["name"])
+            inc("llm_call_errors_total", model=entry["name"])
+
+    def breakdown(self):
+        """本轮明细：{"total": 秒, "entries": [{kind, name, seconds, ...}]} (按结束顺序)"""
+        with self.lock:
+            entries = list(self.entries)
+        return {"total": time.perf_counter() - self.started, "entries": entries}
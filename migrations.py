@@ -0,0 +1,232 @@
+import argparse
+import threading
+from database import get_db_pool
+
+# 🗃️ 数据库迁移
+# - 编号迁移按顺序执行，已执行的版本记录在 schema_version 表
+# - pg_advisory_lock 保证多进程部署时只有一个进程在迁移
+# - 进程内只执行一次 (Streamlit 每次 rerun 不再重复执行 DDL)
+# - CLI: python migrations.py [--status]
+# 新增表结构时在 MIGRATIONS 末尾追加新版本，不要修改已发布的迁移
+
+ADVISORY_LOCK_KEY = 7_301_000
+
+# (版本号, 说明, SQL 列表)
+# 早期版本使用 IF NOT EXISTS，兼容迁移机制引入之前就已建表的部署
+MIGRATIONS = [
+    (1, "用户 / 对话 / 图片基础表", [
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            id SERIAL PRIMARY KEY,
+            username TEXT UNIQUE NOT NULL,
+            password_hash TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        """,
+        # 记录 thread_id 和 user_id 的关系
+        """
+        CREATE TABLE IF NOT EXISTS user_threads (
+            thread_id UUID PRIMARY KEY,
+            user_id INTEGER REFERENCES users(id),
+            title TEXT,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS app_images (
+            id SERIAL PRIMARY KEY,
+            thread_id UUID NOT NULL,
+            prompt TEXT,
+            base64_data TEXT,
+            mime_type TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_user_threads_user_id ON user_threads(user_id);",
+        "CREATE INDEX IF NOT EXISTS idx_app_images_thread_id ON app_images(thread_id);",
+    ]),
+    (2, "内容寻址 blob 存储", [
+        # app_images 只保存元数据，图片内容通过 blob_hash 指向 app_blobs / 本地磁盘
+        # base64_data 仅保留用于读取旧数据
+        "ALTER TABLE app_images ADD COLUMN IF NOT EXISTS blob_hash TEXT;",
+        "ALTER TABLE app_images ADD COLUMN IF NOT EXISTS size_bytes INTEGER;",
+        """
+        CREATE TABLE IF NOT EXISTS app_blobs (
+            sha256 TEXT PRIMARY KEY,
+            data BYTEA NOT NULL,
+            size_bytes INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        """,
+    ]),
+    (3, "图片衍生尺寸 (缩略图 / 中图)", [
+        """
+        CREATE TABLE IF NOT EXISTS app_image_variants (
+            image_id INTEGER REFERENCES app_images(id) ON DELETE CASCADE,
+            variant TEXT NOT NULL,
+            blob_hash TEXT NOT NULL,
+            mime_type TEXT,
+            width INTEGER,
+            height INTEGER,
+            size_bytes INTEGER,
+            PRIMARY KEY (image_id, variant)
+        );
+        """,
+    ]),
+    (4, "已渲染历史缓存", [
+        """
+        CREATE TABLE IF NOT EXISTS app_history_cache (
+            thread_id UUID PRIMARY KEY,
+            checkpoint_id TEXT NOT NULL,
+            message_count INTEGER NOT NULL,
+            last_message_id TEXT,
+            pending_image_ids JSONB,
+            display JSONB NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        """,
+    ]),
+    (5, "Embedding 缓存", [
+        # key = 模型 + 用途 + 归一化文本的 SHA-256
+        """
+        CREATE TABLE IF NOT EXISTS app_embedding_cache (
+            key TEXT PRIMARY KEY,
+            model TEXT NOT NULL,
+            vector BYTEA NOT NULL,
+            dim INTEGER NOT NULL,
+            hits INTEGER DEFAULT 0,
+            last_used_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_app_embedding_cache_last_used ON app_embedding_cache(last_used_at);",
+    ]),
+    (6, "对话列表 keyset 分页索引", [
+        "CREATE INDEX IF NOT EXISTS idx_user_threads_user_updated ON user_threads(user_id, updated_at DESC, thread_id DESC);",
+        # 新索引已覆盖 user_id 前缀查询
+        "DROP INDEX IF EXISTS idx_user_threads_user_id;",
+    ]),
+    (7, "后台图片生成任务", [
+        """
+        CREATE TABLE app_image_jobs (
+            id SERIAL PRIMARY KEY,
+            thread_id UUID NOT NULL,
+            prompt TEXT NOT NULL,
+            status TEXT NOT NULL,
+            attempts INTEGER DEFAULT 0,
+            image_id INTEGER REFERENCES app_images(id) ON DELETE SET NULL,
+            error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        """,
+        "CREATE INDEX idx_app_image_jobs_thread_id ON app_image_jobs(thread_id);",
+        "CREATE INDEX idx_app_image_jobs_pending ON app_image_jobs(updated_at) WHERE status IN ('queued', 'running');",
+        # 历史缓存中的待附加图片改为存储展示用的图片 / 任务引用，旧缓存格式作废
+        "ALTER TABLE app_history_cache RENAME COLUMN pending_image_ids TO pending_images;",
+        "DELETE FROM app_history_cache;",
+    ]),
+    (8, "插图 prompt 去重", [
+        # prompt_hash = sha256(模型 + 归一化 prompt)，用于复用相同描述的已有图片
+        "ALTER TABLE app_images ADD COLUMN prompt_hash TEXT;",
+        "ALTER TABLE app_images ADD COLUMN model TEXT;",
+        "CREATE INDEX idx_app_images_prompt_hash ON app_images(prompt_hash, created_at DESC) WHERE prompt_hash IS NOT NULL;",
+    ]),
+    (9, "上传图片引用 (孤立 blob 清理)", [
+        # 上传图片只以 blob_ref 形式存在于 checkpoint 中，这里单独记录引用，供 checkpoint_gc 判断 blob 是否仍被使用
+        # (blob_ref 上传与本表同时引入，无需从已有 checkpoint 回填)
+        """
+        CREATE TABLE app_upload_refs (
+            thread_id UUID NOT NULL,
+            blob_hash TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (thread_id, blob_hash)
+        );
+        """,
+        "CREATE INDEX idx_app_upload_refs_blob_hash ON app_upload_refs(blob_hash);",
+        "CREATE INDEX idx_app_images_blob_hash ON app_images(blob_hash);",
+        "CREATE INDEX idx_app_image_variants_blob_hash ON app_image_variants(blob_hash);",
+    ]),
+]
+
+_migrated = False
+_migrate_lock = threading.Lock()
+
+def _ensure_version_table(cur):
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    """)
+
+def get_current_version(cur):
+    cur.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+    return cur.fetchone()[0]
+
+def setup_checkpointer(pool):
+    """创建 / 升级 LangGraph checkpoint 表 (由 langgraph 自己的迁移表管理版本)"""
+    from langgraph.checkpoint.postgres import PostgresSaver
+    PostgresSaver(pool).setup()
+
+def migrate(pool=None):
+    """执行所有未执行的迁移，返回执行的版本号列表"""
+    pool = pool or get_db_pool()
+    applied = []
+    with pool.connection() as conn:
+        with conn.cursor() as cur:
+            # 阻塞等待其他进程完成迁移
+            cur.execute("SELECT pg_advisory_lock(%s)", (ADVISORY_LOCK_KEY,))
+            try:
+                _ensure_version_table(cur)
+                current = get_current_version(cur)
+                for version, name, statements in MIGRATIONS:
+                    if version <= current:
+                        continue
+                    # 每个迁移一个事务，失败时整体回滚
+                    with conn.transaction():
+                        for sql in statements:
+                            cur.execute(sql)
+                        cur.execute("INSERT INTO schema_version (version, name) VALUES (%s, %s)", (version, name))
+                    applied.append(version)
+                    print(f"🗃️ 已执行迁移 {version}: {name}")
+
+                setup_checkpointer(pool)
+            finally:
+                cur.execute("SELECT pg_advisory_unlock(%s)", (ADVISORY_LOCK_KEY,))
+    return applied
+
+def ensure_schema():
+    """进程内只执行一次迁移 (后续调用直接返回)"""
+    global _migrated
+    if _migrated:
+        return
+    with _migrate_lock:
+        if _migrated:
+            return
+        migrate()
+        _migrated = True
+
+def main():
+    parser = argparse.ArgumentParser(description="执行数据库迁移")
+    parser.add_argument("--status", action="store_true", help="只显示当前版本，不执行迁移")
+    args = parser.parse_args()
+
+    import config
+    config.init_environment()
+    pool = get_db_pool()
+    if args.status:
+        with pool.connection() as conn:
+            with conn.cursor() as cur:
+                _ensure_version_table(cur)
+                current = get_current_version(cur)
+        latest = MIGRATIONS[-1][0]
+        print(f"当前版本: {current}，最新版本: {latest}" + ("" if current >= latest else f" (待执行 {latest - current} 个迁移)"))
+        return
+
+    applied = migrate(pool)
+    print(f"✅ 迁移完成，本次执行 {len(applied)} 个: {applied}" if applied else "✅ 已是最新版本")
+
+if __name__ == "__main__":
+    main()
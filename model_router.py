@@ -0,0 +1,187 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+import config
+import metrics
+from context_window import estimate_content_tokens
+
+# 🧭 模型路由：每一步按廉价特征在快速模型与 pro 模型之间选择
+# 特征：用户消息长度、是否带图片、本轮已调用工具的回合数、上一条是否为工具结果、历史 token 数、关键词
+# 快速模型调用失败或输出无效 (空回复 / 未知工具 / 参数无法解析) 时自动升级到 pro 模型重试
+# 配置 ROUTER_LOG 时每次决策写入该文件 (JSONL)，用于离线调整阈值；未配置时不记录
+
+# 需要较强推理 / 长输出的请求
+COMPLEX_KEYWORDS = ("分析", "比较", "对比", "方案", "计划", "总结", "为什么", "推理", "代码", "写一", "撰写", "翻译", "详细")
+# 日历工具对参数格式要求严格 (见 SYSTEM_PROMPT)，交给 pro 模型
+STRICT_TOOL_KEYWORDS = ("日程", "日历", "会议", "安排", "calendar")
+
+def extract_features(messages):
+    """从即将发送给模型的消息列表中提取特征 (只做字符串 / 计数运算，结果直接写入决策日志)"""
+    last_human = None
+    tool_rounds = 0
+    for msg in reversed(messages):
+        if isinstance(msg, HumanMessage):
+            last_human = msg
+            break
+        if isinstance(msg, AIMessage) and msg.tool_calls:
+            tool_rounds += 1
+
+    text = ""
+    has_image = False
+    if last_human is not None:
+        content = last_human.content
+        if isinstance(content, list):
+            text = "".join(p if isinstance(p, str) else p.get("text", "") for p in content)
+            has_image = any(isinstance(p, dict) and p.get("type") != "text" for p in content)
+        else:
+            text = str(content)
+
+    return dict(
+        chars=len(text),
+        has_image=has_image,
+        tool_rounds=tool_rounds,
+        after_tool=bool(messages) and isinstance(messages[-1], ToolMessage),
+        history_tokens=sum(estimate_content_tokens(m.content) for m in messages),
+        complex=any(k in text for k in COMPLEX_KEYWORDS),
+        strict_tools=any(k in text.lower() for k in STRICT_TOOL_KEYWORDS),
+    )
+
+def choose(features):
+    """返回 ("fast" | "pro", 原因)"""
+    if features["has_image"]:
+        return "pro", "image"
+    if features["tool_rounds"] >= config.get_int_setting("ROUTER_PRO_TOOL_ROUNDS", 2):
+        return "pro", "multi_step_tools"
+    if features["history_tokens"] > config.get_int_setting("ROUTER_PRO_HISTORY_TOKENS", 12000):
+        return "pro", "long_history"
+    if features["chars"] > config.get_int_setting("ROUTER_PRO_CHARS", 400):
+        return "pro", "long_message"
+    if features["complex"]:
+        return "pro", "complex_request"
+    if features["strict_tools"]:
+        return "pro", "strict_tools"
+    if features["after_tool"]:
+        return "fast", "summarize_tool_result"
+    return "fast", "simple"
+
+def validate(response, tool_names):
+    """检查快速模型的输出，返回问题描述 (None 表示可用)"""
+    if getattr(response, "invalid_tool_calls", None):
+        return "invalid_tool_call"
+    for tool_call in response.tool_calls or []:
+        if tool_call["name"] not in tool_names:
+            return "unknown_tool"
+    content = response.content
+    if isinstance(content, list):
+        content = "".join(p if isinstance(p, str) else p.get("text", "") for p in content)
+    if not response.tool_calls and not str(content).strip():
+        return "empty_response"
+    return None
+
+class DecisionLog:
+    """决策日志 (JSONL，追加写入；path 为空时不记录)"""
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def write(self, record):
+        if not self.path:
+            return
+        try:
+            line = json.dumps(record, ensure_ascii=False, default=str)
+            with self.lock:
+                directory = os.path.dirname(self.path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(line + "\n")
+        except Exception as e:
+            print(f"⚠️ 路由日志写入失败: {e}")
+
+class ModelRouter:
+    """fast / pro 为已绑定工具的模型；fast 为 None 时始终使用 pro"""
+    def __init__(self, fast, pro, tool_names, fast_name="fast", pro_name="pro", log_path=None):
+        self.models = {"fast": fast, "pro": pro}
+        self.names = {"fast": fast_name, "pro": pro_name}
+        self.tool_names = set(tool_names)
+        self.log = DecisionLog(log_path)
+
+    def _decide(self, messages):
+        features = extract_features(messages)
+        if self.models["fast"] is None:
+            return features, "pro", "router_disabled"
+        tier, reason = choose(features)
+        return features, tier, reason
+
+    def _record(self, config, features, tier, reason, final_tier, escalation, started):
+        """更新指标，返回需要写入决策日志的记录 (未开启日志时为 None)"""
+        configurable = (config or {}).get("configurable", {})
+        latency_ms = round((time.perf_counter() - started) * 1000, 1)
+        metrics.inc("model_route_total", tier=tier, reason=reason)
+        if escalation:
+            metrics.inc("model_route_escalations_total", reason=escalation)
+        if not self.log.path:
+            return None
+        return {
+            "ts": datetime.now().isoformat(timespec="milliseconds"),
+            "thread_id": configurable.get("thread_id"),
+            "turn_id": configurable.get("turn_id"),
+            "features": features,
+            "tier": tier,
+            "reason": reason,
+            "model": self.names[final_tier],
+            "escalation": escalation,
+            "latency_ms": latency_ms,
+        }
+
+    def _write_log(self, record):
+        if record is not None:
+            self.log.write(record)
+
+    async def _awrite_log(self, record):
+        # 文件写入放到线程池，不阻塞共享事件循环
+        if record is not None:
+            await asyncio.get_running_loop().run_in_executor(None, self.log.write, record)
+
+    def invoke(self, messages, config=None):
+        features, tier, reason = self._decide(messages)
+        started = time.perf_counter()
+        escalation = None
+        if tier == "fast":
+            try:
+                response = self.models["fast"].invoke(messages, config)
+                escalation = validate(response, self.tool_names)
+            except Exception as e:
+                escalation = f"error: {type(e).__name__}"
+            if escalation is None:
+                self._write_log(self._record(config, features, tier, reason, "fast", None, started))
+                return response
+            print(f"⤴️ 快速模型结果不可用 ({escalation})，升级到 {self.names['pro']}")
+
+        response = self.models["pro"].invoke(messages, config)
+        self._write_log(self._record(config, features, tier, reason, "pro", escalation, started))
+        return response
+
+    async def ainvoke(self, messages, config=None):
+        """invoke 的异步版本"""
+        features, tier, reason = self._decide(messages)
+        started = time.perf_counter()
+        escalation = None
+        if tier == "fast":
+            try:
+                response = await self.models["fast"].ainvoke(messages, config)
+                escalation = validate(response, self.tool_names)
+            except Exception as e:
+                escalation = f"error: {type(e).__name__}"
+            if escalation is None:
+                await self._awrite_log(self._record(config, features, tier, reason, "fast", None, started))
+                return response
+            print(f"⤴️ 快速模型结果不可用 ({escalation})，升级到 {self.names['pro']}")
+
+        response = await self.models["pro"].ainvoke(messages, config)
+        await self._awrite_log(self._record(config, features, tier, reason, "pro", escalation, started))
+        return response
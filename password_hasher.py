@@ -0,0 +1,80 @@
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FuturesTimeout
+import bcrypt
+
+# 🔑 密码哈希进程池
+# bcrypt 是刻意设计的 CPU 密集运算，放在 Streamlit 脚本线程里会在登录高峰时拖慢所有聊天会话
+# 这里把 hashpw / checkpw 放到有界进程池中执行，排队过多时直接拒绝
+# 注意：本模块会在子进程中被导入，模块级不要引入 streamlit / config 等重依赖
+
+class HasherBusy(Exception):
+    """哈希队列已满"""
+
+class HasherTimeout(Exception):
+    """哈希任务在 timeout 内未完成 (进程池过载)"""
+
+def _hash(password: bytes, rounds: int) -> str:
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds=rounds)).decode("utf-8")
+
+def _check(password: bytes, hashed: bytes) -> bool:
+    return bcrypt.checkpw(password, hashed)
+
+def get_rounds(hashed: str) -> int:
+    """解析哈希中的 work factor ($2b$12$... -> 12)"""
+    try:
+        return int(hashed.split("$")[2])
+    except (IndexError, ValueError):
+        return 0
+
+class PasswordHasher:
+    def __init__(self, workers, max_pending, timeout, rounds):
+        # spawn：避免在多线程的 Web 进程中 fork
+        self.executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.timeout = timeout
+        self.rounds = rounds
+
+    def _submit(self, fn, *args):
+        if not self.slots.acquire(blocking=False):
+            raise HasherBusy()
+        try:
+            future = self.executor.submit(fn, *args)
+        except BaseException:
+            self.slots.release()
+            raise
+        # 名额在任务真正结束时才释放：超时返回后子进程可能仍在计算，提前释放会让排队数超过上限
+        future.add_done_callback(lambda _: self.slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except FuturesTimeout:
+            # 仍在排队的任务直接取消；已在运行的无法中断，由回调在结束时释放名额
+            future.cancel()
+            raise HasherTimeout() from None
+
+    def hash(self, password: str) -> str:
+        return self._submit(_hash, password.encode("utf-8"), self.rounds)
+
+    def verify(self, password: str, hashed: str) -> bool:
+        return self._submit(_check, password.encode("utf-8"), hashed.encode("utf-8"))
+
+    def needs_rehash(self, hashed: str) -> bool:
+        return get_rounds(hashed) != self.rounds
+
+_hasher = None
+_hasher_lock = threading.Lock()
+
+def get_hasher():
+    """进程内共享的哈希器 (BCRYPT_WORKERS / BCRYPT_MAX_PENDING / BCRYPT_TIMEOUT / BCRYPT_ROUNDS)"""
+    global _hasher
+    if _hasher is None:
+        with _hasher_lock:
+            if _hasher is None:
+                import config
+                _hasher = PasswordHasher(
+                    workers=config.get_int_setting("BCRYPT_WORKERS", 2),
+                    max_pending=config.get_int_setting("BCRYPT_MAX_PENDING", 8),
+                    timeout=config.get_int_setting("BCRYPT_TIMEOUT", 10),
+                    rounds=config.get_int_setting("BCRYPT_ROUNDS", 12)
+                )
+    return _hasher
@@ -0,0 +1,36 @@
+import threading
+import time
+from collections import deque
+
+# 🚦 滑动窗口限流 (进程内)
+# 用于登录 / 注册的准入控制：超过次数的请求在进行任何密码哈希之前就被拒绝
+
+class SlidingWindowLimiter:
+    def __init__(self, max_attempts, window_seconds, max_keys=100_000):
+        self.max_attempts = max_attempts
+        self.window_seconds = window_seconds
+        self.max_keys = max_keys
+        self.attempts = {}  # key -> deque[时间戳]
+        self.lock = threading.Lock()
+
+    def _prune(self, now):
+        # key 过多时清理已过期的记录，防止撞库攻击撑爆内存
+        cutoff = now - self.window_seconds
+        for key in [k for k, q in self.attempts.items() if not q or q[-1] < cutoff]:
+            del self.attempts[key]
+
+    def allow(self, key) -> bool:
+        """记录一次尝试，超过窗口内上限时返回 False"""
+        if key is None:
+            return True
+        now = time.monotonic()
+        with self.lock:
+            history = self.attempts.setdefault(key, deque())
+            while history and history[0] < now - self.window_seconds:
+                history.popleft()
+            if len(history) >= self.max_attempts:
+                return False
+            history.append(now)
+            if len(self.attempts) > self.max_keys:
+                self._prune(now)
+            return True
@@ -0,0 +1,85 @@
+import importlib
+import threading
+import time
+from contextlib import contextmanager
+
+# ⏱️ 冷启动耗时记录
+# 记录模块导入、各工具初始化、Graph 构建等阶段的耗时
+# 用法: python startup_profile.py  (逐个导入重型依赖并初始化全部工具，打印耗时报告)
+
+_timings = {}
+_lock = threading.Lock()
+
+# 冷启动时最重的依赖 (按 web_app 的导入顺序)
+HEAVY_MODULES = [
+    "streamlit",
+    "langchain_core",
+    "langgraph",
+    "langchain_google_genai",
+    "langchain_community.tools",
+    "langchain_community.agent_toolkits",
+    "langchain_google_community",
+    "langchain_qdrant",
+    "qdrant_client",
+    "psycopg_pool",
+]
+
+def record(phase, seconds):
+    with _lock:
+        _timings[phase] = seconds
+
+def record_once(phase, seconds):
+    """只记录首次耗时 (Streamlit rerun 时模块已缓存，后续耗时没有意义)"""
+    with _lock:
+        _timings.setdefault(phase, seconds)
+
+@contextmanager
+def timed(phase):
+    """记录一个阶段的耗时"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(phase, time.perf_counter() - started)
+
+def get_timings():
+    with _lock:
+        return dict(_timings)
+
+def format_report():
+    """按耗时从高到低输出报告"""
+    timings = get_timings()
+    if not timings:
+        return "(暂无启动耗时记录)"
+    width = max(len(phase) for phase in timings)
+    lines = [f"{phase.ljust(width)}  {seconds * 1000:9.1f} ms" for phase, seconds in sorted(timings.items(), key=lambda item: -item[1])]
+    return "\n".join(lines)
+
+def print_report():
+    print("⏱️ 启动耗时报告:\n" + format_report())
+
+def main():
+    for module in HEAVY_MODULES:
+        with timed(f"import:{module}"):
+            try:
+                importlib.import_module(module)
+            except ImportError as e:
+                print(f"⚠️ 无法导入 {module}: {e}")
+
+    import config
+    config.init_environment()
+    with timed("import:tools"):
+        import tools
+    with timed("tools:get_all_tools"):
+        tool_list = tools.get_all_tools()
+    # 知识库检索器是懒加载的，这里主动初始化一次以测量后端耗时
+    with timed("tool:search_company_policy"):
+        try:
+            tools.get_policy_retriever(tools.get_embeddings())
+        except Exception as e:
+            print(f"⚠️ 知识库检索器初始化失败: {e}")
+    print(f"🧰 共加载 {len(tool_list)} 个工具")
+    print_report()
+
+if __name__ == "__main__":
+    main()
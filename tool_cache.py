@@ -0,0 +1,150 @@
+import asyncio
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any
+import streamlit as st
+from langchain_core.runnables import RunnableConfig
+from langchain_core.tools import BaseTool
+import config
+
+# ⏱️ 外部工具结果缓存 (TTL + LRU + single-flight)
+# Key = 工具名 + 归一化参数 + 用户范围
+# 同一 key 的并发调用只执行一次，其余调用等待同一结果
+
+def _normalize(value):
+    if isinstance(value, str):
+        return re.sub(r"\s+", " ", value).strip()
+    if isinstance(value, dict):
+        return {k: _normalize(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v) for v in value]
+    return value
+
+def make_key(tool_name, args, scope_value):
+    normalized = json.dumps(_normalize(args), sort_keys=True, ensure_ascii=False, default=str)
+    return f"{tool_name}|{scope_value}|{normalized}"
+
+def _size_of(value):
+    return len(str(value).encode("utf-8"))
+
+class ToolResultCache:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.entries = OrderedDict()  # key -> (过期时间, 结果, 字节数)
+        self.in_flight = {}           # key -> Future
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "coalesced": 0, "evictions": 0}
+
+    def _remove(self, key):
+        _expires_at, _value, size = self.entries.pop(key)
+        self.total_bytes -= size
+
+    def _store(self, key, value, ttl):
+        size = _size_of(value)
+        if size > self.max_bytes:
+            return
+        if key in self.entries:
+            self._remove(key)
+        self.entries[key] = (time.monotonic() + ttl, value, size)
+        self.total_bytes += size
+        while self.total_bytes > self.max_bytes:
+            self._remove(next(iter(self.entries)))
+            self.stats["evictions"] += 1
+
+    def get_or_compute(self, key, ttl, compute, cacheable=None):
+        """cacheable(结果) 返回 False 时只把结果交给当前等待者，不写入缓存"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    self.entries.move_to_end(key)
+                    self.stats["hits"] += 1
+                    return entry[1]
+                self._remove(key)
+
+            waiter = self.in_flight.get(key)
+            if waiter is None:
+                waiter = self.in_flight[key] = Future()
+                is_owner = True
+                self.stats["misses"] += 1
+            else:
+                is_owner = False
+                self.stats["coalesced"] += 1
+
+        if not is_owner:
+            return waiter.result()
+
+        try:
+            value = compute()
+        except BaseException as e:
+            waiter.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                self.in_flight.pop(key, None)
+
+        if cacheable is None or cacheable(value):
+            with self.lock:
+                self._store(key, value, ttl)
+        waiter.set_result(value)
+        return value
+
+    def get_stats(self):
+        with self.lock:
+            return {**self.stats, "entries": len(self.entries), "bytes": self.total_bytes}
+
+@st.cache_resource
+def get_tool_cache():
+    """进程内共享的工具结果缓存 (TOOL_CACHE_MAX_BYTES，默认 32MB)"""
+    return ToolResultCache(config.get_int_setting("TOOL_CACHE_MAX_BYTES", 32 * 1024 * 1024))
+
+# 工具以字符串形式返回的错误 (本项目工具用 ❌ 前缀，第三方工具多为 Error / An error occurred)
+ERROR_PREFIXES = ("❌", "error", "an error occurred")
+
+def is_cacheable_result(value):
+    """错误结果不缓存，下次调用重新执行"""
+    return not str(value).lstrip().lower().startswith(ERROR_PREFIXES)
+
+class CachedTool(BaseTool):
+    """包装任意工具：名称 / 描述 / 参数与原工具一致，结果按 TTL 缓存"""
+    inner: BaseTool
+    ttl: float
+    # user: 按 configurable.user_id 隔离；global: 所有用户共享
+    scope: str = "user"
+    cache: Any = None
+
+    def _scope_value(self, config):
+        if self.scope == "global":
+            return "*"
+        return str((config or {}).get("configurable", {}).get("user_id", ""))
+
+    def _run(self, config: RunnableConfig, run_manager=None, **kwargs):
+        key = make_key(self.name, kwargs, self._scope_value(config))
+        cache = self.cache or get_tool_cache()
+        # 内层工具作为本次调用的子运行上报回调，而不是以父级 callbacks 重复触发一次完整的工具事件
+        inner_config = {**config, "callbacks": run_manager.get_child() if run_manager else None}
+        return cache.get_or_compute(
+            key, self.ttl, lambda: self.inner.invoke(kwargs, config=inner_config), cacheable=is_cacheable_result
+        )
+
+    async def _arun(self, config: RunnableConfig, run_manager=None, **kwargs):
+        # 等待 single-flight 结果会阻塞，放到线程中执行
+        sync_manager = run_manager.get_sync() if run_manager else None
+        return await asyncio.to_thread(self._run, config, sync_manager, **kwargs)
+
+def cached_tool(tool, ttl, scope="user"):
+    """为工具开启结果缓存"""
+    return CachedTool(
+        name=tool.name,
+        description=tool.description,
+        args_schema=tool.args_schema,
+        return_direct=tool.return_direct,
+        inner=tool,
+        ttl=ttl,
+        scope=scope
+    )
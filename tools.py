@@ -1,7 +1,13 @@
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, List, Optional
 import streamlit as st
+from pydantic import PrivateAttr
 from langchain_core.tools import tool
 from langchain_core.runnables import RunnableConfig
+from langchain_core.retrievers import BaseRetriever
 from langchain_core.tools.retriever import create_retriever_tool
 from langchain_community.tools import DuckDuckGoSearchRun
 from langchain_community.agent_toolkits import GmailToolkit
@@ -11,7 +17,13 @@ from langchain_qdrant import QdrantVectorStore
 from qdrant_client import QdrantClient
 from google.oauth2.credentials import Credentials
 
-from image_store import get_image_store
+import config
+import startup_profile
+import image_jobs
+import image_dedup
+from embedding_cache import CachedEmbeddings
+from local_index import LocalVectorIndex, LocalVectorRetriever
+from tool_cache import cached_tool
 
 @tool
 def calculate_bonus(salary: int) -> str:
@@ -19,115 +31,199 @@ def calculate_bonus(salary: int) -> str:
     bonus = salary * 0.2
     return f"【系统计算】根据您的工资，年终奖应为 {bonus} 元。"
 
+def _resolve_thread_id(config):
+    # 优先从 Config 获取 context (Cross-thread safe)
+    thread_id = config.get("configurable", {}).get("thread_id")
+    
+    # Fallback to session_state if config is empty (Main thread dev mode)
+    if not thread_id and "thread_id" in st.session_state:
+        thread_id = st.session_state["thread_id"]
+    return thread_id
+
 @tool
-def generate_illustration(prompt: str, config: RunnableConfig) -> str:
+def generate_illustration(prompt: str, config: RunnableConfig, fresh: bool = False) -> str:
     """当你需要根据用户的描述生成图片、绘画、或者设计草图时，使用这个工具。
-    输入应该是对画面内容的详细英文或中文描述。"""
+    输入应该是对画面内容的详细英文或中文描述。
+    用户明确要求"重新生成"、"换一张"时，将 fresh 设为 true，不复用已有图片。"""
     try:
-        # 延迟导入
-        from google import genai
-        from google.genai import types
-        import base64
-        import os
-        
-        api_key = os.getenv("GOOGLE_API_KEY") or os.getenv("GEMINI_API_KEY")
-        if not api_key:
+        if not image_jobs.get_api_key():
             return "❌ 错误：未找到 GOOGLE_API_KEY，无法生成图片。"
 
-        client = genai.Client(api_key=api_key)
-        
-        try:
-            # 使用 Gemini 2.0 Flash 的多模态生成能力
-            response = client.models.generate_content(
-                model='gemini-2.0-flash-exp',
-                contents=prompt,
-                config=types.GenerateContentConfig(
-                    response_modalities=['Text', 'Image']
-                )
-            )
-            
-            # 从响应中提取图片
-            for part in response.candidates[0].content.parts:
-                if part.inline_data is not None:
-                    img_data = part.inline_data.data
-                    mime_type = part.inline_data.mime_type or 'image/png'
-                    b64_data = base64.b64encode(img_data).decode('utf-8')
-                    
-                    # 优先从 Config 获取 context (Cross-thread safe)
-                    thread_id = config.get("configurable", {}).get("thread_id")
-                    
-                    # Fallback to session_state if config is empty (Main thread dev mode)
-                    if not thread_id and "thread_id" in st.session_state:
-                        thread_id = st.session_state["thread_id"]
-
-                    image_id = None
-                    try:
-                        import auth_service
-                        if thread_id:
-                            image_id = auth_service.save_image_to_db(thread_id, prompt, b64_data, mime_type)
-                            print(f"✅ 图片已存储到数据库 app_images (ID: {image_id}, Thread: {thread_id})")
-                        else:
-                            print(f"⚠️ 无法获取 thread_id，跳过 DB 存储")
-                            
-                    except Exception as db_e:
-                        print(f"❌ 图片入库失败: {db_e}")
-
-                    # 无论是否入库成功，都存一份到内存 Store，用于即时回显
-                    store = get_image_store()
-                    store.add({
-                        'data': b64_data,
-                        'mime_type': mime_type,
-                        'prompt': prompt[:50],
-                        'image_id': image_id
-                    })
-                    
-                    # 返回包含 image_id 的消息，便于精确匹配
-                    if image_id:
-                        return f"✅ 图片已成功生成！[IMAGE_ID:{image_id}]"
-                    else:
-                        return f"✅ 图片已成功生成！（提示词：{prompt[:30]}...）"
-            
-            # 如果没有图片，返回文本响应
-            text_parts = [p.text for p in response.candidates[0].content.parts if hasattr(p, 'text') and p.text]
-            if text_parts:
-                return f"⚠️ 模型返回了文字而非图片：\n{''.join(text_parts)}"
-            
-            return "❌ 生成成功但未返回图片数据。"
-            
-        except Exception as gemini_e:
-            error_msg = str(gemini_e)
-            # 检测是否是计费问题
-            if "billed" in error_msg.lower() or "billing" in error_msg.lower():
-                return "❌ **需要启用 Google Cloud 计费**\n\n您的 API 账户目前是免费层级。图片生成功能需要在 Google AI Studio 或 Google Cloud 中启用计费。"
-            # 检测是否是安全策略问题
-            if "safety" in error_msg.lower() or "blocked" in error_msg.lower():
-                return f"❌ 图片生成被安全策略阻止。请尝试更换描述内容。"
-            return f"❌ 图片生成失败: {gemini_e}"
+        thread_id = _resolve_thread_id(config)
+        if not thread_id:
+            return "❌ 无法获取对话 ID，图片生成任务未提交。"
+
+        # 相同描述的图片已存在时直接复用
+        image_id = image_dedup.reuse_image(thread_id, prompt, image_jobs.IMAGE_MODEL, bypass=fresh)
+        if image_id:
+            return f"✅ 图片已生成。[IMAGE_ID:{image_id}]"
+
+        # 提交后台任务，图片生成完成后由界面自动显示
+        job_id = image_jobs.get_job_queue().enqueue(thread_id, prompt)
+        print(f"🎨 图片任务已提交 (Job: {job_id}, Thread: {thread_id})")
+        return f"✅ 图片生成任务已提交，完成后会自动显示。[IMAGE_JOB:{job_id}]"
             
     except Exception as e:
         return f"❌ 生成图片出错: {str(e)}"
 
-def get_all_tools():
-    """初始化并返回所有可用工具"""
-    
-    # 1. 知识库检索工具
-    embeddings = GoogleGenerativeAIEmbeddings(model="gemini-embedding-001")
-    
+# 单次批量生成的图片数量上限
+MAX_ILLUSTRATIONS_PER_CALL = 4
+
+@tool
+def generate_illustrations(prompts: List[str], config: RunnableConfig, fresh: bool = False) -> str:
+    """当用户一次需要多张不同的图片时，使用这个工具一次性提交，所有图片会并发生成。
+    输入是画面描述列表，每个元素对应一张图片。
+    用户明确要求"重新生成"、"换一张"时，将 fresh 设为 true，不复用已有图片。"""
+    try:
+        if not image_jobs.get_api_key():
+            return "❌ 错误：未找到 GOOGLE_API_KEY，无法生成图片。"
+
+        prompts = [p for p in prompts if p and p.strip()][:MAX_ILLUSTRATIONS_PER_CALL]
+        if not prompts:
+            return "❌ 没有有效的图片描述，图片生成任务未提交。"
+
+        thread_id = _resolve_thread_id(config)
+        if not thread_id:
+            return "❌ 无法获取对话 ID，图片生成任务未提交。"
+
+        # 相同描述的图片已存在时直接复用，其余提交后台任务
+        markers = []
+        to_generate = []
+        for prompt in prompts:
+            image_id = image_dedup.reuse_image(thread_id, prompt, image_jobs.IMAGE_MODEL, bypass=fresh)
+            if image_id:
+                markers.append(f"[IMAGE_ID:{image_id}]")
+            else:
+                to_generate.append(prompt)
+
+        if to_generate:
+            job_ids = image_jobs.get_job_queue().enqueue_many(thread_id, to_generate)
+            print(f"🎨 批量图片任务已提交 (Jobs: {job_ids}, Thread: {thread_id})")
+            markers.extend(f"[IMAGE_JOB:{job_id}]" for job_id in job_ids)
+        return f"✅ {len(prompts)} 张图片的生成任务已提交，完成后会自动显示。{''.join(markers)}"
+
+    except Exception as e:
+        return f"❌ 生成图片出错: {str(e)}"
+
+EMBEDDING_MODEL = "gemini-embedding-001"
+KNOWLEDGE_BASE_COLLECTION = "knowledge_base"
+
+# 工具结果缓存：工具名 -> (TTL 秒, 缓存范围)
+TOOL_CACHE_TTLS = {
+    "search_company_policy": (3600, "global"),
+    "duckduckgo_search": (600, "global"),
+    "get_calendars_info": (300, "user"),
+}
+
+@st.cache_resource
+def get_embeddings():
+    """知识库 Embedding (带内存 + 持久化缓存，进程内共享)"""
+    return CachedEmbeddings(
+        GoogleGenerativeAIEmbeddings(model=EMBEDDING_MODEL),
+        EMBEDDING_MODEL,
+        max_memory_entries=config.get_int_setting("EMBEDDING_CACHE_MEMORY", 1024),
+        max_persistent_entries=config.get_int_setting("EMBEDDING_CACHE_MAX_ROWS", 50000),
+        persistent=config.get_bool_setting("EMBEDDING_CACHE_PERSIST", True)
+    )
+
+def get_qdrant_client():
+    """创建 Qdrant 客户端"""
     # Qdrant 连接配置
     qdrant_url = os.getenv("QDRANT_URL", "http://localhost:6333")
     qdrant_api_key = os.getenv("QDRANT_API_KEY", None)
     
     if qdrant_api_key:
-        client = QdrantClient(url=qdrant_url, api_key=qdrant_api_key)
-    else:
-        client = QdrantClient(url=qdrant_url)
-    
+        return QdrantClient(url=qdrant_url, api_key=qdrant_api_key)
+    return QdrantClient(url=qdrant_url)
+
+def get_policy_retriever(embeddings):
+    """知识库检索器 (VECTOR_BACKEND=qdrant | local)"""
+    if str(config.get_setting("VECTOR_BACKEND", "qdrant")).lower() == "local":
+        # 进程内索引，无需网络访问 Qdrant
+        index = LocalVectorIndex.load()
+        return LocalVectorRetriever(index=index, embeddings=embeddings, k=2)
+
     vectorstore = QdrantVectorStore(
-        client=client,
-        collection_name="knowledge_base",
+        client=get_qdrant_client(),
+        collection_name=KNOWLEDGE_BASE_COLLECTION,
         embedding=embeddings
     )
-    retriever = vectorstore.as_retriever(search_kwargs={"k": 2})
+    return vectorstore.as_retriever(search_kwargs={"k": 2})
+
+class LazyRetriever(BaseRetriever):
+    """首次检索时才初始化后端 (Embedding 客户端 + Qdrant / 本地索引)"""
+    factory: Callable[[], BaseRetriever]
+    _retriever: Optional[BaseRetriever] = PrivateAttr(default=None)
+    _lock: Any = PrivateAttr(default_factory=threading.Lock)
+
+    def ensure_ready(self):
+        if self._retriever is None:
+            with self._lock:
+                if self._retriever is None:
+                    with startup_profile.timed("tool:search_company_policy"):
+                        self._retriever = self.factory()
+        return self._retriever
+
+    def _get_relevant_documents(self, query, *, run_manager=None):
+        return self.ensure_ready().invoke(query)
+
+def _load_calendar_tools():
+    """Calendar 工具 (读取 token.json)"""
+    with startup_profile.timed("tool:calendar"):
+        try:
+            if os.path.exists("token.json"):
+                calendar_creds = Credentials.from_authorized_user_file("token.json")
+                # Debug: 确认 token 包含 calendar 权限 (后台线程中无法写 sidebar)
+                print(f"🔧 Debug: Loaded Scopes: {calendar_creds.scopes}")
+                calendar_toolkit = CalendarToolkit(credentials=calendar_creds)
+                return calendar_toolkit.get_tools()
+            print("Warning: token.json not found, Calendar tools disabled.")
+        except Exception as e:
+            print(f"Error loading Calendar tools: {e}")
+        return []
+
+def _load_gmail_tools():
+    """Gmail 工具"""
+    with startup_profile.timed("tool:gmail"):
+        try:
+            gmail_toolkit = GmailToolkit()
+            return gmail_toolkit.get_tools()
+        except Exception as e:
+            print(f"Error loading Gmail tools: {e}")
+            return []
+
+# Calendar / Gmail 工具包的初始化需要网络握手，进程内只在后台加载一次；
+# 加载完成前构建的 Graph 不包含这些工具，完成后由 web_app 的预热线程用完整工具重建 Graph
+_toolkit_futures = None
+_toolkit_lock = threading.Lock()
+
+def start_toolkit_loading():
+    """启动 (或返回已启动的) Calendar / Gmail 后台加载任务"""
+    global _toolkit_futures
+    if _toolkit_futures is None:
+        with _toolkit_lock:
+            if _toolkit_futures is None:
+                executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="tool-init")
+                _toolkit_futures = [executor.submit(_load_calendar_tools), executor.submit(_load_gmail_tools)]
+                executor.shutdown(wait=False)
+    return _toolkit_futures
+
+def toolkits_loaded():
+    """Calendar / Gmail 是否都已加载完成 (成功或失败)"""
+    return all(future.done() for future in start_toolkit_loading())
+
+def wait_for_toolkits():
+    """阻塞直到 Calendar / Gmail 加载完成 (只应在后台线程中调用)"""
+    for future in start_toolkit_loading():
+        future.exception()
+
+def get_all_tools():
+    """初始化并返回所有可用工具 (Calendar / Gmail 只包含已在后台加载完成的)"""
+    started = time.perf_counter()
+    toolkit_futures = start_toolkit_loading()
+
+    # 1. 知识库检索工具 (后端在第一次检索时才初始化)
+    retriever = LazyRetriever(factory=lambda: get_policy_retriever(get_embeddings()))
     
     retriever_tool = create_retriever_tool(
         retriever,
@@ -136,38 +232,36 @@ def get_all_tools():
     )
 
     # 2. 搜索工具
-    search_tool = DuckDuckGoSearchRun()
+    with startup_profile.timed("tool:duckduckgo_search"):
+        search_tool = DuckDuckGoSearchRun()
 
-    # 3. Calendar 工具
-    try:
-        if os.path.exists("token.json"):
-            calendar_creds = Credentials.from_authorized_user_file("token.json")
-            # Debug: Show scopes in sidebar to verify we have calendar permissions
-            with st.sidebar:
-                st.caption(f"🔧 Debug: Loaded Scopes: {calendar_creds.scopes}")
-            calendar_toolkit = CalendarToolkit(credentials=calendar_creds)
-            calendar_tools = calendar_toolkit.get_tools()
-        else:
-            print("Warning: token.json not found, Calendar tools disabled.")
-            calendar_tools = []
-    except Exception as e:
-        print(f"Error loading Calendar tools: {e}")
-        calendar_tools = []
-
-    # 4. Gmail 工具
-    try:
-        gmail_toolkit = GmailToolkit()
-        gmail_tools = gmail_toolkit.get_tools()
-    except Exception as e:
-        print(f"Error loading Gmail tools: {e}")
-        gmail_tools = []
+    # 3 & 4. Calendar / Gmail 工具：只取已加载完成的，不等待后台加载
+    toolkit_tools = []
+    for future in toolkit_futures:
+        if future.done():
+            toolkit_tools += future.result()
+    if not toolkits_loaded():
+        print("⏳ Calendar / Gmail 工具仍在后台加载，加载完成后重建 Graph")
 
     # 组合所有工具
     tools = [
         retriever_tool, 
         calculate_bonus, 
         search_tool, 
-        generate_illustration
-    ] + calendar_tools + gmail_tools
+        generate_illustration,
+        generate_illustrations
+    ] + toolkit_tools
     
-    return tools
+    startup_profile.record("tools:get_all_tools", time.perf_counter() - started)
+    # 为重复调用频繁的工具开启结果缓存
+    return [apply_tool_cache(t) for t in tools]
+
+def apply_tool_cache(tool):
+    """按 TOOL_CACHE_TTLS 为工具开启缓存 (TOOL_CACHE_TTL_<工具名> 可覆盖，0 表示关闭)"""
+    if tool.name not in TOOL_CACHE_TTLS:
+        return tool
+    default_ttl, scope = TOOL_CACHE_TTLS[tool.name]
+    ttl = config.get_int_setting(f"TOOL_CACHE_TTL_{tool.name.upper()}", default_ttl)
+    if ttl <= 0:
+        return tool
+    return cached_tool(tool, ttl, scope)
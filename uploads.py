@@ -0,0 +1,99 @@
+import base64
+import threading
+from collections import OrderedDict
+import config
+import blob_store
+import image_variants
+from database import get_db_pool
+
+# 📎 用户上传图片
+# 上传时按 UPLOAD_MAX_SIDE 缩放并重新编码 (UPLOAD_IMAGE_FORMAT)，内容存入 blob 存储一次，
+# HumanMessage 中只保存 {"type": "blob_ref", ...} 引用，checkpoint 不再携带图片数据；
+# 调用模型前才把引用解析为 data URI，且只解析最近 UPLOAD_RESOLVE_RECENT 张，
+# 更早的图片以文字占位，避免每轮请求体随附件数量增长
+
+BLOB_REF_TYPE = "blob_ref"
+OMITTED_IMAGE_TEXT = "[用户之前上传的图片，已省略]"
+
+def prepare_upload(data: bytes, mime_type: str):
+    """缩放 / 重新编码上传图片，返回 (图片字节, mime_type)"""
+    max_side = config.get_int_setting("UPLOAD_MAX_SIDE", 1536)
+    max_bytes = config.get_int_setting("UPLOAD_MAX_BYTES", 1024 * 1024)
+    fmt = config.get_setting("UPLOAD_IMAGE_FORMAT", "JPEG")
+    # 尺寸未超限但文件过大时也重新编码
+    variant = image_variants.make_variant(data, max_side, quality=85, fmt=fmt, force=len(data) > max_bytes)
+    if variant and len(variant["bytes"]) < len(data):
+        return variant["bytes"], variant["mime_type"]
+    return data, mime_type
+
+def store_upload(data: bytes, mime_type: str, thread_id) -> dict:
+    """处理并存储上传图片，返回放入消息内容的引用块
+
+    同时在 app_upload_refs 记录 (对话, blob) 引用，孤立 blob 清理据此判断上传图片是否仍被使用
+    """
+    data, mime_type = prepare_upload(data, mime_type)
+    blob_hash = blob_store.put_blob(data)
+    with get_db_pool().connection() as conn:
+        conn.execute(
+            "INSERT INTO app_upload_refs (thread_id, blob_hash) VALUES (%s, %s) ON CONFLICT DO NOTHING",
+            (thread_id, blob_hash)
+        )
+    print(f"📎 上传图片已存储 ({blob_hash[:12]}, {len(data) // 1024} KB)")
+    return {"type": BLOB_REF_TYPE, "blob_hash": blob_hash, "mime_type": mime_type}
+
+class _DataUriCache:
+    """blob_hash -> data URI (LRU，按字节数限制)"""
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, blob_hash, mime_type):
+        with self.lock:
+            uri = self.entries.get(blob_hash)
+            if uri is not None:
+                self.entries.move_to_end(blob_hash)
+                return uri
+        data = blob_store.get_blob(blob_hash)
+        if data is None:
+            return None
+        uri = f"data:{mime_type};base64,{base64.b64encode(data).decode('utf-8')}"
+        with self.lock:
+            if blob_hash not in self.entries:
+                self.entries[blob_hash] = uri
+                self.size += len(uri)
+            while self.size > self.max_bytes and len(self.entries) > 1:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+        return uri
+
+_uri_cache = _DataUriCache(config.get_int_setting("UPLOAD_URI_CACHE_BYTES", 32 * 1024 * 1024))
+
+def _has_ref(msg):
+    return isinstance(msg.content, list) and any(
+        isinstance(part, dict) and part.get("type") == BLOB_REF_TYPE for part in msg.content
+    )
+
+def resolve_references(messages):
+    """把消息中的 blob 引用解析为模型可读的 image_url (只在构建模型请求时调用)"""
+    keep = config.get_int_setting("UPLOAD_RESOLVE_RECENT", 3)
+    resolved = list(messages)
+    remaining = keep
+    for i in range(len(resolved) - 1, -1, -1):
+        msg = resolved[i]
+        if not _has_ref(msg):
+            continue
+        content = []
+        for part in msg.content:
+            if not (isinstance(part, dict) and part.get("type") == BLOB_REF_TYPE):
+                content.append(part)
+                continue
+            uri = _uri_cache.get(part["blob_hash"], part.get("mime_type", "image/jpeg")) if remaining > 0 else None
+            if uri is None:
+                content.append({"type": "text", "text": OMITTED_IMAGE_TEXT})
+            else:
+                content.append({"type": "image_url", "image_url": {"url": uri}})
+                remaining -= 1
+        resolved[i] = msg.model_copy(update={"content": content})
+    return resolved
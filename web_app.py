@@ -4,16 +4,31 @@ import streamlit as st
 if not hasattr(st, "cache"):
     st.cache = st.cache_resource
 
-import base64
+import time
+_import_started = time.perf_counter()
+
 import datetime
-from langchain_core.messages import HumanMessage, AIMessage, ToolMessage
+import threading
+import uuid
+from collections import OrderedDict
+from langchain_core.messages import HumanMessage, AIMessage, AIMessageChunk, ToolMessage
 from streamlit_cookies_manager import EncryptedCookieManager
 
 # 导入自定义模块
 import config
-import database
-from agent import get_graph
-from image_store import get_image_store
+import migrations
+import image_variants
+import image_jobs
+import uploads
+import metrics
+import checkpoint_gc
+import history_cache
+from agent import get_graph, get_async_graph
+from async_runner import get_async_runner
+import tools
+import startup_profile
+
+startup_profile.record_once("import:web_app", time.perf_counter() - _import_started)
 
 # ==========================================
 # 0. 初始化配置 & 数据库
@@ -22,9 +37,9 @@ from image_store import get_image_store
 config.init_environment()
 st.set_page_config(page_title="幻影科技 AI 助手", page_icon="🤖", layout="wide")
 
-# 初始化表结构 (Safe to run multiple times)
+# 执行数据库迁移 (每个进程只执行一次，后续 rerun 直接跳过)
 try:
-    database.init_db_schema()
+    migrations.ensure_schema()
 except Exception as e:
     print(f"DB Init Warning: {e}")
 
@@ -87,17 +102,86 @@ if "tool_calls" not in st.session_state:
 if "uploaded_image" not in st.session_state:
     st.session_state["uploaded_image"] = None
 
+# 侧边栏已加载的对话列表页数
+if "thread_pages" not in st.session_state:
+    st.session_state["thread_pages"] = 1
+
+# 侧边栏每页对话数
+THREAD_PAGE_SIZE = config.get_int_setting("THREAD_PAGE_SIZE", 30)
+
+# 异步模式：Graph 运行在共享事件循环中 (AsyncPostgresSaver + AsyncConnectionPool)
+USE_ASYNC_GRAPH = config.get_bool_setting("ASYNC_GRAPH")
+
 @st.cache_resource
-def get_cached_graph():
+def get_cached_graph(use_async=False, with_toolkits=False):
+    """with_toolkits 只作为缓存键：Calendar / Gmail 加载完成后换用新构建的 Graph"""
+    if use_async:
+        return get_async_graph()
     return get_graph()
 
-graph = get_cached_graph()
-image_store = get_image_store() # Memory fallback
+def get_current_graph(use_async=False):
+    """当前可用的 Graph (Calendar / Gmail 仍在后台加载时不包含这些工具)"""
+    return get_cached_graph(use_async, tools.toolkits_loaded())
+
+def _warm_up_graph(use_async):
+    # 先用已就绪的工具构建 Graph，Calendar / Gmail 加载完成后再用完整工具重建
+    get_current_graph(use_async)
+    if not tools.toolkits_loaded():
+        tools.wait_for_toolkits()
+        get_cached_graph(use_async, True)
+        print("✅ Calendar / Gmail 工具已加载，Graph 已重建")
+
+@st.cache_resource
+def start_graph_warmup(use_async=False):
+    """后台预热 Graph (工具 / 模型 / checkpointer)，登录页无需等待"""
+    warmup = threading.Thread(target=_warm_up_graph, args=(use_async,), name="graph-warmup", daemon=True)
+    warmup.start()
+    return warmup
+
+# Graph 在登录后才真正需要，首次访问时在后台构建
+graph = None
+start_graph_warmup(USE_ASYNC_GRAPH)
+checkpoint_gc.start_compaction_worker()
+
+@st.cache_resource
+def start_metrics():
+    """注册组件状态采集并启动指标导出 (METRICS_PORT / METRICS_FILE)"""
+    from database import get_db_pool
+    from tool_cache import get_tool_cache
+    import image_dedup
+    metrics.register_collector("db_pool", lambda: get_db_pool().get_stats())
+    metrics.register_collector("image_jobs", lambda: image_jobs.get_job_queue().get_metrics())
+    metrics.register_collector("image_dedup", image_dedup.get_stats)
+    metrics.register_collector("tool_cache", lambda: get_tool_cache().get_stats())
+    return metrics.start_exporter()
+
+start_metrics()
+
+# 图片内容缓存的字节上限 (按需加载的图片字节，需能容纳一个完整恢复的长对话)
+IMAGE_CACHE_BYTES = config.get_int_setting("IMAGE_CACHE_BYTES", 128 * 1024 * 1024)
+# 最近多少条消息中的图片显示中图，更早的消息只显示缩略图
+IMAGE_MEDIUM_RECENT = config.get_int_setting("IMAGE_MEDIUM_RECENT", 6)
+# 后台图片任务的轮询间隔 (秒)
+IMAGE_JOB_POLL_SECONDS = config.get_int_setting("IMAGE_JOB_POLL_SECONDS", 2)
 
 # ==========================================
 # 2. 认证逻辑 (UI)
 # ==========================================
 
+# 部署在可信反向代理之后时才开启：否则客户端可以伪造 X-Forwarded-For 绕过按 IP 的登录限流
+TRUST_PROXY_HEADERS = config.get_bool_setting("TRUST_PROXY_HEADERS", False)
+
+def get_client_ip():
+    """获取客户端 IP (TRUST_PROXY_HEADERS 开启时优先反向代理的 X-Forwarded-For)"""
+    try:
+        if TRUST_PROXY_HEADERS:
+            forwarded = st.context.headers.get("X-Forwarded-For")
+            if forwarded:
+                return forwarded.split(",")[0].strip()
+        return getattr(st.context, "ip_address", None)
+    except Exception:
+        return None
+
 def login_page():
     st.title("🔐 登录 / 注册")
     
@@ -113,7 +197,7 @@ def login_page():
                     st.error("请输入用户名和密码")
                 else:
                     import auth_service
-                    uid, msg = auth_service.login_user(username, password)
+                    uid, msg = auth_service.login_user(username, password, get_client_ip())
                     if uid:
                         st.session_state["user_id"] = uid
                         st.session_state["username"] = username
@@ -140,7 +224,7 @@ def login_page():
                     st.error("请输入用户名和密码")
                 else:
                     import auth_service
-                    uid, msg = auth_service.register_user(new_user, new_pass)
+                    uid, msg = auth_service.register_user(new_user, new_pass, get_client_ip())
                     if uid:
                         st.success(f"注册成功！请切换到登录标签页进行登录。")
                     else:
@@ -179,7 +263,7 @@ def show_chat_interface():
             
         # 历史列表
         import auth_service
-        threads = auth_service.get_user_threads(st.session_state["user_id"])
+        threads, has_more = load_thread_pages(st.session_state["user_id"], st.session_state["thread_pages"])
         if threads:
             for tid, title, updated_at in threads:
                 tid_str = str(tid)
@@ -217,16 +301,24 @@ def show_chat_interface():
                                 st.session_state["messages"] = []  # 清空消息
                                 st.query_params.clear()
                             st.rerun()
+            if has_more and st.button("⬇️ 加载更多", use_container_width=True):
+                st.session_state["thread_pages"] += 1
+                st.rerun()
         else:
             st.caption("暂无历史记录")
 
+        st.divider()
+        # 本轮耗时明细 (节点 / 工具 / LLM)
+        if st.toggle("⏱️ 显示本轮耗时", key="show_turn_timings"):
+            render_turn_timings(st.session_state.get("last_turn_timings"))
+
         st.divider()
         # 图片上传 & 工具追踪 (Keep existing sidebar features)
         st.header("🖼️ 图片上传")
         uploaded_file = st.file_uploader("选择图片", type=["jpg", "png", "webp"])
         if uploaded_file:
             st.session_state["uploaded_image"] = uploaded_file
-            st.image(uploaded_file, caption="待发送", use_container_width=True)
+            st.image(make_thumbnail(uploaded_file.getvalue()), caption="待发送", use_container_width=True)
             if st.button("❌ 取消"):
                 st.session_state["uploaded_image"] = None
                 st.rerun()
@@ -251,7 +343,8 @@ def show_chat_interface():
         restore_history(current_thread_id)
 
     # 渲染消息
-    for msg in st.session_state["messages"]:
+    medium_from = len(st.session_state["messages"]) - IMAGE_MEDIUM_RECENT
+    for msg_index, msg in enumerate(st.session_state["messages"]):
         if msg["role"] == "user":
             st.chat_message("user").write(msg["content"])
         else:
@@ -259,109 +352,80 @@ def show_chat_interface():
                 st.write(msg["content"])
                 if "images" in msg and msg["images"]:
                     for img in msg["images"]:
-                        try:
-                            # 兼容 base64 数据
-                            if "data" in img: # From memory or DB struct
-                                image_data = base64.b64decode(img['data'])
-                                st.image(image_data, caption=img.get('prompt', ''), use_container_width=True)
-                        except Exception as e:
-                            st.warning(f"无法显示图片: {e}")
+                        render_image(img, key=str(msg_index), variant="medium" if msg_index >= medium_from else "thumb")
 
     # 输入处理
     if user_input := st.chat_input("请输入问题..."):
         # 1. UI 立即显示
         st.chat_message("user").write(user_input)
         if st.session_state.get("uploaded_image"):
-            st.chat_message("user").image(st.session_state["uploaded_image"], width=300)
+            st.chat_message("user").image(make_thumbnail(st.session_state["uploaded_image"].getvalue()), width=300)
         
         st.session_state["messages"].append({"role": "user", "content": user_input})
         
         # 2. 调用 Agent
-        config_dict = {"configurable": {"thread_id": current_thread_id}}
+        # turn_id 用于关联本轮的路由日志等记录
+        turn_id = str(uuid.uuid4())
+        # 记录本轮各节点 / 工具 / LLM 的耗时
+        turn_metrics = metrics.TurnMetrics()
+        config_dict = {
+            "configurable": {"thread_id": current_thread_id, "user_id": st.session_state["user_id"], "turn_id": turn_id},
+            "callbacks": [turn_metrics],
+        }
         
         # 预先初始化结果变量
         final_response_text = "⚠️ 暂时无法获取回复，请稍后再试。"
         final_images = []
         
-        try:
-            with st.spinner("思考中..."):
+        with st.chat_message("assistant"):
+            # 工具进度在上，流式文本在下
+            status_area = st.container()
+            text_placeholder = st.empty()
+            text_placeholder.markdown("思考中...")
+            
+            try:
                 # 构建输入
                 message_content = [{"type": "text", "text": user_input}]
                 
                 # 处理图片
                 if st.session_state.get("uploaded_image"):
                     try:
-                        img_bytes = st.session_state["uploaded_image"].getvalue()
-                        b64_img = base64.b64encode(img_bytes).decode("utf-8")
-                        message_content.append({
-                            "type": "image_url",
-                            "image_url": {"url": f"data:{st.session_state['uploaded_image'].type};base64,{b64_img}"}
-                        })
+                        uploaded = st.session_state["uploaded_image"]
+                        # 图片存入 blob 存储，消息中只保存引用
+                        message_content.append(uploads.store_upload(uploaded.getvalue(), uploaded.type, current_thread_id))
                     except Exception as e:
                         print(f"Error processing upload: {e}")
                 
-                # Invoke Graph
-                response = graph.invoke({"messages": [HumanMessage(content=message_content)]}, config=config_dict)
+                # 流式运行 Graph
+                streamed_text, tool_outputs = stream_agent_turn(
+                    {"messages": [HumanMessage(content=message_content)]},
+                    config_dict,
+                    text_placeholder,
+                    status_area
+                )
                 st.session_state["uploaded_image"] = None # Clear upload after sending
-
-                # 解析结果
-                if response and "messages" in response:
-                    ai_msg = response["messages"][-1]
-                    content = ai_msg.content
-                    # Handle list content (common in multimodal models)
-                    if isinstance(content, list):
-                        texts = [p if isinstance(p, str) else p.get("text", "") for p in content]
-                        final_response_text = "\n".join(texts)
-                    else:
-                        final_response_text = str(content)
                 
-                # 尝试获取新生成的图片
-                # 优先方案：从消息中提取 IMAGE_ID
-                import re
-                image_id_match = re.search(r'\[IMAGE_ID:(\d+)\]', final_response_text)
+                if streamed_text:
+                    final_response_text = streamed_text
                 
-                if image_id_match:
-                    image_id = int(image_id_match.group(1))
-                    import auth_service
-                    img = auth_service.get_image_by_id(image_id)
-                    if img:
-                        final_images = [img]
-                        # 从显示文本中移除 IMAGE_ID 标记
-                        final_response_text = re.sub(r'\[IMAGE_ID:\d+\]', '图片已生成。', final_response_text)
-                        print(f"✅ 通过 IMAGE_ID:{image_id} 精确获取图片")
-                else:
-                    # 备选方案：从内存获取
-                    current_generated_imgs = image_store.get_and_clear()
-                    print(f"🖼️ 内存图片: {len(current_generated_imgs)} 张")
-                    
-                    if current_generated_imgs:
-                        final_images = current_generated_imgs
-                    else:
-                        # Fallback: 如果内存没拿到，去 DB 查最近的
-                        response_text_lower = str(final_response_text).lower()
-                        image_keywords = ["图片", "生成", "绘制", "画", "generated", "image", "✅", "成功"]
+                # 尝试获取新生成的图片
+                final_response_text, final_images = collect_turn_images(
+                    final_response_text, tool_outputs
+                )
                         
-                        if any(kw.lower() in response_text_lower for kw in image_keywords):
-                            import auth_service
-                            recent_db_imgs = auth_service.get_recent_images(current_thread_id, limit=5)
-                            if recent_db_imgs:
-                                final_images = recent_db_imgs
-                                print(f"✅ 从 DB 成功捞取 {len(final_images)} 张最近图片")
-                    
-        except Exception as e:
-            final_response_text = f"❌ 系统错误: {str(e)}"
-            print(f"Agent Invoke Error: {e}")
+            except Exception as e:
+                final_response_text = f"❌ 系统错误: {str(e)}"
+                print(f"Agent Invoke Error: {e}")
 
-        # 3. 渲染回复 (无论成功与否)
-        with st.chat_message("assistant"):
-            st.markdown(final_response_text)
+            timings = turn_metrics.breakdown()
+            metrics.observe("turn_seconds", timings["total"])
+            st.session_state["last_turn_timings"] = timings
+
+            # 3. 渲染最终回复 (无论成功与否)
+            text_placeholder.markdown(final_response_text)
             if final_images:
                 for img in final_images:
-                    try:
-                        data = base64.b64decode(img['data'])
-                        st.image(data, caption=img.get('prompt'), use_container_width=True)
-                    except:
-                        pass
+                    render_image(img, key="live")
         
         # 4. 存入历史 (仅当有内容时)
         if final_response_text.strip() or final_images:
@@ -371,80 +435,236 @@ def show_chat_interface():
                 "images": final_images
             })
 
-def restore_history(thread_id):
-    """从 LangGraph State 和 DB 恢复历史"""
+TIMING_KIND_LABELS = {"node": "节点", "tool": "工具", "llm": "LLM", "summary": "摘要"}
+
+def render_turn_timings(timings):
+    """侧边栏显示上一轮的耗时明细"""
+    if not timings:
+        st.caption("发送消息后显示耗时明细")
+        return
+    st.caption(f"上一轮总耗时 {timings['total']:.2f} 秒")
+    rows = []
+    for entry in timings["entries"]:
+        label = f"{TIMING_KIND_LABELS.get(entry['kind'], entry['kind'])} · {entry['name']}"
+        if entry["kind"] in ("llm", "summary"):
+            label += f" ({entry.get('input_tokens', 0)} → {entry.get('output_tokens', 0)} tokens)"
+        if entry["error"]:
+            label += " ❌"
+        rows.append({"步骤": label, "耗时 (ms)": round(entry["seconds"] * 1000, 1)})
+    st.dataframe(rows, hide_index=True, use_container_width=True)
+
+def load_thread_pages(user_id, pages):
+    """按 keyset 分页加载前 pages 页对话，返回 (对话列表, 是否还有更多)"""
+    import auth_service
+    threads, before = [], None
+    for _ in range(pages):
+        # 多取一条用于判断是否还有下一页
+        rows = auth_service.get_user_threads(user_id, limit=THREAD_PAGE_SIZE + 1, before=before)
+        threads.extend(rows[:THREAD_PAGE_SIZE])
+        if len(rows) <= THREAD_PAGE_SIZE:
+            return threads, False
+        last_tid, _title, last_updated_at = rows[THREAD_PAGE_SIZE - 1]
+        before = (last_updated_at, last_tid)
+    return threads, True
+
+class ImageBytesCache:
+    """(image_id, variant) -> 图片字节 (LRU，按总字节数限制，线程安全)"""
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, load):
+        with self.lock:
+            data = self.entries.get(key)
+            if data is not None:
+                self.entries.move_to_end(key)
+                return data
+        data = load()
+        if data is None or len(data) > self.max_bytes:
+            return data
+        with self.lock:
+            if key not in self.entries:
+                self.entries[key] = data
+                self.size += len(data)
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+        return data
+
+@st.cache_resource
+def get_image_bytes_cache():
+    """进程内共享的图片内容缓存 (IMAGE_CACHE_BYTES，默认 128MB)"""
+    return ImageBytesCache(IMAGE_CACHE_BYTES)
+
+def load_image_bytes(image_id, variant=None):
+    """按需加载图片内容 (进程内按字节数限制的缓存，跨会话共享)"""
+    import auth_service
+    return get_image_bytes_cache().get((image_id, variant), lambda: auth_service.get_image_bytes(image_id, variant))
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def make_thumbnail(data):
+    """为未入库的图片 (如待发送的上传) 生成缩略图"""
+    variant = image_variants.make_variant(data, image_variants.VARIANT_SIZES["thumb"])
+    return variant["bytes"] if variant else data
+
+def render_image(img, key="", variant="medium"):
+    """渲染单张图片：默认显示 variant (中图 / 较早消息的缩略图)，用户展开时才加载原图"""
+    if img.get("job_id") and not img.get("id"):
+        render_image_job(img["job_id"], key)
+        return
     try:
-        config = {"configurable": {"thread_id": thread_id}}
-        current_state = graph.get_state(config)
-        restored_msgs = []
-        
-        # 1. 获取文本历史
-        if current_state and current_state.values and "messages" in current_state.values:
-            from langchain_core.messages import HumanMessage, ToolMessage, SystemMessage, AIMessage
-            import re
-            
-            raw_msgs = current_state.values["messages"]
-            
-            # 2. 获取该 Thread 所有图片历史，建立 ID -> 图片 映射
-            import auth_service
-            db_images = auth_service.get_images_for_thread(thread_id)
-            image_by_id = {img["id"]: img for img in db_images if "id" in img}
-            
-            temp_msgs = []
-            pending_images = []  # 从 ToolMessage 提取的待附加图片
-            
-            for msg in raw_msgs:
-                if isinstance(msg, SystemMessage): 
-                    continue
-                
-                # 处理 ToolMessage：提取 IMAGE_ID
-                if isinstance(msg, ToolMessage):
-                    content = str(msg.content)
-                    image_id_matches = re.findall(r'\[IMAGE_ID:(\d+)\]', content)
-                    for id_str in image_id_matches:
-                        img_id = int(id_str)
-                        if img_id in image_by_id:
-                            pending_images.append(image_by_id[img_id])
-                            print(f"📎 从 ToolMessage 提取图片 ID: {img_id}")
-                    continue  # 不显示 ToolMessage 本身
-                
-                role = "user" if isinstance(msg, HumanMessage) else "assistant"
-                content = msg.content
-                if isinstance(content, list):
-                    text_parts = [item["text"] for item in content if isinstance(item, dict) and "text" in item]
-                    content = "\n".join(text_parts)
-                
-                content_str = str(content)
-                
-                # 跳过空内容的 Assistant 消息
-                if role == "assistant" and not content_str.strip():
+        data = img.get("bytes")
+        if data is None and img.get("id"):
+            show_full = st.toggle("🔍 查看原图", key=f"full_{img['id']}_{key}")
+            data = load_image_bytes(img["id"], None if show_full else variant)
+            if not show_full and variant == "thumb":
+                # 缩略图按原始尺寸显示，不拉伸到容器宽度
+                if data:
+                    st.image(data, caption=img.get('prompt', ''), width=image_variants.VARIANT_SIZES["thumb"])
+                return
+        if data:
+            st.image(data, caption=img.get('prompt', ''), use_container_width=True)
+    except Exception as e:
+        st.warning(f"无法显示图片: {e}")
+
+def render_image_job(job_id, key=""):
+    """渲染后台任务生成的图片：未完成时局部轮询，完成后显示图片"""
+    job = image_jobs.get_job(job_id)
+    if job is None:
+        st.warning("⚠️ 图片任务不存在")
+    elif job["status"] == "done" and job["image_id"]:
+        render_image({"id": job["image_id"], "prompt": job["prompt"][:50]}, key)
+    elif job["status"] == "failed":
+        st.warning(job["error"] or "❌ 图片生成失败")
+    else:
+        poll_image_job(job_id)
+
+@st.fragment(run_every=IMAGE_JOB_POLL_SECONDS)
+def poll_image_job(job_id):
+    """只重跑这一小块，直到任务结束后再整页刷新显示图片"""
+    job = image_jobs.get_job(job_id)
+    if job and job["status"] in ("queued", "running"):
+        st.info("🎨 图片生成中，完成后会自动显示...")
+    else:
+        st.rerun()
+
+def content_to_text(content, sep="\n"):
+    """将消息 content (字符串或多模态列表) 转为纯文本"""
+    if isinstance(content, list):
+        texts = [p if isinstance(p, str) else p.get("text", "") for p in content]
+        return sep.join(texts)
+    return str(content)
+
+def iter_graph_stream(inputs, config_dict, stream_mode):
+    """按当前模式 (同步 / 异步) 流式运行 Graph"""
+    if USE_ASYNC_GRAPH:
+        return get_async_runner().iterate(graph.astream(inputs, config=config_dict, stream_mode=stream_mode))
+    return graph.stream(inputs, config=config_dict, stream_mode=stream_mode)
+
+def get_thread_state(config_dict):
+    """读取对话的最新 State"""
+    if USE_ASYNC_GRAPH:
+        return get_async_runner().run(graph.aget_state(config_dict))
+    return graph.get_state(config_dict)
+
+def stream_agent_turn(inputs, config_dict, text_placeholder, status_area):
+    """流式运行 Agent：实时渲染 token 与工具进度
+
+    返回 (最后一条 AI 回复文本, 本轮所有 ToolMessage 文本)
+    """
+    final_text = ""
+    tool_outputs = []
+    streamed_text = ""
+    current_step = None
+    current_message_id = None
+    status = None
+
+    # messages: LLM token 增量；updates: 每个节点执行完后的状态更新
+    for mode, chunk in iter_graph_stream(inputs, config_dict, ["messages", "updates"]):
+        if mode == "messages":
+            msg_chunk, metadata = chunk
+            if metadata.get("langgraph_node") != "chatbot" or not isinstance(msg_chunk, AIMessageChunk):
+                continue
+            # 上下文摘要等标记为 nostream 的调用不显示
+            if "nostream" in (metadata.get("tags") or []):
+                continue
+            # 工具调用之后会再次进入 chatbot 节点，此时重新累积文本；
+            # 同一步内快速模型失败升级到 pro 模型时，消息 id 会变化，同样重新累积
+            if metadata.get("langgraph_step") != current_step or msg_chunk.id != current_message_id:
+                current_step = metadata.get("langgraph_step")
+                current_message_id = msg_chunk.id
+                streamed_text = ""
+            streamed_text += content_to_text(msg_chunk.content, sep="")
+            if streamed_text.strip():
+                text_placeholder.markdown(streamed_text + "▌")
+
+        elif mode == "updates":
+            for node, update in chunk.items():
+                if not isinstance(update, dict):
                     continue
-                
-                # 也尝试从 AI 消息中提取 IMAGE_ID（某些情况下 AI 会复述）
-                images = []
-                if role == "assistant":
-                    image_id_matches = re.findall(r'\[IMAGE_ID:(\d+)\]', content_str)
-                    for id_str in image_id_matches:
-                        img_id = int(id_str)
-                        if img_id in image_by_id:
-                            images.append(image_by_id[img_id])
-                            content_str = re.sub(r'\[IMAGE_ID:\d+\]', '图片已生成。', content_str)
-                    
-                    # 附加从 ToolMessage 提取的待处理图片
-                    if pending_images:
-                        images.extend(pending_images)
-                        pending_images = []  # 清空
-                
-                msg_obj = {
-                    "role": role,
-                    "content": content_str,
-                    "images": images
-                }
-                temp_msgs.append(msg_obj)
+                for msg in update.get("messages", []):
+                    if node == "chatbot" and isinstance(msg, AIMessage):
+                        final_text = content_to_text(msg.content)
+                        for tool_call in msg.tool_calls or []:
+                            if status is None:
+                                with status_area:
+                                    status = st.status("🔧 正在调用工具...", expanded=False)
+                            status.update(label=f"🔧 正在调用: {tool_call['name']}", state="running")
+                            status.write(f"▶️ 开始 `{tool_call['name']}`")
+                    elif node == "tools" and isinstance(msg, ToolMessage):
+                        tool_outputs.append(str(msg.content))
+                        if status is not None:
+                            status.write(f"✅ 完成 `{msg.name}`")
+
+    if status is not None:
+        status.update(label="✅ 工具调用完成", state="complete")
+    return final_text, tool_outputs
+
+def collect_turn_images(final_response_text, tool_outputs):
+    """收集本轮生成的图片，返回 (处理后的回复文本, 图片列表)"""
+    import re
+    import auth_service
+    final_images = []
+
+    # 优先方案：从 ToolMessage / AI 回复中提取 IMAGE_ID
+    id_strs = []
+    job_strs = []
+    for text in tool_outputs + [final_response_text]:
+        id_strs.extend(re.findall(r'\[IMAGE_ID:(\d+)\]', text))
+        job_strs.extend(re.findall(r'\[IMAGE_JOB:(\d+)\]', text))
+    final_response_text = re.sub(r'\[IMAGE_JOB:\d+\]', '', final_response_text)
+    
+    if job_strs:
+        # 后台生成的图片：先放任务占位，渲染时查询进度
+        final_images = [{"job_id": int(job_str)} for job_str in dict.fromkeys(job_strs)]
+    if id_strs:
+        for id_str in dict.fromkeys(id_strs):
+            img = auth_service.get_image_meta(int(id_str))
+            if img:
+                final_images.append(img)
+                print(f"✅ 通过 IMAGE_ID:{id_str} 精确获取图片")
+        # 从显示文本中移除 IMAGE_ID 标记
+        final_response_text = re.sub(r'\[IMAGE_ID:\d+\]', '图片已生成。', final_response_text)
+
+    return final_response_text, final_images
 
-            restored_msgs = temp_msgs
-            st.session_state["messages"] = restored_msgs
-            print(f"✅ 成功恢复 {len(restored_msgs)} 条消息，{len(db_images)} 张图片")
+def restore_history(thread_id):
+    """从 LangGraph State 和 DB 恢复历史 (优先使用已渲染历史缓存)"""
+    try:
+        import auth_service
+        config = {"configurable": {"thread_id": thread_id}}
+        with metrics.timed("restore_history_seconds", phase="total"):
+            display = history_cache.get_display_messages(
+                thread_id,
+                lambda: get_thread_state(config),
+                # 只取元数据，图片内容在渲染时按需加载
+                auth_service.get_image_meta_by_ids
+            )
+        # 复制一份，避免会话追加消息时改动共享缓存
+        st.session_state["messages"] = list(display)
+        print(f"✅ 成功恢复 {len(display)} 条消息")
 
     except Exception as e:
         print(f"Restore Error: {e}")
@@ -456,6 +676,8 @@ def restore_history(thread_id):
 # ==========================================
 
 if st.session_state["user_id"]:
+    # 预热未完成时在这里等待 (同一个缓存 key，不会重复构建)
+    graph = get_current_graph(USE_ASYNC_GRAPH)
     show_chat_interface()
 else:
     login_page()